@@ -0,0 +1,57 @@
+"""
+Measures how long the simulation core takes to import in a fresh interpreter, and checks that it doesn't pull in Qt.
+Exits with a non-zero status if any core module imports PySide6, so it can be used as a check in CI.
+
+    python benchmarks/import_time.py [-n REPEATS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Every module of the project but the interface, which is the only part that needs Qt
+CORE_MODULES = sorted(f"project.{name[:-3]}" for name in os.listdir(os.path.join(ROOT, "project"))
+                      if name.endswith(".py") and name != "__init__.py")
+
+# Run in a fresh interpreter for every measurement, so that nothing is already imported
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "qt": sorted(name for name in sys.modules if name.startswith("PySide6"))}}))
+"""
+
+
+def measure(module: str) -> tuple[float, list[str]]:
+    output = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout
+    result = json.loads(output)
+    return result["seconds"], result["qt"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeats", type=int, default=5, help="Fresh imports per module (default: 5)")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'Module':<24} {'Median (ms)':>12} {'Min (ms)':>10}  Qt")
+    for module in CORE_MODULES:
+        times, qt = [], []
+        for _ in range(args.repeats):
+            seconds, qt = measure(module)
+            times.append(seconds * 1000)
+        print(f"{module:<24} {statistics.median(times):>12.1f} {min(times):>10.1f}  {', '.join(qt) or '-'}")
+        failed |= bool(qt)
+
+    if failed:
+        print("Some core modules import PySide6, they should only need NumPy", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
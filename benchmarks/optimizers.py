@@ -0,0 +1,83 @@
+"""
+Compares the optimizers at training agents through the map sizes: for every optimizer and seed, trains a population
+with the adaptive curriculum and reports the generation and the wall-clock time at which each map size is first
+mastered. Runs that don't clear a size within the generation limit are reported as '-'.
+
+    python benchmarks/optimizers.py [-o OPTIMIZERS...] [-s SEEDS...] [-r MIN MAX] [-g GENERATIONS] [--json PATH]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project.environment import Environment
+from project.optimizers import OPTIMIZERS
+
+
+def train(optimizer: str, seed: int, size_range: tuple[int, int], max_generations: int) -> dict[int, tuple]:
+    # Map size to the (generation, seconds) at which it was first mastered
+    env = Environment(seed=seed)
+    env.autosave = False
+    env.configure({"optimizer": optimizer, "curriculum": "adaptive", "map_size_range": size_range})
+
+    cleared = {}
+    start = time.perf_counter()
+    generation = env.generation
+    while env.generation < max_generations and len(cleared) < size_range[1] - size_range[0] + 1:
+        env.tick()
+        if env.generation == generation:
+            continue
+
+        generation = env.generation
+        for size in range(size_range[0], size_range[1] + 1):
+            if size not in cleared and (env.curriculum.is_mastered(size) or env.completed_cycles):
+                cleared[size] = (generation, time.perf_counter() - start)
+    return cleared
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--optimizers", nargs="+", default=list(OPTIMIZERS), choices=list(OPTIMIZERS))
+    parser.add_argument("-s", "--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("-r", "--range", type=int, nargs=2, default=[3, 7], metavar=("MIN", "MAX"),
+                        help="Map sizes to train through")
+    parser.add_argument("-g", "--generations", type=int, default=300, help="Generation limit per run")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    sizes = range(args.range[0], args.range[1] + 1)
+    results = {}
+    print(f"{'Optimizer':<10} {'Seed':>4} " + " ".join(f"{f'size {size}':>14}" for size in sizes))
+    for optimizer in args.optimizers:
+        for seed in args.seeds:
+            cleared = train(optimizer, seed, tuple(args.range), args.generations)
+            results.setdefault(optimizer, {})[seed] = {str(size): cleared.get(size) for size in sizes}
+            cells = (f"{cleared[size][0]:>5} {cleared[size][1]:>7.1f}s" if size in cleared else f"{'-':>14}"
+                     for size in sizes)
+            print(f"{optimizer:<10} {seed:>4} " + " ".join(cells), flush=True)
+
+    # Medians over the seeds that cleared each size
+    print()
+    print(f"{'Median':<15} " + " ".join(f"{f'size {size}':>14}" for size in sizes))
+    for optimizer, runs in results.items():
+        cells = []
+        for size in sizes:
+            times = [run[str(size)] for run in runs.values() if run[str(size)]]
+            if times:
+                generations, seconds = zip(*times)
+                cells.append(f"{statistics.median(generations):>5g} {statistics.median(seconds):>7.1f}s")
+            else:
+                cells.append(f"{'-':>14}")
+        print(f"{optimizer:<15} " + " ".join(cells))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
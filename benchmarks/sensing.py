@@ -0,0 +1,75 @@
+"""
+Compares the sensing backends on maps of a few sizes: how far the distance field's sensor distances and collisions are
+from the exact ones at each resolution, and how long each backend takes to sense for a whole population at once.
+
+    python benchmarks/sensing.py [-s SIZES...] [-r RESOLUTIONS...] [-p POPULATION]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import enums
+from project.map_gen import MapGenerator
+from project.models import Vehicle
+from project.sensing import DistanceFieldSensing, ExactSensing, SensingBackend, compare_backends
+
+
+def time_backend(backend: SensingBackend, mapgen: MapGenerator, population: int, repeats: int = 20) -> float:
+    # Milliseconds to sense for a population of vehicles at random poses along the path, as one batched query
+    rng = np.random.default_rng(0)
+    layout = mapgen.layout()
+    tiles = layout.path[rng.integers(len(layout.path), size=population), :2]
+    vehicle = Vehicle(0, 0, enums.VEHICLE_SIZE, enums.VEHICLE_SIZE, 0)
+    rays, borders = [], []
+    for (x, y), theta in zip(((tiles + 0.5) * layout.tile_size).tolist(), rng.uniform(0, 2 * math.pi, population)):
+        vehicle.set_pose(x, y, theta)
+        rays.append(vehicle.sensor_rays().copy())
+        borders.append(vehicle.border_lines().copy())
+    rays, borders = np.concatenate(rays), np.stack(borders)
+
+    backend.prepare(mapgen)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        backend.cast(rays)
+        backend.collisions(borders)
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[11, 50, 200], help="Map sizes")
+    parser.add_argument("-r", "--resolutions", type=float, nargs="+", default=[1.0, 2.0, 4.0],
+                        help="Distance field cell sizes in pixels")
+    parser.add_argument("-p", "--population", type=int, default=enums.NUM_POPULATION, help="Vehicles per query")
+    args = parser.parse_args()
+
+    print(f"{'Size':>4} {'Walls':>5} {'Backend':<20} {'Mean err':>8} {'p99 err':>8} {'Max err':>8} {'Hit mis':>8} "
+          f"{'Coll mis':>8} {'Prepare':>9} {'Query':>9}")
+    for size in args.sizes:
+        mapgen = MapGenerator(max(enums.CANVAS_SIZE / size, enums.MIN_TILE_SIZE), size, np.random.default_rng(size))
+        walls = len(mapgen.walls())
+        exact_ms = time_backend(ExactSensing(), mapgen, args.population)
+        print(f"{size:>4} {walls:>5} {'exact':<20} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {'-':>9} "
+              f"{exact_ms:>7.2f}ms")
+
+        for resolution in args.resolutions:
+            start = time.perf_counter()
+            DistanceFieldSensing(resolution).prepare(mapgen)
+            prepare_ms = (time.perf_counter() - start) * 1000
+
+            backend = DistanceFieldSensing(resolution)
+            report = compare_backends(mapgen, backend, rng=np.random.default_rng(0))
+            query_ms = time_backend(backend, mapgen, args.population)
+            print(f"{size:>4} {walls:>5} {f'distance_field@{resolution:g}':<20} {report['mean_error']:>8.2f} "
+                  f"{report['p99_error']:>8.2f} {report['max_error']:>8.1f} {report['hit_mismatch_rate']:>8.2%} "
+                  f"{report['collision_mismatch_rate']:>8.2%} {prepare_ms:>7.1f}ms {query_ms:>7.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compares training with and without surrogate pre-screening: for every surrogate and seed, trains a population with the
+adaptive curriculum for a number of generations and reports how many episodes were simulated, the wall-clock time,
+the largest map size mastered, and how well the surrogate's predictions ranked the simulated genomes.
+
+    python benchmarks/surrogate.py [-m SURROGATES...] [-s SEEDS...] [-r MIN MAX] [-g GENERATIONS]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project.environment import Environment
+from project.surrogate import SURROGATES
+
+
+def train(surrogate: str | None, seed: int, size_range: tuple[int, int], generations: int) -> dict:
+    env = Environment(seed=seed)
+    env.autosave = False
+    env.configure({"surrogate": surrogate, "curriculum": "adaptive", "map_size_range": size_range})
+
+    mastered = size_range[0] - 1
+    start = time.perf_counter()
+    while env.generation < generations and not env.completed_cycles:
+        env.tick()
+        while mastered < size_range[1] and env.curriculum.is_mastered(mastered + 1):
+            mastered += 1
+    seconds = time.perf_counter() - start
+
+    records = env.metrics.ordered()
+    return {
+        "simulated": int(records["simulated"].sum()),
+        "seconds": seconds,
+        "generations": env.generation,
+        "mastered": size_range[1] if env.completed_cycles else mastered,
+        "correlation": float(np.nanmean(records["surrogate_correlation"])) if surrogate else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-m", "--surrogates", nargs="+", default=["none", *SURROGATES],
+                        choices=["none", *SURROGATES])
+    parser.add_argument("-s", "--seeds", type=int, nargs="+", default=[0, 1, 2])
+    parser.add_argument("-r", "--range", type=int, nargs=2, default=[3, 7], metavar=("MIN", "MAX"),
+                        help="Map sizes to train through")
+    parser.add_argument("-g", "--generations", type=int, default=100, help="Generations per run")
+    args = parser.parse_args()
+
+    print(f"{'Surrogate':<10} {'Seed':>4} {'Gens':>5} {'Simulated':>9} {'Time':>8} {'Mastered':>8} {'Rank corr':>9}")
+    for name in args.surrogates:
+        surrogate = None if name == "none" else name
+        for seed in args.seeds:
+            result = train(surrogate, seed, tuple(args.range), args.generations)
+            correlation = f"{result['correlation']:>9.2f}" if surrogate else f"{'-':>9}"
+            print(f"{name:<10} {seed:>4} {result['generations']:>5} {result['simulated']:>9} "
+                  f"{result['seconds']:>7.1f}s {result['mastered']:>8} {correlation}", flush=True)
+
+
+if __name__ == '__main__':
+    main()
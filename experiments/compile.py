@@ -1,60 +1,58 @@
 """
-Helper script for compiling results from multiple experiments. It only creates average collisions and
-average of average ticks per map of all experiments. This is with the assumption that 2 experiments were
-run in parallel, with the first one testing the BEST agent, and the second one testing the AVERAGE agent.
-Four new files will be created:
+Helper script for running and compiling experiments of multiple agents. Each given agent is evaluated through the map
+sizes 3 to 11 (the same evaluation as the Experiment Mode) a number of times, in parallel worker processes. The results
+are written under the agent's label:
 
-- averages_avg_avg_ticks.csv = The average of average ticks per map of all experiments for the AVERAGE agent
-- average_avg_collisions.csv = The average collisions per map of all experiments for the AVERAGE agent
-- bests_avg_avg_ticks.csv = The average of average ticks per map of all experiments for the BEST agent
-- bests_avg_collisions.csv = The average collisions per map of all experiments for the BEST agent
+- <output>/<label>/repeat_<n>/ = The run reports, experiment results and CSVs of each repeat
+- <output>/<label>/summary.json = The mean, standard deviation and confidence interval per map size of all repeats
+- <output>/<label>/summary.csv = The same summary as a CSV
 
-IMPORTANT NOTE: This is not meant to be run normally. This is just a helper script I made while running experiments.
+Agents are given as file paths, optionally labelled as LABEL=PATH. Unlabelled agents are labelled by their file name.
+Example: `python experiments/compile.py best=agents/sample_best.pickle agents/sample_avg.pickle --repeats 10`
 """
 
-import csv
-import json
+import argparse
+import os
+import sys
 from pathlib import Path
 
-
-def average_datas(dataset: list[dict], key: str):
-    collisions = [[value[key] for k, value in data.items() if k.startswith("map")] for data in dataset]
-    return [average([row[i] for row in collisions]) for i in range(len(collisions[0]))]
-
-
-def write_csv(path: str, dataset: list[list]):
-    with open(path, "w") as file:
-        writer = csv.writer(file, delimiter=" ")
-        writer.writerows(dataset)
-
-
-def average(values: list):
-    return sum(values) / len(values)
-
-
-def read_file(path: str):
-    with open(path, "r") as file:
-        return json.load(file)
-
-
-cwd = Path.cwd()
-experiment_result = "experiment_results.json"
-experiments = [folder for folder in cwd.iterdir() if folder.is_dir()]
-bests: list[dict] = [read_file(best / experiment_result) for best in experiments[::2]]
-averages: list[dict] = [read_file(avg / experiment_result) for avg in experiments[1::2]]
-maps: list[int] = [int(key[3:]) for key, value in bests[0].items() if key.startswith("map")]
-
-bests_avg_collisions = average_datas(bests, "collisions")
-bests_avg_avg_ticks = average_datas(bests, "average_ticks")
-averages_avg_collisions = average_datas(averages, "collisions")
-averages_avg_avg_ticks = average_datas(averages, "average_ticks")
-
-bests_avg_collisions_zipped = list(zip(maps, bests_avg_collisions))
-bests_avg_avg_ticks_zipped = list(zip(maps, bests_avg_avg_ticks))
-averages_avg_collisions_zipped = list(zip(maps, averages_avg_collisions))
-averages_avg_avg_ticks_zipped = list(zip(maps, averages_avg_avg_ticks))
-
-write_csv(cwd / "bests_avg_collisions.csv", bests_avg_collisions_zipped)
-write_csv(cwd / "bests_avg_avg_ticks.csv", bests_avg_avg_ticks_zipped)
-write_csv(cwd / "averages_avg_collisions.csv", averages_avg_collisions_zipped)
-write_csv(cwd / "averages_avg_avg_ticks.csv", averages_avg_avg_ticks_zipped)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from project.experiment import ExperimentHarness
+
+
+def parse_agents(values: list[str]) -> dict[str, str]:
+    agents = {}
+    for value in values:
+        label, _, path = value.rpartition("=")
+        label = label or Path(path).stem
+        if label in agents:
+            raise SystemExit(f"Duplicate agent label '{label}'. Label them explicitly with LABEL=PATH.")
+        if not os.path.isfile(path):
+            raise SystemExit(f"Agent file '{path}' does not exist.")
+        agents[label] = path
+    return agents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run and compile experiments of multiple agents.")
+    parser.add_argument("agents", nargs="+", help="Agent pickle files, optionally as LABEL=PATH")
+    parser.add_argument("-r", "--repeats", type=int, default=5, help="Number of experiments per agent")
+    parser.add_argument("-n", "--runs-per-size", type=int, default=50, help="Number of runs per map size")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="Root seed, for replaying experiments")
+    parser.add_argument("-c", "--confidence", type=float, default=0.95, help="Confidence level of the intervals")
+    parser.add_argument("-o", "--output", default=str(Path(__file__).resolve().parent / "results"),
+                        help="Output directory")
+    args = parser.parse_args()
+
+    harness = ExperimentHarness(
+        parse_agents(args.agents),
+        args.repeats,
+        args.output,
+        runs_per_size=args.runs_per_size,
+        workers=args.workers,
+        confidence=args.confidence,
+        seed=args.seed
+    )
+    harness.run()
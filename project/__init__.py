@@ -1 +1,10 @@
-from project.ui.app import App
+# The simulation core only needs NumPy. The interface is imported on first access of project.App, so that importing
+# project.environment and the other core modules, e.g. in worker processes, doesn't load PySide6.
+__all__ = ["App"]
+
+
+def __getattr__(name: str):
+    if name == "App":
+        from project.ui.app import App
+        return App
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
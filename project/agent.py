@@ -1,5 +1,4 @@
 import math
-import random
 
 import numpy as np
 
@@ -7,20 +6,37 @@ from project import enums, utils
 from project.models import VehicleData
 from project.types import *
 
+# Fraction of the track added to the remaining progress in the "progress" fitness, which caps how steeply it rises
+# towards the end of the track. The same role as the offset of 15 pixels in the displacement ratio
+PROGRESS_OFFSET = 0.02
+
 
 class NavigatorAgent:
-    def __init__(self):
+    # Topology, the same for every agent
+    INPUT_SIZE = 6
+    NUM_HLAYERS = 2
+    NUM_HNEURONS = 5
+    OUTPUT_SIZE = 2
+
+    def __init__(self, weights: list[np.ndarray] | None = None, rng: np.random.Generator | None = None):
         # Topology
-        self.input_size: int = 6
-        self.num_hlayers: int = 2
-        self.num_hneurons: int = 5
-        self.output_size: int = 2
-
-        # Weights
-        self.weights: list[np.ndarray] = [
-            0.1 * np.random.randn(self.input_size, self.num_hneurons),  # Input to first hidden layer
-            *[0.1 * np.random.randn(self.num_hneurons, self.num_hneurons) for _ in range(self.num_hlayers - 1)],
-            0.1 * np.random.randn(self.num_hneurons, self.output_size)  # Last hidden layer to output
+        self.input_size: int = self.INPUT_SIZE
+        self.num_hlayers: int = self.NUM_HLAYERS
+        self.num_hneurons: int = self.NUM_HNEURONS
+        self.output_size: int = self.OUTPUT_SIZE
+
+        # Weights. If given, the weights are used as they are, e.g. as views into a WeightStore
+        rng = rng or np.random.default_rng()
+        self.weights: list[np.ndarray] = weights if weights is not None else [
+            0.1 * rng.standard_normal(shape) for shape in self.layer_shapes()
+        ]
+
+    @classmethod
+    def layer_shapes(cls) -> list[tuple[int, int]]:
+        return [
+            (cls.INPUT_SIZE, cls.NUM_HNEURONS),  # Input to first hidden layer
+            *[(cls.NUM_HNEURONS, cls.NUM_HNEURONS) for _ in range(cls.NUM_HLAYERS - 1)],
+            (cls.NUM_HNEURONS, cls.OUTPUT_SIZE)  # Last hidden layer to output
         ]
 
     def predict(self, inputs: np.ndarray | list) -> tuple[float, float]:
@@ -87,14 +103,76 @@ class NavigatorAgent:
         ]
 
 
+class WeightStore:
+    """
+    Packs the weights of a whole population of agents into one contiguous buffer, with one row (genome) per agent.
+    Every agent's layer matrices are views into its row, so the agents can still be used and pickled on their own,
+    while the population can be read, replaced and run through the network as a whole.
+    """
+
+    def __init__(self, size: int, dtype: type = np.float32, rng: np.random.Generator | None = None):
+        rng = rng or np.random.default_rng()
+        self.shapes: list[tuple[int, int]] = NavigatorAgent.layer_shapes()
+        self.genome_size: int = sum(rows * columns for rows, columns in self.shapes)
+        self.genomes: np.ndarray = (0.1 * rng.standard_normal((size, self.genome_size))).astype(dtype)
+
+        # Each layer of the whole population as a (size, rows, columns) view into the buffer
+        self.layers: list[np.ndarray] = []
+        start = 0
+        for rows, columns in self.shapes:
+            end = start + rows * columns
+            self.layers.append(self.genomes[:, start:end].reshape(size, rows, columns))
+            start = end
+
+        self.agents: list[NavigatorAgent] = [NavigatorAgent(self._views(i)) for i in range(size)]
+
+    def set_genomes(self, genomes: np.ndarray):
+        # Replace the whole population's weights with a single buffer copy
+        self.genomes[...] = genomes
+
+    def adopt(self, index: int, agent: NavigatorAgent):
+        # Copy the given agent's weights into the store and turn its weights into views of the store
+        genome = np.asarray(agent.to_genome())
+        if genome.size != self.genome_size:
+            raise ValueError(f"Agent's genome size does not match the store's. {genome.size} != {self.genome_size}")
+
+        self.genomes[index] = genome
+        agent.weights = self._views(index)
+        self.agents[index] = agent
+
+    def average(self, indices: np.ndarray) -> np.ndarray:
+        return self.genomes[indices].mean(axis=0)
+
+    def predict(self, inputs: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        # Batched NavigatorAgent.predict(). Each row of inputs is run through the network of the agent at the same row
+        # of indices, and the adjusted (dtheta, dspeed) outputs are returned as rows
+        activations = inputs[:, np.newaxis, :]
+        for layer in self.layers[:-1]:
+            activations = relu(np.matmul(activations, layer[indices]))
+        outputs = np.tanh(np.matmul(activations, self.layers[-1][indices]))[:, 0, :]
+        return outputs * (math.radians(enums.VEHICLE_DANGLE), enums.VEHICLE_DSPEED)
+
+    def _views(self, index: int) -> list[np.ndarray]:
+        return [layer[index] for layer in self.layers]
+
+
 class GeneticAlgorithm:
+    # What the fitness is measured by before the finishing bonus. "displacement" is the ratio between the straight line
+    # distances from the start and to the goal, and "progress" is how far along the track the vehicle got
+    MEASURES = ("displacement", "progress")
+
     @staticmethod
-    def fitness(data: VehicleData, all_ticks_taken: list[float]) -> float:
-        # The fitness will be the ratio between displacement from start and displacement from goal
-        offset = 15
-        denom = math.sqrt(data.displacement_goal + offset)
-        ratio = math.sqrt(data.displacement_start) / denom if denom else 0
-        out = ratio
+    def fitness(data: VehicleData, all_ticks_taken: list[float], measure: str = "displacement") -> float:
+        if measure == "progress":
+            # Same shape as the displacement ratio, as a fraction of the track's length
+            offset = PROGRESS_OFFSET
+            out = math.sqrt(data.progress) / math.sqrt(1 - data.progress + offset)
+        else:
+            # The fitness will be the ratio between displacement from start and displacement from goal
+            offset = 15
+            denom = math.sqrt(data.displacement_goal + offset)
+            ratio = math.sqrt(data.displacement_start) / denom if denom else 0
+            out = ratio
 
         # If the vehicle has reached its goal, the number of ticks it took to reach there also factors in
         if data.is_finished:
@@ -109,18 +187,58 @@ class GeneticAlgorithm:
         return out
 
     @staticmethod
-    def selection_pair(population: Population, fitnesses: list[float]) -> tuple[Genome, Genome]:
+    def fitnesses(datas: tuple[VehicleData], measure: str = "displacement") -> np.ndarray:
+        # Same as fitness(), but for the whole population at once
+        count = len(datas)
+        ticks_taken = np.fromiter((data.ticks_taken for data in datas), float, count)
+        is_finished = np.fromiter((data.is_finished for data in datas), bool, count)
+
+        if measure == "progress":
+            progress = np.fromiter((data.progress for data in datas), float, count)
+            out = np.sqrt(progress) / np.sqrt(1 - progress + PROGRESS_OFFSET)
+        else:
+            displacement_start = np.fromiter((data.displacement_start for data in datas), float, count)
+            displacement_goal = np.fromiter((data.displacement_goal for data in datas), float, count)
+            offset = 15
+            out = np.sqrt(displacement_start) / np.sqrt(displacement_goal + offset)
+
+        if is_finished.any():
+            taken = ticks_taken[ticks_taken != 0]
+            minimum, maximum = taken.min(), taken.max()
+            denom = maximum - minimum
+            normalised = (ticks_taken[is_finished] - minimum) / denom if denom else np.ones(is_finished.sum())
+            multiplier = 2  # Same as in fitness()
+            power = 0.2
+            out[is_finished] += exp_decay(normalised, multiplier, power)
+
+        return out
+
+    @staticmethod
+    def selection_pair(population: Population, fitnesses: list[float],
+                       rng: np.random.Generator | None = None) -> tuple[Genome, Genome]:
+        rng = rng or np.random.default_rng()
         if not sum(fitnesses):  # If weights are all zero
-            return random.choices(population=population, k=2)
+            first, second = rng.integers(0, len(population), size=2)
+        else:
+            weights = np.asarray(fitnesses, dtype=float)
+            first, second = rng.choice(len(population), size=2, p=weights / weights.sum())
 
-        return random.choices(
-            population=population,
-            weights=fitnesses,
-            k=2
-        )
+        return population[first], population[second]
 
     @staticmethod
-    def crossover(genome1: Genome, genome2: Genome) -> tuple[Genome, Genome]:
+    def selection_pairs(fitnesses: np.ndarray, num_pairs: int, rng: np.random.Generator | None = None) -> np.ndarray:
+        # Same as selection_pair(), but draws the indices of all the pairs at once from a single cumulative distribution
+        rng = rng or np.random.default_rng()
+        if not fitnesses.sum():  # If weights are all zero
+            return rng.integers(0, len(fitnesses), size=(num_pairs, 2))
+
+        cumulative = np.cumsum(fitnesses)
+        indices = np.searchsorted(cumulative, rng.random((num_pairs, 2)) * cumulative[-1], side="right")
+        return np.minimum(indices, len(fitnesses) - 1)  # Guards against floating point error at the upper end
+
+    @staticmethod
+    def crossover(genome1: Genome, genome2: Genome, rng: np.random.Generator | None = None) -> tuple[Genome, Genome]:
+        rng = rng or np.random.default_rng()
         length = len(genome1)
         if length != len(genome2):
             raise ValueError(f"Length of given gnomes are not equal. {length} != {len(genome2)}")
@@ -129,48 +247,83 @@ class GeneticAlgorithm:
             return genome1, genome2
 
         # Crossover at random index
-        index = random.randint(1, length - 1)
+        index = int(rng.integers(1, length))
         return genome1[0:index] + genome2[index:], genome2[0:index] + genome1[index:]
 
     @staticmethod
-    def mutation(genome: Genome, mutation_chance: float, mutation_rate: float) -> Genome:
+    def crossover_pairs(genomes1: np.ndarray, genomes2: np.ndarray,
+                        rng: np.random.Generator | None = None) -> tuple[np.ndarray, np.ndarray]:
+        # Same as crossover(), but for rows of genomes at once
+        rng = rng or np.random.default_rng()
+        length = genomes1.shape[1]
+        if length < 2:
+            return genomes1.copy(), genomes2.copy()
+
+        indices = rng.integers(1, length, size=(len(genomes1), 1))
+        before = np.arange(length) < indices
+        return np.where(before, genomes1, genomes2), np.where(before, genomes2, genomes1)
+
+    @staticmethod
+    def mutation(genome: Genome, mutation_chance: float, mutation_rate: float,
+                 rng: np.random.Generator | None = None) -> Genome:
+        rng = rng or np.random.default_rng()
         mutated = genome.copy()  # Avoid modifying given genome
 
         for i in range(len(genome)):
-            if random.random() < mutation_chance:
-                mutated[i] += random.choice([-1, 1]) * mutation_rate
-                if random.random() < mutation_rate:  # Chance to flip the sign of the gene
+            if rng.random() < mutation_chance:
+                mutated[i] += rng.choice([-1, 1]) * mutation_rate
+                if rng.random() < mutation_rate:  # Chance to flip the sign of the gene
                     mutated[i] *= -1
 
         return mutated
 
     @staticmethod
-    def next_generation(population: Population, datas: tuple[VehicleData], carry_over: float,
-                        mutation_chance: float, mutation_rate: float) -> Population:
-        # Sort population by fitness
-        fitnesses = [GeneticAlgorithm.fitness(data, [_data.ticks_taken for _data in datas]) for data in datas]
-        sorted_population = sorted(
-            enumerate(population),
-            key=lambda enum: fitnesses[enum[0]],
-            reverse=True
-        )
-        sorted_population = [pop for i, pop in sorted_population]
+    def mutate_population(genomes: np.ndarray, mutation_chance: float, mutation_rate: float,
+                          rng: np.random.Generator | None = None) -> np.ndarray:
+        # Same as mutation(), but for rows of genomes at once. All the random numbers are drawn in one batch
+        rng = rng or np.random.default_rng()
+        draws = rng.random((3, *genomes.shape))
+        mutate = draws[0] < mutation_chance
+        signs = np.where(draws[1] < 0.5, -1, 1)
+        mutated = genomes + mutate * signs * mutation_rate
+
+        flip = mutate & (draws[2] < mutation_rate)  # Chance to flip the sign of the gene
+        mutated[flip] *= -1
+        return mutated.astype(genomes.dtype, copy=False)
+
+    @staticmethod
+    def next_generation(population: Population | np.ndarray, datas: tuple[VehicleData], carry_over: float,
+                        mutation_chance: float, mutation_rate: float, rng: np.random.Generator | None = None,
+                        measure: str = "displacement") -> np.ndarray:
+        # Works on the population as a matrix of genomes, one row per genome
+        population = np.asarray(population, dtype=float) if isinstance(population, list) else population
+        return GeneticAlgorithm.breed(population, GeneticAlgorithm.fitnesses(datas, measure), carry_over,
+                                      mutation_chance, mutation_rate, rng)
+
+    @staticmethod
+    def breed(population: np.ndarray, fitnesses: np.ndarray, carry_over: float, mutation_chance: float,
+              mutation_rate: float, rng: np.random.Generator | None = None) -> np.ndarray:
+        # Same as next_generation(), given the population's fitnesses
+        rng = rng or np.random.default_rng()
+        size = len(population)
+
+        # Sort population by fitness (stable, so ties keep their order)
+        order = np.argsort(-fitnesses, kind="stable")
 
         # Carry over the top carry_over% of the population
-        num = int(len(sorted_population) * carry_over)
-        next_generation: Population = sorted_population[:num]
-        while len(next_generation) < len(population):
-            parents = GeneticAlgorithm.selection_pair(population, fitnesses)
-            child_a, child_b = GeneticAlgorithm.crossover(*parents)
-            child_a = GeneticAlgorithm.mutation(child_a, mutation_chance, mutation_rate)
-            child_b = GeneticAlgorithm.mutation(child_b, mutation_chance, mutation_rate)
-            next_generation += [child_a, child_b]
+        num = int(size * carry_over)
+        carried = population[order[:num]]
 
-        # For odd population sizes
-        if len(next_generation) > len(population):
-            next_generation = next_generation[:-1]
+        # Fill the rest with children of fitness proportionally selected parents, two children per pair
+        num_pairs = math.ceil((size - num) / 2)
+        pairs = GeneticAlgorithm.selection_pairs(fitnesses, num_pairs, rng)
+        children_a, children_b = GeneticAlgorithm.crossover_pairs(
+            population[pairs[:, 0]], population[pairs[:, 1]], rng)
+        children = np.stack((children_a, children_b), axis=1).reshape(num_pairs * 2, -1)
+        children = GeneticAlgorithm.mutate_population(children, mutation_chance, mutation_rate, rng)
 
-        return next_generation
+        # Slicing handles odd population sizes
+        return np.concatenate((carried, children))[:size]
 
 
 def relu(inputs: np.ndarray) -> np.ndarray:
@@ -178,8 +331,10 @@ def relu(inputs: np.ndarray) -> np.ndarray:
     return np.maximum(0, inputs)
 
 
-def exp_decay(value: float, multiplier: float, power: float):
+def exp_decay(value: float | np.ndarray, multiplier: float, power: float):
     # Exponentially increase output as the input approaches 0
-    if value == 0:
+    if isinstance(value, np.ndarray):
+        value = np.where(value == 0, 0.01, value)
+    elif value == 0:
         value = 0.01
     return multiplier / (value ** power)
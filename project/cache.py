@@ -0,0 +1,65 @@
+import copy
+import hashlib
+from collections import OrderedDict
+
+from project import enums
+from project.agent import NavigatorAgent
+from project.models import VehicleData
+from project.types import *
+
+
+class EpisodeCache:
+    """
+    A bounded, least recently used cache of the final results of episodes (one vehicle's run on one map). The
+    simulation of an episode is deterministic given the agent's weights, the map and the physics parameters, so an
+    episode that has ended in a collision or at the finish line will end exactly the same way again. Episodes that were
+    cut short by the end of the run are not cached, as how far they got depends on when the run ended, which isn't
+    always after ticks_per_run ticks, e.g. when the run is reset from the interface.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict[tuple, tuple[VehicleData, Pose]] = OrderedDict()
+
+    def get(self, key: tuple) -> tuple[VehicleData, Pose] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return copy.copy(entry[0]), entry[1]
+
+    def put(self, key: tuple, data: VehicleData, pose: Pose):
+        self._entries[key] = (copy.copy(data), pose)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(agent: NavigatorAgent, map_key: bytes, ticks_per_run: int) -> tuple:
+        return EpisodeCache.genome_key(agent), map_key, EpisodeCache.physics_key(ticks_per_run)
+
+    @staticmethod
+    def genome_key(agent: NavigatorAgent) -> bytes:
+        digest = hashlib.blake2b(digest_size=16)
+        for layer in agent.weights:
+            digest.update(layer.dtype.str.encode())
+            digest.update(layer.tobytes())
+        return digest.digest()
+
+    @staticmethod
+    def physics_key(ticks_per_run: int) -> tuple:
+        return (enums.VEHICLE_SIZE, enums.VEHICLE_MAXSPEED, enums.VEHICLE_DSPEED, enums.VEHICLE_DANGLE,
+                enums.SENSOR_LENGTH, ticks_per_run)
@@ -0,0 +1,171 @@
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+
+
+@dataclass
+class CurriculumStep:
+    regenerate: bool = False  # Whether to regenerate the map
+    map_size: int | None = None  # The new map size, or None to keep the current one
+    completed: bool = False  # Whether the map sizes have been cleared, i.e. a learning process or experiment is done
+
+
+class Curriculum:
+    """
+    Decides how the environment progresses through the map sizes after every run. Subclasses implement _next_step().
+    Every curriculum logs the wall-clock time spent on each map size, and the time it took to clear all the map sizes.
+    """
+
+    def __init__(self):
+        self.size_times: dict[int, float] = {}  # Map size to seconds spent on it
+        self.completion_times: list[float] = []  # Seconds since the start of the curriculum of every completion
+        self._start: float | None = None
+        self._last: float | None = None
+
+    def next_step(self, env, success: bool) -> CurriculumStep:
+        # Called by the environment at the end of every run, with whether any vehicle reached the goal
+        now = time.perf_counter()
+        if self._start is None:
+            self._start = self._last = now
+        size = env.get_map_size()
+        self.size_times[size] = self.size_times.get(size, 0.0) + now - self._last
+        self._last = now
+
+        step = self._next_step(env, success)
+        if step.completed:
+            self.completion_times.append(now - self._start)
+        return step
+
+    def time_to_solution(self) -> float | None:
+        # Wall-clock seconds it took to clear all the map sizes the first time
+        return self.completion_times[0] if self.completion_times else None
+
+    def report(self) -> dict:
+        return {
+            "curriculum": type(self).__name__,
+            "size_times": {str(size): seconds for size, seconds in sorted(self.size_times.items())},
+            "completion_times": self.completion_times,
+            "time_to_solution": self.time_to_solution()
+        }
+
+    def _next_step(self, env, success: bool) -> CurriculumStep:
+        raise NotImplementedError
+
+
+class FixedCurriculum(Curriculum):
+    """
+    Regenerates the map every `regen_n_runs` runs and increments the map size every `resize_n_regens` regenerations.
+    In learning mode, both counters start over whenever no vehicle reaches the goal.
+    """
+
+    def _next_step(self, env, success: bool) -> CurriculumStep:
+        step = CurriculumStep()
+        if env.regen_n_runs_enabled:
+            # Update current map run if haven't reached limit
+            if env.current_map_run + 1 < env.regen_n_runs:
+                env.current_map_run += 1
+
+            # Regenerate current map if current_map_run >= regen_n_runs
+            else:
+                env.current_map_run = 0
+                step.regenerate = True
+
+                if env.resize_n_regens_enabled:
+                    # Update current map size run if haven't reached limit
+                    if env.current_mapsize_run + 1 < env.resize_n_regens:
+                        env.current_mapsize_run += 1
+
+                    # Resize map once reached limit
+                    else:
+                        env.current_mapsize_run = 0
+
+                        # Increment map size by one
+                        step.map_size = env.get_map_size() + 1
+                        if step.map_size > env.map_size_range[1]:  # Loop back once all the sizes are done
+                            step.map_size = env.map_size_range[0]
+                            step.completed = True
+
+        if not success and env.learning_mode:
+            env.current_map_run = 0
+            env.current_mapsize_run = 0
+
+        return step
+
+
+class AdaptiveCurriculum(Curriculum):
+    """
+    Keeps a rolling success rate of the last `window` runs of every map size. A map size is mastered once it has been
+    run at least `min_runs` times with a success rate of at least `mastery`. The curriculum always trains on the
+    smallest map size that isn't mastered yet, moving on as soon as it is, instead of after a fixed number of runs.
+    Every `review_every` regenerations, one map of the weakest mastered size is revisited, and that size goes back to
+    being trained on if it isn't mastered anymore. All the map sizes are cleared once the largest one is mastered.
+
+    The map is still regenerated every `regen_n_runs` runs of the environment.
+    """
+
+    def __init__(self, window: int = 10, min_runs: int = 6, mastery: float = 0.8, review_every: int = 5):
+        super().__init__()
+        self.window = window
+        self.min_runs = min_runs
+        self.mastery = mastery
+        self.review_every = review_every
+
+        self.successes: dict[int, deque[bool]] = {}
+        self._regenerations: int = 0
+        self._reviewing: bool = False
+
+    def success_rate(self, size: int) -> float:
+        runs = self.successes.get(size)
+        return float(np.mean(runs)) if runs else 0.0
+
+    def is_mastered(self, size: int) -> bool:
+        runs = self.successes.get(size, ())
+        return len(runs) >= self.min_runs and self.success_rate(size) >= self.mastery
+
+    def report(self) -> dict:
+        return {
+            **super().report(),
+            "success_rates": {str(size): self.success_rate(size) for size in sorted(self.successes)}
+        }
+
+    def _next_step(self, env, success: bool) -> CurriculumStep:
+        size = env.get_map_size()
+        self.successes.setdefault(size, deque(maxlen=self.window)).append(success)
+
+        step = CurriculumStep()
+        env.current_mapsize_run = 0
+        if env.current_map_run + 1 < env.regen_n_runs:
+            env.current_map_run += 1
+            return step
+
+        env.current_map_run = 0
+        step.regenerate = True
+        self._regenerations += 1
+
+        minimum, maximum = env.map_size_range
+        target = next((size for size in range(minimum, maximum + 1) if not self.is_mastered(size)), None)
+        if target is None:
+            # Everything is mastered, so start over with fresh success rates
+            self.successes.clear()
+            self._reviewing = False
+            step.map_size = minimum
+            step.completed = True
+            return step
+
+        mastered = [size for size in range(minimum, target) if self.is_mastered(size)]
+        if not self._reviewing and mastered and self._regenerations % self.review_every == 0:
+            self._reviewing = True
+            step.map_size = min(mastered, key=self.success_rate)
+        else:
+            self._reviewing = False
+            step.map_size = target
+
+        return step
+
+
+CURRICULA = {
+    "fixed": FixedCurriculum,
+    "adaptive": AdaptiveCurriculum
+}
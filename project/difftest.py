@@ -0,0 +1,341 @@
+"""
+Differential testing of the simulation. A reference simulation runs side by side with an `Environment` using a
+candidate sensing backend and weight store, on the same map and the same genomes. The reference shares none of the
+environment's optimised paths. Its vehicles place every part with its own sine and cosine, as vehicles did before
+their points were rotated together and cached. Its sensors see the nearest of every tile border they cross, by
+`utils.intersects`, and every vehicle is predicted with `NavigatorAgent.predict`. After every tick, every vehicle's
+pose, sensor distances, collision flag and finish flag are compared, and the first difference beyond the tolerances is
+reported with the state of the vehicle in both simulations.
+
+Run `python -m project.difftest --sensing exact` to check the default paths on a few map sizes and seeds, or e.g.
+`--sensing distance_field --weight-dtype float32 --sensor-tolerance 1` for the fast ones. Exits with a non-zero status
+if any of the runs diverge, so it can be used as a check in CI.
+"""
+
+import argparse
+import math
+import pickle
+import sys
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from project import enums
+from project import utils
+from project.agent import NavigatorAgent
+from project.environment import Environment
+from project.map_gen import Direction, MapGenerator
+from project.models import Sensor, Wheel
+from project.types import *
+
+
+@dataclass
+class VehicleState:
+    x: float
+    y: float
+    theta: float
+    speed: float
+    distances: list[float]
+    collision: bool
+    finished: bool
+
+
+@dataclass
+class Divergence:
+    tick: int
+    vehicle: int  # Index of the vehicle in the population
+    quantity: str  # What differs, e.g. "pose", "sensor 2", "collision" or "finished"
+    reference: VehicleState
+    candidate: VehicleState
+    previous: VehicleState | None  # The reference vehicle's state one tick earlier, None on the first tick
+
+    def __str__(self):
+        lines = [f"Tick {self.tick}, vehicle {self.vehicle}: {self.quantity} differs"]
+        for name, state in (("previous", self.previous), ("reference", self.reference),
+                            ("candidate", self.candidate)):
+            if state is not None:
+                distances = ", ".join(f"{distance:.6f}" for distance in state.distances)
+                lines.append(f"  {name + ':':<10} pose ({state.x:.6f}, {state.y:.6f}, {state.theta:.6f}) "
+                             f"speed {state.speed:.6f} sensors [{distances}] collision {state.collision} "
+                             f"finished {state.finished}")
+        return "\n".join(lines)
+
+
+@dataclass
+class DiffReport:
+    ticks: int = 0  # Number of ticks compared
+    max_pose_error: float = 0.0
+    max_sensor_error: float = 0.0
+    divergence: Divergence | None = None
+    map: dict = field(default_factory=dict)  # Description of the map, see MapGenerator.describe()
+
+
+class ReferenceVehicle:
+    """
+    A vehicle that works out the position of each of its parts separately, from the part's angle and distance to the
+    center, and keeps nothing between poses. The same maths as `Vehicle`, without its shared rotation and pose cache.
+    """
+
+    def __init__(self, x: float, y: float, size: float):
+        self.x, self.y, self.size = x, y, size
+        self.theta: float = math.radians(90)
+
+        # Wheels, and sensors as (angle, distance) to the center and the sensor's own angle, as if the angle is 0
+        half = size / 2
+        self.wheels: list[Wheel] = [Wheel(x, y - half, 8, 24), Wheel(x, y + half, 8, 24)]
+        sensor_offsets = [(half, -half / 2, -30), (half, 0, 0), (half, half / 2, 30), (0, half, 60), (0, -half, -60)]
+        self._sensor_info = [(math.atan2(dy, dx), math.hypot(dx, dy), math.radians(angle))
+                             for dx, dy, angle in sensor_offsets]
+        corners = [(-half, -half), (half, -half), (half, half), (-half, half)]  # TOP, RIGHT, BOTTOM, LEFT borders
+        self._border_info = [(self._info(*corners[i]), self._info(*corners[(i + 1) % 4])) for i in range(4)]
+        self.sensors: list[Sensor] = []
+        self._place_parts()
+
+    def move(self):
+        # Moves along the current angle, then turns by the difference in wheel speeds
+        speed = (self.wheels[0].speed + self.wheels[1].speed) / 2
+        dx, dy = speed * math.cos(self.theta), speed * math.sin(self.theta)
+        self.theta += (self.wheels[0].speed - self.wheels[1].speed) / self.size
+        self.theta %= 2 * math.pi
+        self.x += dx
+        self.y += dy
+        self._place_parts()
+
+    def speed(self) -> float:
+        return self.wheels[0].speed + self.wheels[1].speed
+
+    def change_speed(self, change: float):
+        for wheel in self.wheels:
+            speed = wheel.speed + change / 2
+            wheel.speed = math.copysign(min(enums.VEHICLE_MAXSPEED / 2, abs(speed)), speed)
+
+    def borders(self) -> list[Line]:
+        return [(self._position(*start), self._position(*end)) for start, end in self._border_info]
+
+    def collides(self, line: Line) -> bool:
+        return any(utils.intersects(border, line) for border in self.borders())
+
+    def _place_parts(self):
+        # Sensors are made anew for every pose, so that no position is carried over from the last one
+        self.sensors = []
+        for angle, distance, sensor_angle in self._sensor_info:
+            sensor = Sensor(*self._position(angle, distance), 8, 0)
+            sensor.theta = sensor_angle
+            self.sensors.append(sensor)
+
+    def _position(self, angle: float, distance: float) -> Point:
+        return (self.x + distance * math.cos(self.theta + angle),
+                self.y + distance * math.sin(self.theta + angle))
+
+    @staticmethod
+    def _info(dx: float, dy: float) -> tuple[float, float]:
+        return math.atan2(dy, dx), math.hypot(dx, dy)
+
+
+class ReferenceSimulation:
+    """
+    The simulation of one run, one vehicle and one sensor at a time, with ReferenceVehicles. Only what's compared is
+    kept, i.e. no fitness or displacements.
+    """
+
+    def __init__(self, mapgen: MapGenerator, genomes: np.ndarray):
+        self.mapgen = mapgen
+        self.borders: list[Line] = [border for tile in mapgen.tiles() for border in tile.borders if border]
+        self.ticks: int = 0
+
+        first_tile = mapgen.tiles()[0]
+        x, y = first_tile.x + first_tile.size / 2, enums.VEHICLE_SIZE / 2 + 10
+        self.vehicles: list[ReferenceVehicle] = []
+        self.agents: list[NavigatorAgent] = []
+        self.intersections: list[list[tuple[Point, float]]] = []
+        self.collisions: list[bool] = []
+        self.finished: list[bool] = []
+        for genome in genomes:
+            vehicle = ReferenceVehicle(x, y, enums.VEHICLE_SIZE)
+            agent = NavigatorAgent()
+            agent.weights = agent.from_genome(genome)
+            intersections, collision = self._sense(vehicle)
+            self.vehicles.append(vehicle)
+            self.agents.append(agent)
+            self.intersections.append(intersections)
+            self.collisions.append(collision)
+            self.finished.append(False)
+
+    def tick(self) -> bool:
+        # Moves all the vehicles by one tick. Returns whether all of them have collided or finished
+        self.ticks += 1
+        last_tile = self.mapgen.tiles()[-1]
+        (x1, y1), (x2, y2) = last_tile.finish_line()
+        for i, (vehicle, agent) in enumerate(zip(self.vehicles, self.agents)):
+            if self.collisions[i] or self.finished[i]:
+                continue
+
+            vehicle.move()
+            self.intersections[i], self.collisions[i] = self._sense(vehicle)
+            if last_tile.to_direction == Direction.RIGHT:
+                self.finished[i] = vehicle.x >= x1 and y1 <= vehicle.y <= y2
+            elif last_tile.to_direction == Direction.DOWN:
+                self.finished[i] = vehicle.y >= y1 and x1 <= vehicle.x <= x2
+            elif last_tile.to_direction == Direction.LEFT:
+                self.finished[i] = vehicle.x <= x1 and y1 <= vehicle.y <= y2
+
+            inputs = [distance for _, distance in self.intersections[i]] + [vehicle.speed()]
+            dtheta, dspeed = agent.predict(inputs)
+            vehicle.theta += dtheta
+            vehicle.change_speed(dspeed)
+
+        return all(collision or finished for collision, finished in zip(self.collisions, self.finished))
+
+    def state(self, i: int) -> VehicleState:
+        vehicle = self.vehicles[i]
+        return VehicleState(vehicle.x, vehicle.y, vehicle.theta, vehicle.speed(),
+                            [distance for _, distance in self.intersections[i]], bool(self.collisions[i]),
+                            bool(self.finished[i]))
+
+    def _sense(self, vehicle: ReferenceVehicle) -> tuple[list[tuple[Point, float]], bool]:
+        # Every sensor sees the nearest border it intersects. The vehicle collides with any border its borders cross
+        intersections = []
+        for sensor in vehicle.sensors:
+            hits = [hit for border in self.borders if (hit := sensor.intersects(border, vehicle.theta))]
+            intersections.append(min(hits, key=lambda hit: hit[1]) if hits else
+                                 (sensor.end(vehicle.theta), enums.SENSOR_LENGTH))
+
+        collision = any(vehicle.collides(border) for border in self.borders)
+        return intersections, collision
+
+
+def candidate_state(env: Environment, i: int) -> VehicleState:
+    vehicle = env.get_vehicles()[i]
+    data = env.vehicle_data(vehicle)
+    return VehicleState(vehicle.x, vehicle.y, vehicle.theta, vehicle.speed(),
+                        [distance for _, distance in data.intersections], bool(data.collision),
+                        bool(data.is_finished))
+
+
+def compare_simulations(description: dict, genomes: np.ndarray, ticks_per_run: int = 750, sensing: str = "exact",
+                        weight_dtype: type | None = None, pose_tolerance: float = 1e-6,
+                        sensor_tolerance: float = 1e-6) -> DiffReport:
+    """
+    Runs the reference simulation and an environment with the given sensing backend and weight dtype side by side,
+    for one run of the genomes on the described map, and stops at the first difference beyond the tolerances.
+
+    Parameters
+    ----------
+    description: dict
+        The map, as made by MapGenerator.describe().
+    genomes: np.ndarray
+        One genome per vehicle.
+    ticks_per_run: int
+        The most ticks to simulate.
+    sensing: str
+        The candidate's sensing backend, one of SENSING_BACKENDS.
+    weight_dtype: type | None
+        The dtype of the candidate's weight store, or None to predict with one NavigatorAgent per vehicle.
+    pose_tolerance: float
+        The largest difference in position (pixels) or angle (radians) that is not a divergence.
+    sensor_tolerance: float
+        The largest difference in a sensor distance (pixels) that is not a divergence.
+
+    Returns
+    -------
+    DiffReport
+        The number of ticks compared, the largest errors seen, and the first divergence, if any.
+    """
+    mapgen = MapGenerator(description["tile_size"], description["map_size"], np.random.default_rng(0))
+    mapgen.load(description)
+    reference = ReferenceSimulation(mapgen, genomes)
+
+    env = Environment(population=len(genomes), weight_dtype=weight_dtype, seed=0)
+    env.episode_cache = None  # Every episode has to be simulated to be compared
+    env.configure({"sensing": sensing})
+    env.ticks_per_run = ticks_per_run
+    env.mapgen.load(description)
+    if env.weight_store:
+        env.weight_store.set_genomes(genomes)
+    else:
+        for agent, genome in zip(env.vehicle_agents(), genomes):
+            agent.weights = agent.from_genome(genome)
+    env.reset_vehicles()
+
+    report = DiffReport(map=description)
+    previous = [None] * len(genomes)
+    done = False
+    while not done:
+        states = [reference.state(i) for i in range(len(genomes))]
+        for i, (expected, actual) in enumerate(zip(states, (candidate_state(env, i) for i in range(len(genomes))))):
+            if divergence := _compare(report, expected, actual, pose_tolerance, sensor_tolerance):
+                report.divergence = Divergence(reference.ticks, i, divergence, expected, actual, previous[i])
+                return report
+        previous = states
+
+        if reference.ticks >= ticks_per_run:
+            break
+        reference_done, candidate_done = reference.tick(), env.simulate_tick()
+        done = reference_done and candidate_done
+        report.ticks += 1
+
+    return report
+
+
+def _compare(report: DiffReport, expected: VehicleState, actual: VehicleState, pose_tolerance: float,
+             sensor_tolerance: float) -> str | None:
+    # Updates the largest errors of the report, and returns what differs beyond the tolerances, if anything
+    if expected.collision != actual.collision:
+        return "collision"
+    if expected.finished != actual.finished:
+        return "finished"
+
+    # Sensors go before the pose, as the angle is already turned by what the sensors saw in the same tick
+    for i, (a, b) in enumerate(zip(expected.distances, actual.distances)):
+        report.max_sensor_error = max(report.max_sensor_error, abs(a - b))
+        if abs(a - b) > sensor_tolerance:
+            return f"sensor {i}"
+
+    dtheta = abs(math.remainder(expected.theta - actual.theta, 2 * math.pi))
+    pose_error = max(utils.distance_2p((expected.x, expected.y), (actual.x, actual.y)), dtheta)
+    report.max_pose_error = max(report.max_pose_error, pose_error)
+    if pose_error > pose_tolerance:
+        return "pose"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 5, 8, 11], help="Map sizes")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 2], help="Map and genome seeds")
+    parser.add_argument("--population", type=int, default=enums.NUM_POPULATION, help="Random genomes per run")
+    parser.add_argument("--agents", nargs="*", default=[], help="Pickled agents to add to the random genomes")
+    parser.add_argument("--ticks", type=int, default=750, help="Ticks per run")
+    parser.add_argument("--sensing", default="exact", help="Candidate sensing backend")
+    parser.add_argument("--weight-dtype", choices=["float32", "float64"], help="Candidate weight store dtype")
+    parser.add_argument("--pose-tolerance", type=float, default=1e-6)
+    parser.add_argument("--sensor-tolerance", type=float, default=1e-6)
+    args = parser.parse_args()
+
+    agents = []
+    for path in args.agents:
+        with open(path, "rb") as file:
+            agents.append(pickle.load(file).to_genome())
+
+    diverged = 0
+    print(f"{'Size':>4} {'Seed':>4} {'Ticks':>5} {'Pose err':>9} {'Sensor err':>10}  Result")
+    for size in args.sizes:
+        for seed in args.seeds:
+            rng = np.random.default_rng(seed)
+            mapgen = MapGenerator(max(enums.CANVAS_SIZE / size, enums.MIN_TILE_SIZE), size, rng)
+            genomes = np.array([NavigatorAgent(rng=rng).to_genome() for _ in range(args.population)] + agents)
+            report = compare_simulations(mapgen.describe(), genomes, args.ticks, args.sensing,
+                                         args.weight_dtype and np.dtype(args.weight_dtype).type,
+                                         args.pose_tolerance, args.sensor_tolerance)
+            result = "ok" if report.divergence is None else f"diverged at tick {report.divergence.tick}"
+            print(f"{size:>4} {seed:>4} {report.ticks:>5} {report.max_pose_error:>9.2e} "
+                  f"{report.max_sensor_error:>10.2e}  {result}")
+            if report.divergence is not None:
+                diverged += 1
+                print(report.divergence)
+
+    sys.exit(1 if diverged else 0)
+
+
+if __name__ == '__main__':
+    main()
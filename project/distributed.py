@@ -0,0 +1,338 @@
+"""
+Distributed training over plain TCP. One coordinator owns the environment, i.e. the genetic algorithm, the curriculum
+and the map schedule, and any number of workers, on this or other machines, connect to it and simulate the runs.
+
+Every generation, the coordinator splits the population's genomes into batches and sends each batch to a worker as a
+task, together with a description of the current map. A worker simulates a full run of its batch on that map and
+replies with a summary of every vehicle's data, which the coordinator puts back into its environment before ending the
+run as usual. Runs are deterministic given the genomes and the map, so the result is the same as training in one
+process. If a worker disconnects or doesn't reply in time, its task is given to another worker.
+
+Messages are JSON objects, one per line:
+
+- Coordinator to worker: {"type": "task", "id": 0, "map": {...}, "ticks_per_run": 750, "physics": {...},
+  "simulation": {"sensing": "exact", "weight_dtype": null}, "genomes": [[...], ...]}
+- Worker to coordinator: {"type": "result", "id": 0, "ticks": 412, "datas": [{...}, ...]}, or
+  {"type": "error", "id": 0, "error": "..."} if the task couldn't be read or simulated
+
+A task that fails on a worker, or that's lost with MAX_ATTEMPTS workers, fails the training instead of being retried
+forever.
+
+Run `python -m project.distributed coordinator --local-workers 4` to train with 4 local worker processes, or start the
+coordinator with `--host 0.0.0.0` and run `python -m project.distributed worker --host <coordinator>` on every machine.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from project import enums
+from project.environment import Environment
+from project.models import VehicleData
+from project.sensing import SENSING_BACKENDS
+
+HOST = "127.0.0.1"
+PORT = 8766
+PHYSICS = ("VEHICLE_MAXSPEED", "VEHICLE_DSPEED", "VEHICLE_DANGLE", "SENSOR_LENGTH")  # Sent with every task
+SUMMARY_FIELDS = ("collision", "displacement_start", "displacement_goal", "progress", "is_finished", "ticks_taken")
+LINE_LIMIT = 2 ** 28  # Longest message in bytes. Tasks and results of big batches are well over asyncio's 64 KiB
+MAX_ATTEMPTS = 3  # Workers a task is given to before the training fails
+
+
+@dataclass
+class _Task:
+    id: int
+    start: int  # Index of the task's first genome in the population
+    message: dict
+    future: asyncio.Future
+    attempts: int = 0  # Number of workers it was given to
+
+
+class Coordinator:
+    def __init__(self, env: Environment, batch_size: int = 5, task_timeout: float = 300.0):
+        self.env = env
+        self.batch_size = batch_size
+        self.task_timeout = task_timeout  # Seconds a worker has to reply to a task before it's reassigned
+        self.workers: int = 0  # Number of connected workers
+        self.reassigned: int = 0  # Number of tasks that had to be given to another worker
+
+        # The coordinator never simulates, so there are no episodes to cache. Every genome is sent to the workers, so
+        # none can be screened out by a surrogate either, which would replace their simulated fitness with a guess
+        self.env.episode_cache = None
+        if self.env.surrogate is not None:
+            print("The surrogate isn't supported in distributed training, so every genome is simulated")
+            self.env.surrogate = None
+
+        self._tasks: asyncio.Queue[_Task | None] | None = None  # None tells a worker's handler to disconnect it
+        self._handlers: set[asyncio.Task] = set()
+        self._next_id: int = 0
+
+    async def train(self, host: str = HOST, port: int = PORT, cycles: int = 1, max_generations: int | None = None):
+        # Trains until the map sizes have been progressed through `cycles` times or for `max_generations` generations
+        self._tasks = asyncio.Queue()
+        server = await asyncio.start_server(self._handle_worker, host, port, limit=LINE_LIMIT)
+        print(f"Coordinator listening on {host}:{port}")
+
+        start = time.perf_counter()
+        try:
+            async with server:
+                while self.env.completed_cycles < cycles and (max_generations is None or
+                                                              self.env.generation < max_generations):
+                    await self.run_generation()
+                    latest = self.env.metrics.latest()
+                    print(f"Generation {self.env.generation}: map size {self.env.get_map_size()}, "
+                          f"best fitness {latest['best_fitness']:.3f}, {latest['finished']} finished, "
+                          f"{self.workers} workers, {time.perf_counter() - start:.1f}s")
+        finally:
+            # Drop the tasks of a failed generation, and disconnect the workers
+            while not self._tasks.empty():
+                self._tasks.get_nowait()
+            handlers = tuple(self._handlers)
+            for _ in handlers:
+                self._tasks.put_nowait(None)
+            if handlers:
+                await asyncio.wait(handlers, timeout=5)
+
+    async def run_generation(self):
+        env = self.env
+        if env.weight_store:
+            genomes = env.weight_store.genomes
+        else:
+            genomes = np.array([agent.to_genome() for agent in env.vehicle_agents()])
+
+        base = {
+            "type": "task",
+            "map": env.mapgen.describe(),
+            "ticks_per_run": env.ticks_per_run,
+            "physics": {name: getattr(enums, name) for name in PHYSICS},
+            "simulation": simulation_settings(env)
+        }
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for start in range(0, len(genomes), self.batch_size):
+            message = {**base, "id": self._next_id, "genomes": genomes[start:start + self.batch_size].tolist()}
+            tasks.append(_Task(self._next_id, start, message, loop.create_future()))
+            self._next_id += 1
+            self._tasks.put_nowait(tasks[-1])
+
+        results = await asyncio.gather(*(task.future for task in tasks))
+
+        # Put the workers' results into the vehicles' data and end the run, as if it was simulated here
+        datas = env.vehicle_datas()
+        for task, result in zip(tasks, results):
+            for offset, summary in enumerate(result["datas"]):
+                apply_summary(datas[task.start + offset], summary)
+        env.current_ticks = max(result["ticks"] for result in results)
+        env.completed_runs += 1
+        env.end_current_run()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._handlers.add(asyncio.current_task())
+        self.workers += 1
+        name = "{}:{}".format(*writer.get_extra_info("peername")[:2])
+        print(f"Worker {name} connected")
+
+        task = None
+        try:
+            while True:
+                task = await self._tasks.get()
+                if task is None:
+                    break
+                task.attempts += 1
+                await _send(writer, task.message)
+                line = await asyncio.wait_for(reader.readline(), self.task_timeout)
+                if not line:
+                    raise ConnectionError("Disconnected")
+
+                # Workers handle one task at a time, so an error is about this task, even if it couldn't be read
+                result = json.loads(line)
+                if result.get("type") == "error":
+                    # The worker is fine, but the task would fail on any other worker too
+                    task.future.set_exception(RuntimeError(f"Task {task.id} failed on worker {name}: "
+                                                           f"{result.get('error')}"))
+                elif result.get("id") != task.id:
+                    raise ValueError(f"Expected the result of task {task.id}, got {result.get('id')}")
+                else:
+                    task.future.set_result(result)
+                task = None
+        except (ConnectionError, asyncio.TimeoutError, ValueError, KeyError) as error:
+            print(f"Lost worker {name}: {error!r}")
+        finally:
+            # Give the unfinished task to another worker, unless it was already lost with too many of them
+            if task is not None and not task.future.done():
+                if task.attempts >= MAX_ATTEMPTS:
+                    task.future.set_exception(RuntimeError(f"Task {task.id} was lost with {task.attempts} workers"))
+                else:
+                    self.reassigned += 1
+                    self._tasks.put_nowait(task)
+            self.workers -= 1
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+
+def simulation_settings(env: Environment) -> dict:
+    # The settings of an environment, other than the physics, that change how its runs play out
+    sensing = next(name for name, backend in SENSING_BACKENDS.items() if type(env.sensing) is backend)
+    weight_dtype = env.weight_store.genomes.dtype.name if env.weight_store else None
+    return {"sensing": sensing, "weight_dtype": weight_dtype}
+
+
+def simulate_task(task: dict, envs: dict[tuple, Environment]) -> dict:
+    """
+    Simulates a full run of a task's genomes on its map, and returns the result message. The environments are kept in
+    `envs` by population size and simulation settings, so that they, and their episode caches, are reused between
+    tasks.
+    """
+    for name, value in task["physics"].items():
+        setattr(enums, name, value)
+
+    genomes = np.array(task["genomes"])
+    settings = task["simulation"]
+    key = (len(genomes), settings["sensing"], settings["weight_dtype"])
+    if key not in envs:
+        weight_dtype = settings["weight_dtype"] and np.dtype(settings["weight_dtype"]).type
+        envs[key] = Environment(population=len(genomes), weight_dtype=weight_dtype)
+        envs[key].configure({"sensing": settings["sensing"]})
+    env = envs[key]
+
+    env.ticks_per_run = task["ticks_per_run"]
+    env.mapgen.load(task["map"])
+    if env.weight_store:
+        env.weight_store.set_genomes(genomes)
+    else:
+        for agent, genome in zip(env.vehicle_agents(), genomes):
+            agent.weights = agent.from_genome(genome)
+    env.reset_vehicles()
+
+    while not env.simulate_tick():
+        pass
+
+    return {"type": "result", "id": task["id"], "ticks": env.current_ticks,
+            "datas": [summarise(data) for data in env.vehicle_datas()]}
+
+
+def summarise(data: VehicleData) -> dict:
+    # The parts of a vehicle's data that the coordinator needs, as JSON serialisable values
+    return {
+        "collision": [float(value) for value in data.collision] if data.collision else None,
+        "displacement_start": float(data.displacement_start),
+        "displacement_goal": float(data.displacement_goal),
+        "progress": float(data.progress),
+        "is_finished": bool(data.is_finished),
+        "ticks_taken": int(data.ticks_taken)
+    }
+
+
+def apply_summary(data: VehicleData, summary: dict):
+    for name in SUMMARY_FIELDS:
+        setattr(data, name, summary[name])
+    data.collision = tuple(data.collision) if data.collision else None
+
+
+def run_worker(host: str = HOST, port: int = PORT, connect_timeout: float = 30.0):
+    # Worker process entry point
+    asyncio.run(_work(host, port, connect_timeout))
+
+
+async def _work(host: str, port: int, connect_timeout: float):
+    # Keep trying to connect for a while, as the coordinator might not be up yet
+    deadline = time.monotonic() + connect_timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.5)
+
+    envs: dict[tuple, Environment] = {}
+    try:
+        while True:
+            # A message that's too long or malformed is answered with an error, rather than ending the worker
+            task = None
+            try:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = json.loads(line)
+                result = simulate_task(task, envs)
+            except (ValueError, KeyError, TypeError) as error:
+                task_id = task.get("id") if isinstance(task, dict) else None
+                result = {"type": "error", "id": task_id, "error": repr(error)}
+            await _send(writer, result)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+def _coordinate(args: argparse.Namespace):
+    env = Environment(population=args.population, seed=args.seed)
+    env.set_learning_mode(True)
+    if args.environment:
+        with open(args.environment) as file:
+            env.configure(json.load(file))
+    env.agents_dir = args.output
+
+    # Local worker processes, mainly for trying it out on one machine
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=run_worker, args=(args.host, args.port), daemon=True)
+               for _ in range(args.local_workers)]
+    for worker in workers:
+        worker.start()
+
+    coordinator = Coordinator(env, args.batch_size or math.ceil(args.population / max(args.local_workers, 1)),
+                              args.task_timeout)
+    asyncio.run(coordinator.train(args.host, args.port, args.cycles, args.max_generations))
+
+    # Stopped early, so save the agents here. See project.server._run_training()
+    if env.completed_cycles < args.cycles:
+        env.save_best_agent(env.agents_dir, last_generation=True)
+    print(f"Done after {env.generation} generations, {coordinator.reassigned} tasks reassigned. "
+          f"Agents saved to {os.path.abspath(env.agents_dir)}")
+
+    for worker in workers:
+        worker.join(timeout=5)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distributed training with a coordinator and workers over TCP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator", help="Run the training and hand out runs to workers")
+    coordinator_parser.add_argument("-p", "--population", type=int, default=enums.NUM_POPULATION)
+    coordinator_parser.add_argument("-b", "--batch-size", type=int, default=None,
+                                    help="Genomes per task (default: population split over the local workers)")
+    coordinator_parser.add_argument("-c", "--cycles", type=int, default=1,
+                                    help="How many times to progress through the map sizes")
+    coordinator_parser.add_argument("-g", "--max-generations", type=int, default=None, help="Stop after N generations")
+    coordinator_parser.add_argument("-s", "--seed", type=int, default=None, help="Root seed, for replaying a training")
+    coordinator_parser.add_argument("-e", "--environment", default=None,
+                                    help="JSON file of environment parameters, see Environment.PARAMETERS")
+    coordinator_parser.add_argument("-l", "--local-workers", type=int, default=0, help="Worker processes to start here")
+    coordinator_parser.add_argument("-t", "--task-timeout", type=float, default=300.0,
+                                    help="Seconds before an unanswered task is given to another worker")
+    coordinator_parser.add_argument("-o", "--output", default=Environment.AGENTS_DIR, help="Directory to save agents")
+
+    subparsers.add_parser("worker", help="Connect to a coordinator and simulate runs for it")
+
+    args = parser.parse_args()
+    if args.command == "coordinator":
+        _coordinate(args)
+    else:
+        run_worker(args.host, args.port)
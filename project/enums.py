@@ -5,3 +5,6 @@ VEHICLE_DSPEED = 1
 VEHICLE_DANGLE = 5
 SENSOR_LENGTH = 1000
 NUM_POPULATION = 20
+MIN_MAP_SIZE = 3
+MAX_MAP_SIZE = 200
+MIN_TILE_SIZE = CANVAS_SIZE / 11  # Maps larger than 11 keep this tile size and are scaled down to fit the canvas
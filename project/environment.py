@@ -1,15 +1,56 @@
-import csv
 import json
 import math
 import os
 import pickle
+import time
 from datetime import datetime
 
+import numpy as np
+
 from project import enums
 from project import utils
-from project.agent import NavigatorAgent, GeneticAlgorithm as GA
-from project.map_gen import MapGenerator, MapTile, Direction
+from project.agent import NavigatorAgent, WeightStore, GeneticAlgorithm as GA
+from project.cache import EpisodeCache
+from project.curriculum import CURRICULA, Curriculum, FixedCurriculum
+from project.events import EventBus, GenerationEvent, MapEvent, RunEndEvent, TickEvent, VehicleEvent
+from project.map_gen import MapGenerator, Direction
+from project.metrics import MetricsBuffer
 from project.models import Vehicle, VehicleData
+from project.optimizers import OPTIMIZERS, GeneticOptimizer, Optimizer
+from project.sensing import SENSING_BACKENDS, ExactSensing, SensingBackend
+from project.surrogate import SURROGATES, Surrogate
+
+
+class _Observed:
+    """
+    An attribute of the environment whose changes are versioned, see Environment.changed_since(). Assigning it bumps
+    the state version only when the value is different from before.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __get__(self, env, owner=None):
+        if env is None:
+            return self
+        try:
+            return env.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name) from None
+
+    def __set__(self, env, value):
+        values = env.__dict__
+        if self.name not in values or not _equal(values[self.name], value):
+            env.touch(self.name)
+        values[self.name] = value
+
+
+def _equal(a, b) -> bool:
+    # Whether two values of an observed attribute are the same. Objects without a comparison only equal themselves
+    try:
+        return a is b or bool(a == b)
+    except (TypeError, ValueError):
+        return False
 
 
 class Environment:
@@ -17,7 +58,30 @@ class Environment:
     AGENTS_DIR = os.path.join(PROJECT_ROOT, "agents")
     EXPERIMENTS_DIR = os.path.join(PROJECT_ROOT, "experiments")
 
-    def __init__(self):
+    # Parameters that can be set through configure(), e.g. from a job spec
+    PARAMETERS = (
+        "ticks_per_run", "learning_mode", "auto_reset", "regen_n_runs", "regen_n_runs_enabled", "resize_n_regens",
+        "resize_n_regens_enabled", "dynamic_mutation", "mutation_chance", "mutation_rate", "carryover_percentage",
+        "map_size_range", "curriculum", "sensing", "fitness_measure", "optimizer",
+        "surrogate", "prefetch_maps"
+    )
+
+    # Observed state that isn't an attribute of the environment, and is marked as changed with touch(). "map" is a
+    # new map, "vehicles" is vehicles put back at the start, and "physics" is any of the vehicles' physics enums
+    TOUCHED = ("map_size", "prefetch_maps", "map", "vehicles", "physics")
+
+    # Settings, counters and state whose changes are versioned, so that an interface only refreshes what changed and
+    # only repaints when there is something new to show. Changing any of them bumps the state version
+    OBSERVED = frozenset(PARAMETERS + TOUCHED + (
+        "tick_interval", "current_ticks", "current_map_run", "current_mapsize_run", "generation", "loaded_agent"
+    ))
+
+    def __init__(self, population: int | None = None, weight_dtype: type | None = None,
+                 seed: int | np.random.SeedSequence | None = None):
+        # Versions of the observed state, see changed_since()
+        self.state_version: int = 0
+        self._versions: dict[str, int] = {}
+
         # Environment parameters
         self.tick_interval: int = 20
         self.ticks_per_run: int = 750
@@ -33,120 +97,183 @@ class Environment:
         self.mutation_chance: float = self.mutation_chance_domain[1]
         self.mutation_rate: float = 0.05
         self.carryover_percentage: float = 0.20
+        self.map_size_range: tuple[int, int] = (3, 11)  # The map sizes to progress through, inclusive
+        self.curriculum: Curriculum = FixedCurriculum()
+        self.sensing: SensingBackend = ExactSensing()  # How sensor rays and collisions are answered
+        self.fitness_measure: str = "displacement"  # See GeneticAlgorithm.MEASURES
+        self.optimizer: Optimizer = GeneticOptimizer()  # How the next generation of genomes is produced
+        self.surrogate: Surrogate | None = None  # Screens out unpromising genomes before they're simulated
 
         self.current_ticks: int = 0
         self.current_map_run: int = 0
         self.current_mapsize_run: int = 0
-        self.current_best_vehicle: Vehicle | None = None
+        self._best_vehicle: Vehicle | None = None  # See current_best_vehicle, None until it's asked for
         self.generation: int = 0
 
         self.loaded_agent: str = ""
         self.run_reports: list[dict] = []
         self.experiment_results: dict = {}
 
+        # Output locations and headless bookkeeping
+        self.agents_dir: str = Environment.AGENTS_DIR
+        self.experiments_dir: str = Environment.EXPERIMENTS_DIR
+        self.autosave: bool = True  # Save agents/experiments automatically once the map sizes loop back
+        self.completed_runs: int = 0
+        self.completed_cycles: int = 0
+        self.last_run_reports: list[dict] = []
+        self.last_experiment_results: dict = {}
+        self._last_generation: tuple[np.ndarray, np.ndarray] | None = None  # Genomes and fitnesses last bred from
+
+        # Results of finished and collided episodes, so unchanged agents on an unchanged map aren't simulated again
+        self.episode_cache: EpisodeCache | None = EpisodeCache()
+        self._episode_keys: dict[Vehicle, tuple] = {}
+
+        # Vehicles being simulated this run, vehicles screened out by the surrogate, and the surrogate's predictions
+        self._simulating: np.ndarray = np.zeros(0, dtype=bool)
+        self._active: np.ndarray = np.zeros(0, dtype=int)  # Indices of the vehicles still moving in this run
+        self._screened: np.ndarray = np.zeros(0, dtype=bool)
+        self._predictions: np.ndarray = np.zeros(0)
+
+        # Statistics of every run, i.e. every generation in learning mode, and the time spent on the current run
+        self.metrics: MetricsBuffer = MetricsBuffer()
+        self.events: EventBus = EventBus()  # Lifecycle events, see project/events.py
+        self._run_start: float = time.perf_counter()
+        self._tick_seconds: float = 0.0
+
+        # Random number generators. The agents, genetic algorithm and map generator each get an independent stream
+        # spawned from one root seed, so any run can be replayed from that seed
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.agent_rng, self.ga_rng, self.map_rng = (np.random.default_rng(child)
+                                                     for child in self.seed_sequence.spawn(3))
+
         # Map
         map_size: int = 3
-        self.mapgen = MapGenerator(enums.CANVAS_SIZE // map_size, map_size)
+        self.mapgen = MapGenerator(enums.CANVAS_SIZE // map_size, map_size, self.map_rng)
 
         # Initialise vehicles
         x, y = self._calculate_vehicle_start()
-        vehicles = (Vehicle(x, y, enums.VEHICLE_SIZE, enums.VEHICLE_SIZE, 90) for _ in range(enums.NUM_POPULATION))
+        population = population or enums.NUM_POPULATION
+        vehicles = (Vehicle(x, y, enums.VEHICLE_SIZE, enums.VEHICLE_SIZE, 90) for _ in range(population))
+
+        # Initialise vehicles' agents, optionally with their weights packed into one buffer of the given dtype
+        self.weight_store: WeightStore | None = None
+        if weight_dtype:
+            self.weight_store = WeightStore(population, weight_dtype, self.agent_rng)
+        agents = self.weight_store.agents if self.weight_store else (NavigatorAgent(rng=self.agent_rng)
+                                                                     for _ in range(population))
 
         # Initialise vehicles' agents and datas
         self.vehicles: dict[Vehicle, tuple[NavigatorAgent, VehicleData]] = {
-            vehicle: (NavigatorAgent(), VehicleData(*self._find_sensor_intersections(vehicle)))
-            for vehicle in vehicles
+            vehicle: (agent, VehicleData([])) for vehicle, agent in zip(vehicles, agents)
         }
+        self._vehicle_order: tuple[Vehicle, ...] = tuple(self.vehicles)  # Vehicles are never added or removed
+        self._calculate_vehicle_datas(self.get_vehicles())
+        self._prepare_episodes()
 
     def tick(self):
+        if self.simulate_tick():
+            self.completed_runs += 1
+            if not self.learning_mode:
+                self.run_reports.append(self.report_current_run())
+            self.end_current_run()
+
+    def simulate_tick(self) -> bool:
+        # Moves all the vehicles by one tick without ending the run. Returns whether the current run is done
+        start = time.perf_counter()
         self.current_ticks += 1
 
-        # Iterate through vehicles and do a bunch of calculations
+        # Only move the active vehicles, i.e. those that haven't collided, finished or been screened out, and sense
+        # for all of them at once
+        vehicles = self.get_vehicles()
+        moving = self._active.tolist()
+        for i in moving:
+            vehicles[i].move()
+        self._calculate_vehicle_datas([vehicles[i] for i in moving])
+
+        # Iterate through the moving vehicles and do a bunch of calculations
         last_tile = self.mapgen.tiles()[-1]
-        for vehicle, (agent, data) in self.vehicles.items():
-
-            # Only calculate for vehicles that haven't collided or finished
-            if not (data.collision or data.is_finished):
-                vehicle.move()
-                self._calculate_vehicle_data(vehicle)
-
-                # Check if past finish line
-                (x1, y1), (x2, y2) = last_tile.finish_line()
-                if last_tile.to_direction == Direction.RIGHT:
-                    data.is_finished = vehicle.x >= x1 and y1 <= vehicle.y <= y2
-                elif last_tile.to_direction == Direction.DOWN:
-                    data.is_finished = vehicle.y >= y1 and x1 <= vehicle.x <= x2
-                elif last_tile.to_direction == Direction.LEFT:
-                    data.is_finished = vehicle.x <= x1 and y1 <= vehicle.y <= y2
-
-                if data.is_finished:
-                    data.ticks_taken = self.current_ticks
-
-                # Use agent to predict vehicle movement
-                inputs = [distance for (_, _), distance in data.intersections] + [vehicle.speed()]
+        batch_indices, batch_inputs = [], []
+        still_active = np.ones(len(moving), dtype=bool)
+        for j, i in enumerate(moving):
+            vehicle = vehicles[i]
+            agent, data = self.vehicles[vehicle]
+            # Check if past finish line
+            (x1, y1), (x2, y2) = last_tile.finish_line()
+            if last_tile.to_direction == Direction.RIGHT:
+                data.is_finished = vehicle.x >= x1 and y1 <= vehicle.y <= y2
+            elif last_tile.to_direction == Direction.DOWN:
+                data.is_finished = vehicle.y >= y1 and x1 <= vehicle.x <= x2
+            elif last_tile.to_direction == Direction.LEFT:
+                data.is_finished = vehicle.x <= x1 and y1 <= vehicle.y <= y2
+
+            if data.is_finished:
+                data.ticks_taken = self.current_ticks
+
+            if data.collision or data.is_finished:
+                still_active[j] = False
+                self._cache_episode(vehicle, data)
+                event = "vehicle_finished" if data.is_finished else "vehicle_collided"
+                if self.events.wants(event):
+                    self.events.emit(event, VehicleEvent(self.current_ticks, i, vehicle.x, vehicle.y, vehicle.theta))
+
+            # Use agent to predict vehicle movement. Packed agents are predicted together after the loop
+            inputs = [distance for (_, _), distance in data.intersections] + [vehicle.speed()]
+            if self.weight_store:
+                batch_indices.append(i)
+                batch_inputs.append(inputs)
+            else:
                 dtheta, dspeed = agent.predict(inputs)
                 vehicle.theta += dtheta
                 vehicle.change_speed(dspeed)
 
-        # Get current best fit vehicle
-        all_ticks = [data.ticks_taken for data in self.vehicle_datas()]
-        fitness: list[tuple[Vehicle, float]] = [(vehicle, GA.fitness(data, all_ticks))
-                                                for vehicle, (_, data) in self.vehicles.items()]
-        fitness.sort(key=lambda pair: pair[1], reverse=True)
-        self.current_best_vehicle = fitness[0][0]
+        if batch_indices:
+            outputs = self.weight_store.predict(np.array(batch_inputs), np.array(batch_indices))
+            for i, (dtheta, dspeed) in zip(batch_indices, outputs.tolist()):
+                vehicles[i].theta += dtheta
+                vehicles[i].change_speed(dspeed)
+
+        # Vehicles that collided or finished drop out of the active set. The best vehicle is found again when asked for
+        self._active = self._active[still_active]
+        self._best_vehicle = None
+        self._tick_seconds += time.perf_counter() - start
+        if self.events.wants("tick"):
+            self.events.emit("tick", TickEvent(self.current_ticks, len(moving)))
 
         # Check if current run is done
-        ticks_finished = self.current_ticks >= self.ticks_per_run
-        all_collided_or_finished = all(data.collision or data.is_finished for data in self.vehicle_datas())
-        done = ticks_finished or all_collided_or_finished
-        if done:
-            if not self.learning_mode:
-                self.run_reports.append(self.report_current_run())
-            self.end_current_run()
+        return self.current_ticks >= self.ticks_per_run or not len(self._active)
 
     def end_current_run(self, reset: bool = False, proceed_nextgen: bool = False):
-        if self.regen_n_runs_enabled:
-            # Update current map run if haven't reached limit
-            if self.current_map_run + 1 < self.regen_n_runs:
-                self.current_map_run += 1
-
-            # Regenerate current map if current_map_run >= regen_n_runs
+        self._record_metrics()
+
+        # The curriculum decides whether to regenerate or resize the map
+        success = any(data.is_finished for data in self.vehicle_datas())
+        if self.events.wants("run_end"):
+            latest = self.metrics.latest()
+            self.events.emit("run_end", RunEndEvent(
+                self.generation, self.get_map_size(), self.current_ticks, success, int(latest["finished"]),
+                int(latest["collided"]), float(latest["best_fitness"]), float(latest["mean_fitness"])))
+        step = self.curriculum.next_step(self, success)
+
+        if step.completed:  # This signifies the completion of a learning process or experiment
+            # TODO (low): Somehow stop the simulation once it loops back
+            if self.learning_mode:
+                if self.autosave:
+                    self.save_best_agent(self.agents_dir)
             else:
-                self.current_map_run = 0
-
-                if self.resize_n_regens_enabled:
-                    # Update current map size run if haven't reached limit
-                    if self.current_mapsize_run + 1 < self.resize_n_regens:
-                        self.current_mapsize_run += 1
-
-                    # Resize map once reached limit
-                    else:
-                        self.current_mapsize_run = 0
-
-                        # Increment map size by one
-                        new_size = self.get_map_size() + 1
-                        if new_size > 11:  # This also signifies the completion of a learning process or experiment
-                            new_size = 3
-
-                            # TODO (low): Somehow stop the simulation once it loops back
-                            if self.learning_mode:
-                                self.save_best_agent(Environment.AGENTS_DIR)
-                            else:
-                                self.compile_reports()
-                                self.save_experiment(self.EXPERIMENTS_DIR)
-                                self.run_reports.clear()
-                                self.experiment_results.clear()
-
-                        self.change_map_size(new_size)
-
-                self.mapgen.regenerate()
-
-        # If success
-        if any(data.is_finished for data in self.vehicle_datas()):
-            pass
-        elif self.learning_mode:
-            self.current_map_run = 0
-            self.current_mapsize_run = 0
+                self.compile_reports()
+                if self.autosave:
+                    self.save_experiment(self.experiments_dir)
+                self.last_run_reports = self.run_reports
+                self.last_experiment_results = self.experiment_results
+                self.run_reports = []
+                self.experiment_results = {}
+            self.completed_cycles += 1
+
+        if step.map_size is not None:
+            self.change_map_size(step.map_size)
+        if step.regenerate:
+            self.mapgen.regenerate()
+            self._map_regenerated()
 
         # Auto reset
         if self.auto_reset or reset:
@@ -154,55 +281,117 @@ class Environment:
                 self.proceed_next_generation()
             self.reset_vehicles()
 
-    def proceed_next_generation(self):
-        # Get next generation
-        population = [agent.to_genome() for agent in self.vehicle_agents()]
+    def _record_metrics(self):
+        now = time.perf_counter()
         datas = self.vehicle_datas()
-        next_generation = GA.next_generation(
-            population, datas,
-            self.carryover_percentage,
-            self.mutation_chance,
-            self.mutation_rate)
+        fitnesses = GA.fitnesses(datas, self.fitness_measure)
+        correlation = math.nan
+        if self.surrogate is not None and self.learning_mode:
+            correlation = self._observe_episodes(fitnesses)
+
+        # Vehicles screened out by the surrogate weren't run, so the statistics are of the simulated and cached ones
+        evaluated = fitnesses[~self._screened]
+        self.metrics.record(
+            generation=self.generation,
+            map_size=self.get_map_size(),
+            best_fitness=evaluated.max(),
+            mean_fitness=evaluated.mean(),
+            median_fitness=np.median(evaluated),
+            finished=sum(bool(data.is_finished) for data in datas),
+            collided=sum(bool(data.collision) for data in datas),
+            mutation_chance=self.mutation_chance,
+            ticks_per_second=self.current_ticks / (now - self._run_start),
+            ms_per_tick=self._tick_seconds * 1000 / max(self.current_ticks, 1),
+            simulated=self._simulating.sum(),
+            surrogate_correlation=correlation
+        )
 
-        all_ticks = [data.ticks_taken for data in datas]
-        fitted_datas = sorted(datas, key=lambda data: GA.fitness(data, all_ticks), reverse=True)
+    def proceed_next_generation(self):
+        # Get next generation
+        population = self._genomes()
+        fitnesses = GA.fitnesses(self.vehicle_datas(), self.fitness_measure)
+        if self._screened.any():
+            # Screened out genomes weren't simulated, so they rank by their predicted fitness below all the others
+            floor = fitnesses[~self._screened].min()
+            fitnesses[self._screened] = np.clip(self._predictions[self._screened], 0, floor)
+        self._last_generation = (population.copy(), fitnesses)
+        next_generation = self.optimizer.next_generation(self, population, fitnesses)
 
         # Apply next generation to agents
-        for agent, genome in zip(self.vehicle_agents(), next_generation):
-            agent.weights = agent.from_genome(genome)
+        if self.weight_store:
+            self.weight_store.set_genomes(next_generation)
+        else:
+            for agent, genome in zip(self.vehicle_agents(), next_generation):
+                agent.weights = agent.from_genome(genome)
 
         # Adjust chance of mutation if dynamic mutation is True
         if self.dynamic_mutation:
-            num = math.ceil(len(fitted_datas) * self.carryover_percentage)
-            top = fitted_datas[:num]
-            avg_fitness = utils.average([GA.fitness(data, all_ticks) for data in top])
+            num = math.ceil(len(fitnesses) * self.carryover_percentage)
+            avg_fitness = float(np.mean(np.sort(fitnesses)[::-1][:num]))
             adjusted = math.tanh(1 / avg_fitness) if avg_fitness else self.mutation_chance_domain[1]
             self.mutation_chance = utils.squash(adjusted, self.mutation_chance_domain)
 
         self.generation += 1
+        if self.events.wants("generation"):
+            self.events.emit("generation", GenerationEvent(self.generation, float(fitnesses.max()),
+                                                           float(fitnesses.mean()), self.mutation_chance))
 
     def reset_vehicles(self):
         self.current_ticks = 0
+        self._run_start = time.perf_counter()
+        self._tick_seconds = 0.0
 
         for vehicle, (_, data) in self.vehicles.items():
             vehicle.x, vehicle.y = self._calculate_vehicle_start()
             vehicle.reset()
             data.reset()
-            self._calculate_vehicle_data(vehicle)
+        self._calculate_vehicle_datas(self.get_vehicles())
+
+        self._prepare_episodes()
+        self.touch("vehicles")
 
     def regenerate_map(self):
         self.current_mapsize_run = 0
         self.current_map_run = 0
         self.mapgen.regenerate()
+        self._map_regenerated()
         self.reset_vehicles()
 
     def change_map_size(self, value: int):
         change = value - self.get_map_size()
-        size = int(utils.change_cutoff(self.get_map_size(), change, 3, 11))
+        size = int(utils.change_cutoff(self.get_map_size(), change, enums.MIN_MAP_SIZE, enums.MAX_MAP_SIZE))
         self.mapgen.set_map_size(size)
-        self.mapgen.set_tile_size(enums.CANVAS_SIZE / size)
-
-    def save_best_agent(self, directory: str):
+        self.mapgen.set_tile_size(MapGenerator.tile_size_for(size))
+        self.touch("map_size")
+
+    def touch(self, name: str):
+        # Marks a piece of the observed state as changed
+        self.state_version += 1
+        self._versions[name] = self.state_version
+
+    def set_physics(self, name: str, value):
+        # Changes one of the vehicles' physics enums, e.g. "SENSOR_LENGTH", which are shared by all environments
+        setattr(enums, name, value)
+        self.touch("physics")
+
+    def changed_since(self, version: int) -> set[str]:
+        # Names of the observed state that changed after the given state version
+        if version >= self.state_version:
+            return set()
+        return {name for name, changed in self._versions.items() if changed > version}
+
+    def save_best_agent(self, directory: str, last_generation: bool = False):
+        """
+        Saves the best agent and the average of the best agents.
+
+        Parameters
+        ----------
+        directory: str
+            The directory to save them in.
+        last_generation: bool
+            Whether to save the best of the generation that was last bred from, instead of the current vehicles, e.g.
+            when stopping right after a new generation's vehicles were reset.
+        """
         if not os.path.exists(directory):
             os.makedirs(directory, exist_ok=True)
 
@@ -215,22 +404,49 @@ class Environment:
         file_paths = [os.path.join(directory, file_name) for file_name in file_names]
         for file_path in file_paths:
             with open(file_path, "wb") as file:
-                if "_avg" in file_path:
+                if last_generation and self._last_generation is not None:
+                    genomes, fitnesses = self._last_generation
+                    if "_avg" in file_path:
+                        agent = self._average_genomes(genomes, fitnesses)
+                    else:
+                        agent = NavigatorAgent()
+                        agent.weights = agent.from_genome(genomes[int(np.argmax(fitnesses))])
+                elif "_avg" in file_path:
                     agent = self._average_best_weights()
                 else:
                     agent = self.vehicle_agent(self.current_best_vehicle)
 
                 pickle.dump(agent, file)
 
-    def load_agent(self, path: str):
+    def load_agent(self, path: str, index: int = 0):
         with open(path, "rb") as file:
             new_agent = pickle.load(file)
 
-            # Replace first vehicle's agent with the new loaded agent
-            vehicle = self.get_vehicles()[0]
+            # Replace the vehicle's agent (the first vehicle by default) with the new loaded agent
+            vehicle = self.get_vehicles()[index]
             data = self.vehicle_data(vehicle)
             data.is_custom_agent = True
+            data.screened = self._screened[index] = False
             self.vehicles[vehicle] = (new_agent, data)
+            if self.weight_store:
+                self.weight_store.adopt(index, new_agent)
+
+            # Before the run has started, the vehicle starts over, e.g. from a restored episode of the old agent, as
+            # an episode of the new agent that can be cached. Later in the run, it carries on from where the old agent
+            # got it, which is no agent's episode, so it isn't cached
+            self._episode_keys.pop(vehicle, None)
+            if self.current_ticks == 0:
+                vehicle.x, vehicle.y = self._calculate_vehicle_start()
+                vehicle.reset()
+                data.reset()
+                self._calculate_vehicle_datas([vehicle])
+                self._simulating[index] = True
+                if self.episode_cache is not None:
+                    self._episode_keys[vehicle] = EpisodeCache.key(new_agent, self.mapgen.map_key(),
+                                                                   self.ticks_per_run)
+            self.touch("vehicles")
+            self._update_active()
+            self._best_vehicle = None
 
         self.loaded_agent = path
 
@@ -264,7 +480,8 @@ class Environment:
             key = f"map{size}"
             maps = tuple(filter(lambda report: report["map_size"] == size, self.run_reports))
             collisions = sum([int(report["collided"]) for report in maps])
-            avg_ticks = utils.average([report["ticks_taken"] for report in maps if report["ticks_taken"]])
+            ticks = [report["ticks_taken"] for report in maps if report["ticks_taken"]]
+            avg_ticks = utils.average(ticks) if ticks else None  # None if the agent never reached the goal
 
             self.experiment_results[key]["runs"] = len(maps)
             self.experiment_results[key]["collisions"] = collisions
@@ -273,18 +490,22 @@ class Environment:
     def save_experiment(self, directory: str):
         current = datetime.now().strftime("%Y%m%d_%H%M%S")
         experiment_dir = os.path.join(directory, f"exp_{current}")
-        if not os.path.exists(experiment_dir):
-            os.makedirs(experiment_dir, exist_ok=True)
+        self.write_experiment(experiment_dir, self.run_reports, self.experiment_results)
 
-        run_reports_path = os.path.join(experiment_dir, "run_reports.json")
+    @staticmethod
+    def write_experiment(directory: str, run_reports: list[dict], experiment_results: dict):
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+        run_reports_path = os.path.join(directory, "run_reports.json")
         with open(run_reports_path, "w") as file:
-            json.dump(self.run_reports, file)
+            json.dump(run_reports, file)
 
-        exp_results_path = os.path.join(experiment_dir, "experiment_results.json")
+        exp_results_path = os.path.join(directory, "experiment_results.json")
         with open(exp_results_path, "w") as file:
-            json.dump(self.experiment_results, file)
+            json.dump(experiment_results, file)
 
-        self._convert_experiment_to_csv(self.experiment_results, experiment_dir)
+        Environment._convert_experiment_to_csv(experiment_results, directory)
 
     def set_learning_mode(self, enabled: bool):
         self.learning_mode = enabled
@@ -299,11 +520,90 @@ class Environment:
             self.regen_n_runs = 1
             self.resize_n_regens = 50
 
+    @staticmethod
+    def validate_parameters(parameters: dict):
+        """
+        Raises a ValueError if any of the given parameters is unknown or has a value out of its range, without applying
+        any of them. configure() checks its parameters with this first, so a bad one doesn't half configure it.
+        """
+        registries = {"curriculum": ("curriculum", CURRICULA), "sensing": ("sensing backend", SENSING_BACKENDS),
+                      "fitness_measure": ("fitness measure", GA.MEASURES), "optimizer": ("optimizer", OPTIMIZERS),
+                      "surrogate": ("surrogate", SURROGATES)}
+        flags = ("learning_mode", "auto_reset", "regen_n_runs_enabled", "resize_n_regens_enabled", "dynamic_mutation")
+        counts = {"ticks_per_run": 1, "regen_n_runs": 1, "resize_n_regens": 1, "prefetch_maps": 0}  # Name to minimum
+        fractions = ("mutation_chance", "carryover_percentage")
+
+        def is_int(value) -> bool:
+            return isinstance(value, int) and not isinstance(value, bool)
+
+        def is_number(value) -> bool:
+            return is_int(value) or isinstance(value, float)
+
+        for name, value in parameters.items():
+            if name not in Environment.PARAMETERS:
+                raise ValueError(f"Unknown environment parameter '{name}'")
+
+            if name in registries:
+                label, registry = registries[name]
+                if not (isinstance(value, str) and value in registry or name == "surrogate" and value is None):
+                    raise ValueError(f"Unknown {label} '{value}'. Choose from: {', '.join(registry)}")
+            elif name in flags and not isinstance(value, bool):
+                raise ValueError(f"'{name}' must be true or false, got {value!r}")
+            elif name in counts and not (is_int(value) and value >= counts[name]):
+                raise ValueError(f"'{name}' must be an integer of at least {counts[name]}, got {value!r}")
+            elif name in fractions and not (is_number(value) and 0 <= value <= 1):
+                raise ValueError(f"'{name}' must be a number within 0 and 1, got {value!r}")
+            elif name == "mutation_rate" and not (is_number(value) and value >= 0):
+                raise ValueError(f"'{name}' must be a number of at least 0, got {value!r}")
+            elif name == "map_size_range" and not (isinstance(value, (list, tuple)) and len(value) == 2 and
+                                                   all(map(is_int, value)) and
+                                                   enums.MIN_MAP_SIZE <= value[0] <= value[1] <= enums.MAX_MAP_SIZE):
+                raise ValueError(f"'{name}' must be a minimum and maximum map size within {enums.MIN_MAP_SIZE} and "
+                                 f"{enums.MAX_MAP_SIZE}, got {value!r}")
+
+    def configure(self, parameters: dict):
+        Environment.validate_parameters(parameters)
+
+        # Learning mode goes first, as it overrides some of the other parameters
+        for name in sorted(parameters, key=lambda name: name != "learning_mode"):
+            value = parameters[name]
+            if name == "learning_mode":
+                self.set_learning_mode(value)
+            elif name == "curriculum":
+                self.curriculum = CURRICULA[value]()
+            elif name == "sensing":
+                self.sensing = SENSING_BACKENDS[value]()
+                if self.episode_cache is not None:
+                    self.episode_cache.clear()  # Episodes sensed by another backend could end differently
+            elif name == "fitness_measure":
+                self.fitness_measure = value
+            elif name == "surrogate":
+                self.surrogate = SURROGATES[value]() if value is not None else None
+            elif name == "optimizer":
+                self.optimizer = OPTIMIZERS[value]()
+            elif name == "prefetch_maps":
+                self.mapgen.set_prefetch(value)
+                self.touch(name)
+            elif name == "map_size_range":
+                self.map_size_range = tuple(value)
+                self.change_map_size(self.map_size_range[0])
+                self.regenerate_map()
+            else:
+                setattr(self, name, value)
+
     def get_map_size(self):
         return self.mapgen.map_size()
 
+    @property
+    def current_best_vehicle(self) -> Vehicle:
+        # The fittest vehicle right now. Only worked out when asked for, so ticks don't score the whole population
+        if self._best_vehicle is None:
+            fitnesses = GA.fitnesses(self.vehicle_datas(), self.fitness_measure)
+            self._best_vehicle = self.get_vehicles()[int(np.argmax(fitnesses))]
+        return self._best_vehicle
+
     def get_vehicles(self):
-        return tuple(vehicle for vehicle in self.vehicles.keys())
+        return self._vehicle_order
 
     def vehicle_agent(self, vehicle: Vehicle):
         return self.vehicles[vehicle][0]
@@ -323,61 +623,137 @@ class Environment:
         y = enums.VEHICLE_SIZE / 2 + 10
         return x, y
 
-    def _closest_tiles(self, vehicle: Vehicle):
-        def distance(tile: MapTile):
-            tile_center = tile.x + (tile.size / 2), tile.y + (tile.size / 2)
-            return utils.distance_2p(tile_center, (vehicle.x, vehicle.y))
-
-        return sorted(self.mapgen.tiles(), key=distance)
-
-    def _find_sensor_intersections(self, vehicle: Vehicle):
-        intersections = {}
-        collision = None
-        tiles = self._closest_tiles(vehicle)
-        for i, sensor in enumerate(vehicle.sensors):
-            first_intersected = False
-            for j, tile in enumerate(tiles):
-                if first_intersected:
-                    break
-                for k, border in enumerate(tile.borders):
-                    if border:
-                        if not collision:
-                            collision = vehicle.collides(border)
-
-                        if tile_intersects := sensor.intersects(border, vehicle.theta):
-                            intersections[sensor] = tile_intersects
-                            first_intersected = True
-                            break
-                        else:
-                            intersections[sensor] = (sensor.end(vehicle.theta), enums.SENSOR_LENGTH)
-
-        return list(intersections.values()), collision
-
-    def _calculate_vehicle_data(self, vehicle: Vehicle):
-        data = self.vehicle_data(vehicle)
-        data.intersections, data.collision = self._find_sensor_intersections(vehicle)
-        data.displacement_start = utils.distance_2p(self._calculate_vehicle_start(), vehicle.pos())
-        data.displacement_goal = utils.distance_2p(self.mapgen.tiles()[-1].center(), vehicle.pos())
+    def _find_sensor_intersections(self, vehicles: list[Vehicle]):
+        # Senses for all the given vehicles in one query to the sensing backend
+        self.sensing.prepare(self.mapgen)
+
+        # Every sensor sees the nearest wall its line intersects, or nothing within its length
+        rays = np.concatenate([vehicle.sensor_rays() for vehicle in vehicles])
+        nearest = self.sensing.cast(rays)
+        points = rays[:, :2] + np.where(np.isfinite(nearest), nearest, 1)[:, None] * (rays[:, 2:] - rays[:, :2])
+        distances = np.sqrt(np.sum((points - rays[:, :2]) ** 2, axis=1))
+
+        intersections = []
+        for point, distance, hit in zip(points.tolist(), distances.tolist(), np.isfinite(nearest).tolist()):
+            intersections.append((tuple(point), distance if hit else enums.SENSOR_LENGTH))
+        sensors = len(intersections) // len(vehicles)
+        intersections = [intersections[i:i + sensors] for i in range(0, len(intersections), sensors)]
+
+        collisions = self.sensing.collisions(np.stack([vehicle.border_lines() for vehicle in vehicles]))
+        return intersections, collisions
+
+    def _map_regenerated(self):
+        self.touch("map")
+        if self.events.wants("map_regenerated"):
+            layout = self.mapgen.layout()
+            self.events.emit("map_regenerated", MapEvent(layout.map_size(), layout.tile_size, layout.key))
+
+    def _genomes(self) -> np.ndarray:
+        # The population's genomes as a matrix, one row per vehicle
+        if self.weight_store:
+            return self.weight_store.genomes
+        return np.asarray([agent.to_genome() for agent in self.vehicle_agents()], dtype=float)
+
+    def _prepare_episodes(self):
+        # Called at the start of every run. Vehicles whose episode is already cached skip straight to its end result,
+        # and in learning mode, the surrogate screens out the least promising of the others
+        self._episode_keys.clear()
+        self._simulating = np.ones(len(self.vehicles), dtype=bool)
+        self._screened = np.zeros(len(self.vehicles), dtype=bool)
+        self._predictions = np.full(len(self.vehicles), np.nan)
+        if self.episode_cache is not None:
+            self._restore_episodes()
+        if self.surrogate is not None and self.learning_mode and self._simulating.any():
+            self._screen_episodes()
+        self._update_active()
+        self._best_vehicle = None
+
+    def _update_active(self):
+        # Rebuilds the active set from the vehicles' datas. Ticks only remove from it, see simulate_tick()
+        self._active = np.flatnonzero([not (data.collision or data.is_finished or data.screened)
+                                       for data in self.vehicle_datas()])
+
+    def _restore_episodes(self):
+        map_key = self.mapgen.map_key()
+        for i, (vehicle, (agent, data)) in enumerate(self.vehicles.items()):
+            key = EpisodeCache.key(agent, map_key, self.ticks_per_run)
+            if cached := self.episode_cache.get(key):
+                cached_data, pose = cached
+                data.intersections = cached_data.intersections
+                data.collision = cached_data.collision
+                data.displacement_start = cached_data.displacement_start
+                data.displacement_goal = cached_data.displacement_goal
+                data.progress = cached_data.progress
+                data.is_finished = cached_data.is_finished
+                data.ticks_taken = cached_data.ticks_taken
+                vehicle.set_pose(*pose)
+                self._simulating[i] = False
+            else:
+                self._episode_keys[vehicle] = key
+
+    def _screen_episodes(self):
+        candidates = np.flatnonzero(self._simulating)
+        simulate, self._predictions[candidates] = self.surrogate.screen(self._genomes()[candidates], self.ga_rng)
+        vehicles = self.get_vehicles()
+        for i in candidates[~simulate].tolist():
+            self.vehicle_data(vehicles[i]).screened = True
+            self._episode_keys.pop(vehicles[i], None)
+        self._screened[candidates[~simulate]] = True
+        self._simulating[candidates[~simulate]] = False
+
+    def _observe_episodes(self, fitnesses: np.ndarray) -> float:
+        # Hands the results of the simulated vehicles to the surrogate. Returns the rank correlation of its predictions
+        simulated = self._simulating
+        self.surrogate.observe(self._genomes()[simulated], fitnesses[simulated], self._predictions[simulated])
+        return self.surrogate.history[-1]["rank_correlation"]
+
+    def _cache_episode(self, vehicle: Vehicle, data: VehicleData):
+        key = self._episode_keys.pop(vehicle, None)
+
+        # The physics parameters might have been changed through the interface during the run
+        if key and self.episode_cache is not None and key[2] == EpisodeCache.physics_key(self.ticks_per_run):
+            self.episode_cache.put(key, data, (vehicle.x, vehicle.y, vehicle.theta))
+
+    def _calculate_vehicle_datas(self, vehicles: list[Vehicle]):
+        if not vehicles:
+            return
+
+        start, goal = self._calculate_vehicle_start(), self.mapgen.tiles()[-1].center()
+        progresses = self.mapgen.progress(np.array([vehicle.pos() for vehicle in vehicles])).tolist()
+        sensed = zip(*self._find_sensor_intersections(vehicles))
+        for vehicle, (intersections, collision), progress in zip(vehicles, sensed, progresses):
+            data = self.vehicle_data(vehicle)
+            data.intersections, data.collision = intersections, collision
+            data.displacement_start = utils.distance_2p(start, vehicle.pos())
+            data.displacement_goal = utils.distance_2p(goal, vehicle.pos())
+            if not math.isnan(progress):  # Off the track, e.g. while colliding, keeps the last progress
+                data.progress = progress
 
     def _average_best_weights(self) -> NavigatorAgent:
-        all_ticks = [data.ticks_taken for data in self.vehicle_datas()]
-        best_fits: list[tuple[Vehicle, float]] = [(vehicle, GA.fitness(data, all_ticks))
-                                                  for vehicle, (_, data) in self.vehicles.items()]
-        best_fits.sort(key=lambda pair: pair[1], reverse=True)
+        fitnesses = GA.fitnesses(self.vehicle_datas(), self.fitness_measure)
+        best_fits = np.argsort(-fitnesses, kind="stable")
 
         num = math.ceil(len(self.vehicles) * self.carryover_percentage)
-        best_agents: list[NavigatorAgent] = [self.vehicle_agent(vehicle) for vehicle, _ in best_fits][:num]
+        if self.weight_store:
+            avg_genome = self.weight_store.average(best_fits[:num])
+        else:
+            agents = self.vehicle_agents()
+            avg_genome = np.mean([agents[i].to_genome() for i in best_fits[:num]], axis=0)
 
         avg_agent: NavigatorAgent = NavigatorAgent()
-        for layer in range(len(avg_agent.weights)):
-            for row in range(len(avg_agent.weights[layer])):
-                for weight in range(len(avg_agent.weights[layer][row])):
-                    avg_weights = utils.average([agent.weights[layer][row][weight] for agent in best_agents])
-                    avg_agent.weights[layer][row][weight] = avg_weights
+        avg_agent.weights = avg_agent.from_genome(avg_genome)
+        return avg_agent
 
+    def _average_genomes(self, genomes: np.ndarray, fitnesses: np.ndarray) -> NavigatorAgent:
+        # Same as _average_best_weights(), but of the given genomes
+        best_fits = np.argsort(-fitnesses, kind="stable")
+        num = math.ceil(len(genomes) * self.carryover_percentage)
+        avg_agent: NavigatorAgent = NavigatorAgent()
+        avg_agent.weights = avg_agent.from_genome(np.mean(genomes[best_fits[:num]], axis=0))
         return avg_agent
 
-    def _convert_experiment_to_csv(self, experiment: dict, directory: str):
+    @staticmethod
+    def _convert_experiment_to_csv(experiment: dict, directory: str):
         map_keys = tuple(filter(lambda key: key.startswith("map"), experiment.keys()))
         map_sizes = [int(key[3:]) for key in map_keys]
         collisions = [experiment[key]["collisions"] for key in map_keys]
@@ -387,10 +763,10 @@ class Environment:
 
         collisions_path = os.path.join(directory, "collisions.csv")
         avg_ticks_path = os.path.join(directory, "avg_ticks.csv")
-        self._write_csv(collisions_path, collisions_csv)
-        self._write_csv(avg_ticks_path, avg_ticks_csv)
+        utils.write_csv(collisions_path, collisions_csv)
+        utils.write_csv(avg_ticks_path, avg_ticks_csv)
+
 
-    def _write_csv(self, path: str, data: list):
-        with open(path, "w") as file:
-            writer = csv.writer(file, delimiter=" ")
-            writer.writerows(data)
+# The observed settings and counters that are attributes, i.e. all but the touched ones
+for _name in Environment.OBSERVED - set(Environment.TOUCHED):
+    setattr(Environment, _name, _Observed(_name))
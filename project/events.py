@@ -0,0 +1,113 @@
+"""
+Lifecycle events of an environment, for anything that wants to follow a simulation as it happens instead of polling
+it, e.g. recorders, metrics exporters and viewers. Subscribe to an environment's events with:
+
+    env.events.on("vehicle_finished", callback)  # Called with a VehicleEvent, in the simulation's thread
+    env.events.on("run_end", coroutine_function, loop=loop)  # Scheduled on the given asyncio loop
+    env.events.on("tick", queue)  # A queue.Queue, or an asyncio.Queue of the simulation's thread, which gets
+                                  # (event, payload) tuples
+
+The environment only builds an event's payload when the event has subscribers, so unsubscribed events cost one
+dictionary lookup.
+"""
+
+import asyncio
+import queue
+from dataclasses import dataclass
+from typing import Callable
+
+EVENTS = ("tick", "vehicle_finished", "vehicle_collided", "run_end", "generation", "map_regenerated")
+
+
+@dataclass
+class TickEvent:
+    tick: int  # Ticks into the run
+    moving: int  # Number of vehicles that moved in this tick
+
+
+@dataclass
+class VehicleEvent:
+    tick: int
+    vehicle: int  # Index of the vehicle in the population
+    x: float
+    y: float
+    theta: float
+
+
+@dataclass
+class RunEndEvent:
+    generation: int
+    map_size: int
+    ticks: int
+    success: bool  # Whether any vehicle reached the goal
+    finished: int
+    collided: int
+    best_fitness: float
+    mean_fitness: float
+
+
+@dataclass
+class GenerationEvent:
+    generation: int  # The new generation
+    best_fitness: float  # Of the previous generation
+    mean_fitness: float
+    mutation_chance: float
+
+
+@dataclass
+class MapEvent:
+    map_size: int
+    tile_size: float
+    map_key: bytes
+
+
+class EventBus:
+    """
+    Calls the subscribers of an event, in the order they subscribed, whenever the event is emitted.
+    """
+
+    def __init__(self):
+        self._subscribers: dict[str, list[Callable]] = {}
+
+    def on(self, event: str, subscriber, loop: asyncio.AbstractEventLoop | None = None) -> Callable:
+        """
+        Subscribes to an event. The subscriber can be a function, which is called with the payload, a coroutine
+        function, which is run on the given loop (the running loop by default), or a queue, which is put
+        (event, payload) tuples without blocking.
+
+        Returns
+        -------
+        Callable
+            A function that unsubscribes the subscriber again.
+        """
+        if event not in EVENTS:
+            raise ValueError(f"Unknown event '{event}'. Choose from: {', '.join(EVENTS)}")
+
+        if isinstance(subscriber, (queue.Queue, asyncio.Queue)):
+            callback = lambda payload: subscriber.put_nowait((event, payload))
+        elif asyncio.iscoroutinefunction(subscriber):
+            loop = loop or asyncio.get_running_loop()
+            callback = lambda payload: asyncio.run_coroutine_threadsafe(subscriber(payload), loop)
+        else:
+            callback = subscriber
+
+        self._subscribers.setdefault(event, []).append(callback)
+        return lambda: self._unsubscribe(event, callback)
+
+    def wants(self, event: str) -> bool:
+        # Whether the event has any subscribers, so the payload is worth building
+        return event in self._subscribers
+
+    def emit(self, event: str, payload):
+        for callback in self._subscribers.get(event, ()):
+            callback(payload)
+
+    def clear(self):
+        self._subscribers.clear()
+
+    def _unsubscribe(self, event: str, callback: Callable):
+        callbacks = self._subscribers.get(event, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+        if not callbacks:
+            self._subscribers.pop(event, None)
@@ -0,0 +1,180 @@
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from project import utils
+from project.environment import Environment
+
+
+def run_experiment(agent_path: str, runs_per_size: int = 50, parameters: dict | None = None,
+                   seed: int | np.random.SeedSequence | None = None) -> tuple[list[dict], dict]:
+    """
+    Runs the map size 3 to 11 evaluation of a single saved agent without any interface. This is the same evaluation
+    the Experiment Mode does, but it returns once the map sizes loop back instead of running forever. Any given
+    environment parameters are applied on top of the Experiment Mode's, see Environment.configure(). The maps are
+    generated from the given seed, so the same seed gives the same experiment.
+
+    Returns
+    -------
+    tuple
+        The run reports and the compiled experiment results.
+    """
+    env = Environment(population=1, seed=seed)
+    env.set_learning_mode(False)
+    env.resize_n_regens = runs_per_size
+    env.autosave = False
+    env.configure(parameters or {})
+    env.load_agent(agent_path)
+
+    while not env.completed_cycles:
+        env.tick()
+
+    return env.last_run_reports, env.last_experiment_results
+
+
+def compile_experiments(experiments: list[dict], confidence: float = 0.95) -> dict:
+    """
+    Compiles the experiment results of repeated experiments of the same agent into the mean, standard deviation and
+    confidence interval of the collisions and average ticks per map size. Map sizes where an agent never reached the
+    goal are ignored for the ticks statistics of that experiment. The confidence interval is of the Student's t
+    distribution, as there are usually only a few repeats. With fewer than 2 samples, the standard deviation and
+    confidence interval are unknown, i.e. None.
+    """
+    sizes = sorted({int(key[3:]) for experiment in experiments for key in experiment if key.startswith("map")})
+    collisions = np.array([[experiment.get(f"map{size}", {}).get("collisions", np.nan) for size in sizes]
+                           for experiment in experiments], dtype=float)
+    avg_ticks = np.array([[experiment.get(f"map{size}", {}).get("average_ticks", None) for size in sizes]
+                          for experiment in experiments], dtype=float)  # None becomes NaN
+
+    compiled = {"experiments": len(experiments), "confidence": confidence}
+    for name, values in (("collisions", collisions), ("average_ticks", avg_ticks)):
+        counts = np.sum(~np.isnan(values), axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(values, axis=0) / counts
+            std = np.where(counts > 1, np.sqrt(np.nansum((values - mean) ** 2, axis=0) / (counts - 1)), np.nan)
+            t = np.array([_t_quantile(confidence, count - 1) if count > 1 else np.nan for count in counts.tolist()])
+            half_width = t * std / np.sqrt(counts)
+
+        for i, size in enumerate(sizes):
+            compiled.setdefault(f"map{size}", {})[name] = {
+                "mean": _json_float(mean[i]),
+                "std": _json_float(std[i]),
+                "ci_low": _json_float(mean[i] - half_width[i]),
+                "ci_high": _json_float(mean[i] + half_width[i]),
+                "samples": int(counts[i])
+            }
+
+    return compiled
+
+
+class ExperimentHarness:
+    """
+    Runs the evaluation of several saved agents, each repeated a number of times, in a pool of worker processes. The
+    results are written to `output_dir/<label>/repeat_<n>/`, and the compiled statistics of each agent to
+    `output_dir/<label>/summary.json` and `output_dir/<label>/summary.csv`. Every repeat gets its own seed, spawned
+    from one root seed in the order of the agents and repeats, so the whole harness can be replayed from the root seed.
+    """
+
+    def __init__(self, agents: dict[str, str], repeats: int, output_dir: str, runs_per_size: int = 50,
+                 workers: int | None = None, confidence: float = 0.95, seed: int | None = None):
+        if repeats < 1:
+            raise ValueError(f"The number of repeats must be at least 1, got {repeats}")
+
+        self.agents = agents  # Label to agent file path
+        self.repeats = repeats
+        self.output_dir = output_dir
+        self.runs_per_size = runs_per_size
+        self.workers = workers
+        self.confidence = confidence
+        self.seed_sequence = np.random.SeedSequence(seed)
+
+    def run(self) -> dict[str, dict]:
+        results: dict[str, list[dict]] = {label: [] for label in self.agents}
+
+        jobs = [(label, path, repeat) for label, path in self.agents.items() for repeat in range(self.repeats)]
+        seeds = self.seed_sequence.spawn(len(jobs))
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = {
+                executor.submit(_run_repeat, path, self._repeat_dir(label, repeat), self.runs_per_size, seed): label
+                for (label, path, repeat), seed in zip(jobs, seeds)
+            }
+            for future in as_completed(futures):
+                label = futures[future]
+                experiment_results, elapsed = future.result()
+                results[label].append(experiment_results)
+                print(f"{label}: {len(results[label])}/{self.repeats} done ({elapsed:.1f}s)")
+
+        summaries = {label: {"seed": self.seed_sequence.entropy, **compile_experiments(experiments, self.confidence)}
+                     for label, experiments in results.items()}
+        for label, summary in summaries.items():
+            self._write_summary(os.path.join(self.output_dir, label), summary)
+
+        return summaries
+
+    def _repeat_dir(self, label: str, repeat: int) -> str:
+        return os.path.join(self.output_dir, label, f"repeat_{repeat:02d}")
+
+    def _write_summary(self, directory: str, summary: dict):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "summary.json"), "w") as file:
+            json.dump(summary, file, indent=2)
+
+        rows = [("Map Sizes",
+                 "Collisions Mean", "Collisions Std", "Collisions CI Low", "Collisions CI High",
+                 "Average Ticks Mean", "Average Ticks Std", "Average Ticks CI Low", "Average Ticks CI High")]
+        for key in filter(lambda key: key.startswith("map"), summary.keys()):
+            row = [int(key[3:])]
+            for name in ("collisions", "average_ticks"):
+                stats = summary[key][name]
+                # Unknown statistics are written as nan, as an empty field would shift the space delimited columns
+                row += ["nan" if value is None else value
+                        for value in (stats["mean"], stats["std"], stats["ci_low"], stats["ci_high"])]
+            rows.append(tuple(row))
+
+        utils.write_csv(os.path.join(directory, "summary.csv"), rows)
+
+
+def _run_repeat(agent_path: str, directory: str, runs_per_size: int,
+                seed: np.random.SeedSequence) -> tuple[dict, float]:
+    # Worker process entry point. Writes the same files as the Experiment Mode into the given directory.
+    start = time.perf_counter()
+    run_reports, experiment_results = run_experiment(agent_path, runs_per_size, seed=seed)
+    Environment.write_experiment(directory, run_reports, experiment_results)
+    return experiment_results, time.perf_counter() - start
+
+
+def _t_quantile(confidence: float, df: int) -> float:
+    """
+    The t such that the given fraction of Student's t distribution with df degrees of freedom is within -t and t.
+    Found by bisection of the closed form of P(|T| < t) for integer degrees of freedom, as SciPy isn't a dependency.
+    Referenced from Abramowitz and Stegun, 26.7.3 and 26.7.4.
+    """
+    def within(theta: float) -> float:
+        # P(|T| < t) where theta = atan(t / sqrt(df))
+        sin, cos2 = math.sin(theta), math.cos(theta) ** 2
+        if df % 2:
+            term, total = 1.0, 1.0 if df > 1 else 0.0
+            for k in range(3, df, 2):
+                term *= cos2 * (k - 1) / k
+                total += term
+            return 2 / math.pi * (theta + sin * math.cos(theta) * total)
+        term, total = 1.0, 1.0
+        for k in range(2, df, 2):
+            term *= cos2 * (k - 1) / k
+            total += term
+        return sin * total
+
+    low, high = 0.0, math.pi / 2
+    for _ in range(60):
+        middle = (low + high) / 2
+        low, high = (middle, high) if within(middle) < confidence else (low, middle)
+    return math.sqrt(df) * math.tan((low + high) / 2)
+
+
+def _json_float(value: float) -> float | None:
+    return None if np.isnan(value) else float(value)
@@ -1,6 +1,12 @@
-import random
+import hashlib
+import math
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
 
+import numpy as np
+
+from project import enums
 from project import utils
 from project.types import *
 
@@ -94,12 +100,160 @@ class MapTile:
         return f"({self.from_direction.value},{self.to_direction.value})"
 
 
+# Direction codes of the compact map encoding, indices of DIRECTIONS
+RIGHT, DOWN, LEFT, UP = range(4)
+DIRECTIONS = (Direction.RIGHT, Direction.DOWN, Direction.LEFT, Direction.UP)
+_STEPS = ((1, 0), (0, 1), (-1, 0), (0, -1))  # (dx, dy) of every direction code
+_STEP_VECTORS = np.array(_STEPS, dtype=float)
+_CHOICES = {LEFT: (LEFT, DOWN), RIGHT: (RIGHT, DOWN), DOWN: (LEFT, RIGHT, DOWN)}  # Next directions after a heading
+
+
+def _opposite(direction: int) -> int:
+    return (direction + 2) % 4
+
+
+@dataclass(frozen=True, eq=False)
+class MapLayout:
+    """
+    A generated map in its compact form. `grid` is a (map_size, map_size) int8 array of the tiles, where 0 is no tile
+    and any other value is 1 + (from_direction << 2) + to_direction of the tile's direction codes. `path` is a
+    (tiles, 4) array of the (x, y, from_direction, to_direction) of every tile in order, from the start to the finish.
+    `walls` is a (walls, 4) array of the x1, y1, x2, y2 of the map's walls in grid units, where collinear walls that
+    touch are merged into one.
+
+    `indices` is a (map_size, map_size) array of the index in `path` of every tile, or -1 where there is no tile, and
+    `lengths` is the length of the track up to the start of every tile in grid units, followed by its total length.
+    The track runs through the middle of the tiles, straight through straight tiles and as a quarter circle around
+    the inner corner of turns, so together they give how far along the track any point is without searching the path.
+    """
+    tile_size: float
+    grid: np.ndarray
+    path: np.ndarray
+    walls: np.ndarray
+    key: bytes  # Identifies the map, including its tile size
+    indices: np.ndarray
+    lengths: np.ndarray
+
+    @staticmethod
+    def from_path(tile_size: float, map_size: int, path: np.ndarray) -> "MapLayout":
+        grid = np.zeros((map_size, map_size), dtype=np.int8)
+        x, y, from_direction, to_direction = path.T
+        grid[y, x] = 1 + (from_direction << 2) + to_direction
+        return MapLayout.create(tile_size, grid, path)
+
+    @staticmethod
+    def create(tile_size: float, grid: np.ndarray, path: np.ndarray) -> "MapLayout":
+        digest = hashlib.blake2b(repr(float(tile_size)).encode(), digest_size=16)
+        digest.update(path.tobytes())
+
+        indices = np.full(grid.shape, -1, dtype=np.int32)
+        indices[path[:, 1], path[:, 0]] = np.arange(len(path))
+        turns = path[:, 3] != (path[:, 2] + 2) % 4
+        lengths = np.concatenate(([0.0], np.cumsum(np.where(turns, math.pi / 4, 1.0))))
+        return MapLayout(tile_size, grid, path, _merge_walls(path), digest.digest(), indices, lengths)
+
+    def map_size(self) -> int:
+        return len(self.grid)
+
+    def progress(self, points: np.ndarray) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        points: np.ndarray
+            An (n, 2) array of positions in pixels.
+
+        Returns
+        -------
+        np.ndarray
+            How far along the track each point is, as a fraction of the track's length from 0 at the start to 1 at the
+            end of the last tile, or NaN where a point is not on a tile. The finish line is in the middle of the last
+            tile, so a vehicle that finishes is about half a tile short of 1, e.g. at 2.5 / 3 on a track of 3 straight
+            tiles.
+        """
+        grid_points = points / self.tile_size
+        cells = np.floor(grid_points).astype(np.int64)
+        size = self.map_size()
+        on_grid = np.all((cells >= 0) & (cells < size), axis=1)
+        index = np.where(on_grid, self.indices.ravel()[np.where(on_grid, cells[:, 1] * size + cells[:, 0], 0)], -1)
+        tile = np.maximum(index, 0)
+
+        # Position within the tile, relative to the middle of its from and to sides
+        local = grid_points - cells - 0.5
+        entry, exit = _STEP_VECTORS[self.path[tile, 2]], _STEP_VECTORS[self.path[tile, 3]]
+
+        # Straight tiles are projected onto their direction, and turns go by the angle around their inner corner
+        corner = local - (entry + exit) / 2
+        within = np.where(np.any(entry + exit != 0, axis=1),
+                          np.arctan2(np.einsum("ij,ij->i", corner, -entry),
+                                     np.einsum("ij,ij->i", corner, -exit)) / (math.pi / 2),
+                          np.einsum("ij,ij->i", local - entry / 2, -entry))
+        within = np.clip(within, 0, 1) * (self.lengths[tile + 1] - self.lengths[tile])
+        return np.where(index >= 0, (self.lengths[tile] + within) / self.lengths[-1], np.nan)
+
+
+def _merge_walls(path: np.ndarray) -> np.ndarray:
+    # Collect the unit length walls of every tile, i.e. every side that isn't its from or to direction, except that the
+    # start and finish are closed off. Horizontal walls are keyed by (y, x) and vertical walls by (x, y) of their start
+    horizontal, vertical = set(), set()
+    last = len(path) - 1
+    for i, (x, y, from_direction, to_direction) in enumerate(path.tolist()):
+        openings = {from_direction if i > 0 else None, to_direction if i < last else None}
+        for side in {RIGHT, DOWN, LEFT, UP} - openings:
+            if side == RIGHT:
+                vertical.add((x + 1, y))
+            elif side == DOWN:
+                horizontal.add((y + 1, x))
+            elif side == LEFT:
+                vertical.add((x, y))
+            else:
+                horizontal.add((y, x))
+
+    # Merge runs of consecutive unit walls on the same line
+    walls = []
+    for pieces, is_horizontal in ((horizontal, True), (vertical, False)):
+        run_start = None
+        for line, start in sorted(pieces):
+            if run_start is None or (line, start) != (run_line, run_end):
+                if run_start is not None:
+                    walls.append((run_line, run_start, run_end, is_horizontal))
+                run_line, run_start = line, start
+            run_end = start + 1
+        if run_start is not None:
+            walls.append((run_line, run_start, run_end, is_horizontal))
+
+    return np.array([(start, line, end, line) if is_horizontal else (line, start, line, end)
+                     for line, start, end, is_horizontal in walls], dtype=np.int16).reshape(-1, 4)
+
+
 class MapGenerator:
-    def __init__(self, tile_size: int, map_size: int = 7):
+    """
+    Generates random maps as a path of tiles from the top middle of the grid down to the bottom row or either side
+    column. Generation works on the compact MapLayout in time proportional to the path's length, and the MapTile
+    objects used for drawing and sensing are only created when first asked for.
+
+    With prefetching (see set_prefetch()), the upcoming maps are built ahead, tiles and walls included, in a background
+    thread, so that regenerate() only has to swap in a ready map. Every map is then generated from its own seed, the
+    n-th map from the n-th seed spawned from one root seed, so the maps are the same however far ahead they were built.
+    """
+
+    def __init__(self, tile_size: int, map_size: int = 7, rng: np.random.Generator | None = None):
+        self._rng: np.random.Generator = rng or np.random.default_rng()
         self._map_size: int = map_size
         self._tile_size: int = tile_size
-        self._map: list[list[int | MapTile]] = []
-        self._tiles: list[MapTile] = []
+        self._layout: MapLayout | None = None
+        self._tiles: list[MapTile] | None = None
+        self._map: list[list[int | MapTile]] | None = None
+        self._walls: np.ndarray | None = None
+
+        # Prefetching
+        self._prefetch: int = 0  # Number of maps to keep ready ahead of the current one
+        self._root_seed: int | None = None
+        self._generated: int = 0  # Number of maps generated from the seeds so far
+        self._executor: ThreadPoolExecutor | None = None
+        self._upcoming: dict[tuple, Future] = {}  # (map number, map size, tile size) to the map being built
+        self.prefetch_hits: int = 0
+        self.prefetch_misses: int = 0
+
         self.regenerate()
 
     def set_map_size(self, size: int):
@@ -108,70 +262,192 @@ class MapGenerator:
     def map_size(self) -> int:
         return self._map_size
 
-    def map(self) -> list:
-        return self._map
-
     def set_tile_size(self, size: float):
         self._tile_size = size
 
-    def tiles(self) -> list[MapTile]:
-        return self._tiles
-
-    def regenerate(self) -> list:
-        new = self._generate_map()
-        while new == self._map:
-            new = self._generate_map()
-        self._map = new
+    def layout(self) -> MapLayout:
+        return self._layout
+
+    def describe(self) -> dict:
+        # A JSON serialisable description of the current map, which load() can recreate it from
+        return {"map_size": self._layout.map_size(), "tile_size": self._layout.tile_size,
+                "path": self._layout.path.tolist()}
+
+    def load(self, description: dict):
+        # Replaces the current map with the one from a description made by describe()
+        path = np.array(description["path"], dtype=np.int16).reshape(-1, 4)
+        self._map_size = description["map_size"]
+        self._tile_size = description["tile_size"]
+        self._layout = MapLayout.from_path(self._tile_size, self._map_size, path)
+        self._tiles = None
+        self._map = None
+        self._walls = None
+
+    def map(self) -> list[list[int | MapTile]]:
+        if self._map is None:
+            size = self._layout.map_size()
+            self._map = [[0 for _ in range(size)] for __ in range(size)]
+            for tile, (x, y, _, _) in zip(self.tiles(), self._layout.path.tolist()):
+                self._map[y][x] = tile
         return self._map
 
-    def _generate_map(self):
-        # Generate new map without affecting the existing one
-        new_map: list[list[int | MapTile]] = self._new_map()
+    def tiles(self) -> list[MapTile]:
+        if self._tiles is None:
+            self._tiles = self._create_tiles(self._layout)
+        return self._tiles
 
-        # FYI: I'm aware this is insane spaghetti lol
-        x = self._map_size // 2
+    def walls(self) -> np.ndarray:
+        # The merged walls of the map in pixels, as an (n, 4) array of x1, y1, x2, y2
+        if self._walls is None:
+            self._walls = self._layout.walls * self._layout.tile_size
+        return self._walls
+
+    def map_key(self) -> bytes:
+        # Identifies the current map, including its tile size
+        return self._layout.key
+
+    def progress(self, points: np.ndarray) -> np.ndarray:
+        # How far along the track the points are, see MapLayout.progress()
+        return self._layout.progress(points)
+
+    def set_prefetch(self, count: int):
+        """
+        Keeps `count` upcoming maps of the current map size, and the next map of the next size up, built ahead in a
+        background thread. Turning it on switches to generating every map from its own seed, drawn once from the
+        generator's random number generator. A count of 0 turns it off again.
+        """
+        self._prefetch = count
+        if count and self._root_seed is None:
+            self._root_seed = int(self._rng.integers(2 ** 63))
+        if count and self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="map-prefetch")
+        elif not count and self._executor is not None:
+            for future in self._upcoming.values():
+                future.cancel()
+            self._upcoming.clear()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._fill_upcoming()
+
+    def regenerate(self) -> MapLayout:
+        if self._root_seed is None:
+            rng = self._rng
+            layout = self._generate_layout(rng, self._map_size, self._tile_size)
+            tiles = walls = None
+        else:
+            # Swap in the prefetched map, or build it now if it isn't ready or was built for another size
+            key = (self._generated, self._map_size, self._tile_size)
+            future = self._upcoming.pop(key, None)
+            if future is not None and not future.cancelled():
+                self.prefetch_hits += 1
+                layout, tiles, walls, rng = future.result()
+            else:
+                self.prefetch_misses += 1
+                layout, tiles, walls, rng = self._build(self._root_seed, *key)
+            self._generated += 1
+
+        while self._layout is not None and np.array_equal(layout.path, self._layout.path):
+            layout = self._generate_layout(rng, self._map_size, self._tile_size)
+            tiles = walls = None
+
+        self._layout = layout
+        self._tiles = tiles
+        self._map = None
+        self._walls = walls
+        self._fill_upcoming()
+        return layout
+
+    def _fill_upcoming(self):
+        # Drop the maps that can't be used anymore, and queue the missing ones
+        for key in [key for key in self._upcoming if key[0] < self._generated]:
+            self._upcoming.pop(key).cancel()
+        if self._executor is None:
+            return
+
+        # The next maps of the current size, and the next map of the next size up, in case the map is resized first
+        keys = [(number, self._map_size, self._tile_size)
+                for number in range(self._generated, self._generated + self._prefetch)]
+        keys.append((self._generated, self._map_size + 1, MapGenerator.tile_size_for(self._map_size + 1)))
+        for key in keys:
+            if key not in self._upcoming:
+                self._upcoming[key] = self._executor.submit(self._build, self._root_seed, *key)
+
+    @staticmethod
+    def tile_size_for(map_size: int) -> float:
+        # The tile size that fits a map of the given size onto the canvas, down to the minimum tile size
+        return max(enums.CANVAS_SIZE / map_size, enums.MIN_TILE_SIZE)
+
+    @staticmethod
+    def _build(root_seed: int, number: int, map_size: int,
+               tile_size: float) -> tuple["MapLayout", list[MapTile], np.ndarray, np.random.Generator]:
+        # Generates the given map number from its own seed, with its tiles and walls. Also returns the random number
+        # generator, which the retries continue from if the map happens to be the same as the current one
+        rng = np.random.default_rng(np.random.SeedSequence(root_seed, spawn_key=(number,)))
+        layout = MapGenerator._generate_layout(rng, map_size, tile_size)
+        return layout, MapGenerator._create_tiles(layout), layout.walls * layout.tile_size, rng
+
+    @staticmethod
+    def _generate_layout(rng: np.random.Generator, size: int, tile_size: float) -> MapLayout:
+        grid = np.zeros((size, size), dtype=np.int8)
+        path: list[list[int]] = []
+
+        def place(x: int, y: int, from_direction: int, to_direction: int) -> bool:
+            # Returns whether the tile has reached the end, i.e. the bottom row or either side column
+            grid[y, x] = 1 + (from_direction << 2) + to_direction
+            path.append([x, y, from_direction, to_direction])
+            return x == 0 or x == size - 1 or y == size - 1
+
+        # Draw the random numbers for the steps a chunk at a time as the path grows, so the time taken is proportional
+        # to the path's length rather than the map's area
+        draws = rng.random(2 * size)
+        step = 0
+
+        x = size // 2
+        ended = place(x, 0, UP, DOWN)
         y = 1
-        to_direction: Direction = Direction.DOWN
-        from_direction: Direction = to_direction
-        while self._within_ranges(x, y) and not self._any_ends(new_map):
-            # Determine next direction
-            direction_choices = [Direction.LEFT, Direction.RIGHT, Direction.DOWN]
-            if from_direction == Direction.LEFT:
-                direction_choices.remove(Direction.RIGHT)
-            elif from_direction == Direction.RIGHT:
-                direction_choices.remove(Direction.LEFT)
-            to_direction = random.choice(direction_choices)
-
-            tile = MapTile(self._tile_size, x, y, from_direction.opposite(), to_direction)
-            new_map[y][x] = tile
-            self._tiles.append(tile)
+        heading = DOWN
+        while not ended:
+            if step == len(draws):
+                draws = rng.random(2 * size)
+                step = 0
+            to_direction = _CHOICES[heading][int(draws[step] * len(_CHOICES[heading]))]
+            step += 1
+            ended = place(x, y, _opposite(heading), to_direction)
 
             # This part is to account for when it loops back around immediately
             # This just makes sure there's a gap in between
-            new_x, new_y = self._new_directions(to_direction, x, y)
-            if to_direction != Direction.DOWN and self._within_ranges(new_x, new_y + 1) and new_map[y - 1][new_x]:
+            dx, dy = _STEPS[to_direction]
+            new_x, new_y = x + dx, y + dy
+            if to_direction != DOWN and 0 <= new_x < size and new_y + 1 < size and grid[y - 1, new_x]:
                 new_y += 1
-                new_map[y][x] = MapTile(self._tile_size, x, y, Direction.UP, Direction.DOWN)
-                new_map[new_y][x] = MapTile(self._tile_size, x, new_y, Direction.UP, to_direction)
-                self._tiles.remove(self._tiles[-1])
-                self._tiles.append(new_map[y][x])
-                self._tiles.append(new_map[new_y][x])
+                path.pop()
+                place(x, y, UP, DOWN)
+                ended = place(x, new_y, UP, to_direction) or ended
 
-            from_direction = to_direction
+            heading = to_direction
             x = new_x
             y = new_y
 
-        # Set to_direction of the last tile to the opposite of its from_direction and recalculate its borders
-        self._tiles[-1].to_direction = self._tiles[-1].from_direction.opposite()
-        for tile in self._tiles:
+        # Set to_direction of the last tile to the opposite of its from_direction
+        last = path[-1]
+        last[3] = _opposite(last[2])
+        grid[last[1], last[0]] = 1 + (last[2] << 2) + last[3]
+
+        return MapLayout.create(tile_size, grid, np.array(path, dtype=np.int16))
+
+    @staticmethod
+    def _create_tiles(layout: MapLayout) -> list[MapTile]:
+        tiles = [MapTile(layout.tile_size, x, y, DIRECTIONS[from_direction], DIRECTIONS[to_direction])
+                 for x, y, from_direction, to_direction in layout.path.tolist()]
+        for tile in tiles:
             tile._calculate_borders()
 
         # The next two blocks are for making sure borders at the start and end tiles are there and drawn.
         # This is so the sensors can detect them.
-        first = self._tiles[0]
+        first = tiles[0]
         first.borders[0] = first.top_border()
 
-        last = self._tiles[-1]
+        last = tiles[-1]
         match last.to_direction:
             case Direction.RIGHT:
                 last.borders[1] = last.right_border()
@@ -180,42 +456,10 @@ class MapGenerator:
             case Direction.LEFT:
                 last.borders[3] = last.left_border()
 
-        return new_map
-
-    def _new_directions(self, new: Direction, x: int, y: int) -> tuple[int, int]:
-        new_x = x
-        new_y = y
-
-        if new == Direction.LEFT:
-            new_x -= 1
-        elif new == Direction.RIGHT:
-            new_x += 1
-        else:
-            new_y += 1
-
-        return new_x, new_y
-
-    def _new_map(self):
-        first = MapTile(self._tile_size, self._map_size // 2, 0, Direction.UP, Direction.DOWN)
-        new_map = [[0 for _ in range(self._map_size)] for __ in range(self._map_size)]
-        new_map[0][self._map_size // 2] = first
-        self._tiles = [first]
-        return new_map
-
-    def _any_ends(self, array: list) -> bool:
-        # Check if any of the tiles have reached the end
-        return any(array[self._map_size - 1]) or \
-            any([row[0] for row in array]) or \
-            any([row[-1] for row in array])
-
-    def _within_range(self, num: int) -> bool:
-        return 0 <= num < self._map_size
-
-    def _within_ranges(self, x: int, y: int) -> bool:
-        return self._within_range(x) and self._within_range(y)
+        return tiles
 
     def __repr__(self):
-        return "\n".join([" | ".join([f"{str(item):^5}" for item in row]) for row in self._map])
+        return "\n".join([" | ".join([f"{str(item):^5}" for item in row]) for row in self.map()])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,75 @@
+import numpy as np
+
+METRICS_DTYPE = np.dtype([
+    ("generation", np.int64),
+    ("map_size", np.int32),
+    ("best_fitness", np.float64),
+    ("mean_fitness", np.float64),
+    ("median_fitness", np.float64),
+    ("finished", np.int32),  # Number of vehicles that reached the goal
+    ("collided", np.int32),  # Number of vehicles that collided
+    ("mutation_chance", np.float64),
+    ("ticks_per_second", np.float64),  # Ticks over the wall-clock time of the run, including the time between ticks
+    ("ms_per_tick", np.float64),  # Average time spent inside Environment.tick()
+    ("simulated", np.int32),  # Number of vehicles simulated, i.e. neither cached nor screened out by the surrogate
+    ("surrogate_correlation", np.float64)  # Rank correlation of the surrogate's predictions, NaN without a surrogate
+])
+
+
+class MetricsBuffer:
+    """
+    A fixed-size ring buffer of per-run statistics, stored in one preallocated NumPy structured array of
+    METRICS_DTYPE. Once `capacity` runs have been recorded, the oldest records are overwritten.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.total: int = 0  # Number of records ever written
+        self._data = np.zeros(capacity, dtype=METRICS_DTYPE)
+        self._ramp = np.arange(capacity, dtype=np.int64)  # Scratch space for downsample()
+        self._indices = np.empty(capacity, dtype=np.int64)
+
+    def record(self, **values):
+        row = self._data[self.total % self.capacity]
+        for name, value in values.items():
+            row[name] = value
+        self.total += 1
+
+    def latest(self) -> np.void | None:
+        return self._data[(self.total - 1) % self.capacity] if self.total else None
+
+    def ordered(self) -> np.ndarray:
+        # Copy of the records from oldest to newest
+        return np.roll(self._data, -self.total % self.capacity)[-len(self):] if self.total else self._data[:0].copy()
+
+    def downsample(self, field: str, out: np.ndarray) -> int:
+        """
+        Samples up to len(out) evenly spaced values of a field, from oldest to newest, into the given array without
+        allocating any arrays. Always includes the newest value. `out` must have the same dtype as the field.
+
+        Returns
+        -------
+        int
+            The number of values written to `out`.
+        """
+        length = len(self)
+        count = min(length, len(out))
+        if not count:
+            return 0
+
+        # Positions from oldest to newest: i * (length - 1) // (count - 1) for i in range(count)
+        indices = self._indices[:count]
+        if count == 1:
+            indices[0] = length - 1
+        else:
+            np.multiply(self._ramp[:count], length - 1, out=indices)
+            np.floor_divide(indices, count - 1, out=indices)
+        np.add(indices, self.total - length, out=indices)
+        np.take(self._data[field], indices, out=out[:count], mode="wrap")
+        return count
+
+    def clear(self):
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
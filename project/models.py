@@ -1,6 +1,8 @@
 import math
 from dataclasses import dataclass
 
+import numpy as np
+
 from project import enums
 from project import utils
 from project.types import *
@@ -76,17 +78,19 @@ class Vehicle:
             Sensor(self.x, self.y - self.height / 2, sensor_size, -side_sense_angle),  # Left
         ]
 
-        # Recalibrate positions
-        self._borders_info = [(self._calculate_position_info(*p1), (self._calculate_position_info(*p2)))
-                              for p1, p2 in self._calculate_borders()]
-        self._wheel_info = {}
-        self._sensor_info = {}
-        for wheel in self.wheels:
-            self._wheel_info[wheel] = self._calculate_position_info(wheel.x, wheel.y)
-            wheel.x, wheel.y = self._calculate_position(*self._wheel_info[wheel])
-        for sensor in self.sensors:
-            self._sensor_info[sensor] = self._calculate_position_info(sensor.x, sensor.y)
-            sensor.x, sensor.y = self._calculate_position(*self._sensor_info[sensor])
+        # Positions of the border ends, wheels and sensors relative to the center, as if the angle is 0. Every pose is
+        # then one rotation and translation of all these points at once.
+        border_points = [point for line in self._calculate_borders() for point in line]
+        self._local_points = np.array([(x - self.x, y - self.y) for x, y in border_points] +
+                                      [(part.x - self.x, part.y - self.y) for part in self.wheels + self.sensors])
+        self._sensor_directions = np.array([(math.cos(sensor.theta), math.sin(sensor.theta))
+                                            for sensor in self.sensors])
+
+        # Border lines and sensor rays of the current pose, recalculated whenever the pose or sensor length changes
+        self._pose_key: tuple | None = None
+        self._border_lines = np.empty((4, 4))
+        self._sensor_rays = np.empty((len(self.sensors), 4))
+        self._recalculate_parts()
 
     def move(self):
         # Referenced and modified from https://www.youtube.com/watch?v=zHboXMY45YU
@@ -122,10 +126,23 @@ class Vehicle:
         self.set_speed(0)
         self._recalculate_parts()
 
+    def set_pose(self, x: float, y: float, theta: float):
+        self.x, self.y, self.theta = x, y, theta
+        self._recalculate_parts()
+
     def borders(self) -> list[Line]:
         # Returns the borders' positions relative to the vehicle's current position and angle
-        return [(self._calculate_position(angle1, distance1), self._calculate_position(angle2, distance2))
-                for (angle1, distance1), (angle2, distance2) in self._borders_info]
+        return [((x1, y1), (x2, y2)) for x1, y1, x2, y2 in self.border_lines().tolist()]
+
+    def border_lines(self) -> np.ndarray:
+        # The borders as a (4, 4) array of x1, y1, x2, y2, in the order TOP, RIGHT, BOTTOM, LEFT
+        self._update_pose()
+        return self._border_lines
+
+    def sensor_rays(self) -> np.ndarray:
+        # The sensors' lines at the vehicle's current angle, as an array of x1, y1, x2, y2 in the order of the sensors
+        self._update_pose()
+        return self._sensor_rays
 
     def collides(self, line: Line) -> Point | None:
         for line2 in self.borders():
@@ -134,44 +151,28 @@ class Vehicle:
         return None
 
     def _recalculate_parts(self):
-        # Move wheels
-        for i, wheel in enumerate(self.wheels):
-            wheel.x, wheel.y = self._calculate_position(*self._wheel_info[wheel])
-        # Move sensors
-        for i, sensor in enumerate(self.sensors):
-            sensor.x, sensor.y = self._calculate_position(*self._sensor_info[sensor])
-
-    def _calculate_position(self, angle: float, distance: float) -> Point:
-        """
-        Calculates the position of a point relative to the center of the vehicle, given an angle and distance.
-
-        Parameters
-        ----------
-        angle: float
-            The angle (in radians) of the point relative to the center.
-        distance: float
-            The distance between the center of the vehicle and the point.
-
-        Returns
-        -------
-        tuple
-            The x and y coordinates of the new position.
-        """
-        return utils.point_on_circle((self.x, self.y), distance, self.theta + angle)
-
-    def _calculate_position_info(self, x: float, y: float) -> tuple[float, float]:
-        """
-        Calculates some location information of the given point RELATIVE to the center of the vehicle.
-        This is intended to be used ONLY ONCE during initialisation.
-
-        Returns
-        -------
-        tuple
-            The angle (in radians) and distance of the part from the center.
-        """
-        angle = math.atan2(y - self.y, x - self.x)
-        distance = utils.distance_2p((self.x, self.y), (x, y))
-        return angle, distance
+        self._update_pose()
+
+        # Move wheels and sensors
+        parts = self._points[8:].tolist()
+        for part, (x, y) in zip(self.wheels + self.sensors, parts):
+            part.x, part.y = x, y
+
+    def _update_pose(self):
+        # One rotation of all the local points, only when the pose has changed since the last time
+        key = (self.x, self.y, self.theta, enums.SENSOR_LENGTH)
+        if key == self._pose_key:
+            return
+        self._pose_key = key
+
+        cos, sin = math.cos(self.theta), math.sin(self.theta)
+        rotation = np.array([(cos, sin), (-sin, cos)])  # Transposed, as the points are rows
+        self._points = self._local_points @ rotation + (self.x, self.y)
+        self._border_lines = self._points[:8].reshape(4, 4)
+
+        sensor_points = self._points[8 + len(self.wheels):]
+        self._sensor_rays[:, :2] = sensor_points
+        self._sensor_rays[:, 2:] = sensor_points + enums.SENSOR_LENGTH * (self._sensor_directions @ rotation)
 
     def _calculate_borders(self) -> list[Line]:
         x, y = self.x - self.width / 2, self.y - self.height / 2
@@ -189,13 +190,17 @@ class VehicleData:
     collision: tuple | None = None
     displacement_start: float = 0.0
     displacement_goal: float = 0.0
+    progress: float = 0.0  # Fraction of the track's length driven along it, see MapLayout.progress()
     is_finished: bool = False
     ticks_taken: int = 0
     is_custom_agent: bool = False
+    screened: bool = False  # Whether the surrogate screened the vehicle out of the run, so it isn't simulated
 
     def reset(self):
         self.collision = None
         self.displacement_start = 0.0
         self.displacement_goal = 0.0
+        self.progress = 0.0
         self.is_finished = False
         self.ticks_taken = 0
+        self.screened = False
@@ -0,0 +1,164 @@
+import math
+
+import numpy as np
+
+from project.agent import GeneticAlgorithm as GA
+
+
+class Optimizer:
+    """
+    Produces the next generation of genomes from the current one. Every optimizer consumes the same inputs, the
+    population as a matrix of genomes (one row per vehicle) and a vector of their fitnesses, and returns a genome
+    matrix of the same shape. Subclasses implement next_generation().
+    """
+
+    def next_generation(self, env, genomes: np.ndarray, fitnesses: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class GeneticOptimizer(Optimizer):
+    """
+    The genetic algorithm, using the environment's carry over percentage, mutation chance and mutation rate.
+    """
+
+    def next_generation(self, env, genomes: np.ndarray, fitnesses: np.ndarray) -> np.ndarray:
+        return GA.breed(genomes, fitnesses, env.carryover_percentage, env.mutation_chance, env.mutation_rate,
+                        env.ga_rng)
+
+
+class _DistributionOptimizer(Optimizer):
+    """
+    An optimizer that keeps a search distribution around a mean genome and samples every generation from it. The
+    distribution starts (and starts over) around the fittest genome whenever it is given genomes that it didn't sample
+    itself, e.g. on the first generation or after an agent is loaded.
+    """
+
+    def __init__(self, sigma: float):
+        self.sigma0: float = sigma  # Initial step size, in the scale of the weights
+        self._samples: np.ndarray | None = None
+
+    def next_generation(self, env, genomes: np.ndarray, fitnesses: np.ndarray) -> np.ndarray:
+        # Genomes may have been rounded by the weight store, so compare them loosely
+        genomes = np.asarray(genomes, dtype=float)
+        if self._samples is None or self._samples.shape != genomes.shape or \
+                not np.allclose(self._samples, genomes, rtol=1e-5, atol=1e-6):
+            self._start(genomes[np.argmax(fitnesses)], len(genomes))
+        else:
+            self._update(genomes, np.asarray(fitnesses, dtype=float))
+
+        self._samples = self._sample(len(genomes), env.ga_rng)
+        return self._samples
+
+    def _start(self, mean: np.ndarray, size: int):
+        raise NotImplementedError
+
+    def _update(self, genomes: np.ndarray, fitnesses: np.ndarray):
+        raise NotImplementedError
+
+    def _sample(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        raise NotImplementedError
+
+
+class CMAESOptimizer(_DistributionOptimizer):
+    """
+    Covariance matrix adaptation evolution strategy, maximising fitness. Uses the default (μ/μ_w, λ) parameters, with
+    λ the population size and μ = λ/2.
+    Referenced from: N. Hansen, "The CMA Evolution Strategy: A Tutorial", https://arxiv.org/abs/1604.00772
+    """
+
+    def __init__(self, sigma: float = 0.1):
+        super().__init__(sigma)
+
+    def _start(self, mean: np.ndarray, size: int):
+        n = len(mean)
+        self.mu = size // 2
+        weights = math.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+        self.weights = weights / weights.sum()
+        self.mueff = 1 / np.sum(self.weights ** 2)
+
+        # Learning rates of the evolution paths, covariance matrix and step size
+        self.cc = (4 + self.mueff / n) / (n + 4 + 2 * self.mueff / n)
+        self.cs = (self.mueff + 2) / (n + self.mueff + 5)
+        self.c1 = 2 / ((n + 1.3) ** 2 + self.mueff)
+        self.cmu = min(1 - self.c1, 2 * (self.mueff - 2 + 1 / self.mueff) / ((n + 2) ** 2 + self.mueff))
+        self.damps = 1 + 2 * max(0.0, math.sqrt((self.mueff - 1) / (n + 1)) - 1) + self.cs
+        self.chi_n = math.sqrt(n) * (1 - 1 / (4 * n) + 1 / (21 * n ** 2))  # Expected length of a N(0, I) vector
+
+        self.mean = mean.copy()
+        self.sigma = self.sigma0
+        self.pc, self.ps = np.zeros(n), np.zeros(n)
+        self.C = np.eye(n)
+        self.B, self.D = np.eye(n), np.ones(n)  # C = B diag(D²) B^T
+        self.updates = 0
+
+    def _update(self, genomes: np.ndarray, fitnesses: np.ndarray):
+        n = len(self.mean)
+        order = np.argsort(-fitnesses, kind="stable")[:self.mu]
+        steps = (genomes[order] - self.mean) / self.sigma
+        step = self.weights @ steps
+        self.mean = self.mean + self.sigma * step
+        self.updates += 1
+
+        # Evolution paths. The rank one update is stalled while the step size path is long
+        inv_sqrt_c = (self.B / self.D) @ self.B.T
+        self.ps = (1 - self.cs) * self.ps + math.sqrt(self.cs * (2 - self.cs) * self.mueff) * (inv_sqrt_c @ step)
+        ps_norm = np.linalg.norm(self.ps)
+        hsig = ps_norm / math.sqrt(1 - (1 - self.cs) ** (2 * self.updates)) / self.chi_n < 1.4 + 2 / (n + 1)
+        self.pc = (1 - self.cc) * self.pc + hsig * math.sqrt(self.cc * (2 - self.cc) * self.mueff) * step
+
+        # Covariance matrix and step size
+        self.C = (1 - self.c1 - self.cmu) * self.C \
+            + self.c1 * (np.outer(self.pc, self.pc) + (not hsig) * self.cc * (2 - self.cc) * self.C) \
+            + self.cmu * (steps.T * self.weights) @ steps
+        self.sigma *= math.exp(self.cs / self.damps * (ps_norm / self.chi_n - 1))
+
+        # Keep C symmetric, and its eigenvalues positive against round off
+        self.C = np.triu(self.C) + np.triu(self.C, 1).T
+        eigenvalues, self.B = np.linalg.eigh(self.C)
+        self.D = np.sqrt(np.maximum(eigenvalues, 1e-20))
+
+    def _sample(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        z = rng.standard_normal((size, len(self.mean)))
+        return self.mean + self.sigma * (z * self.D) @ self.B.T
+
+
+class EvolutionStrategy(_DistributionOptimizer):
+    """
+    Natural evolution strategy as used by OpenAI: mirrored Gaussian perturbations of one mean genome, whose fitnesses
+    are replaced by centred ranks and used to estimate the gradient that the mean follows. With an odd population, the
+    last genome is the mean itself.
+    Referenced from: T. Salimans et al., "Evolution Strategies as a Scalable Alternative to Reinforcement Learning",
+    https://arxiv.org/abs/1703.03864
+    """
+
+    def __init__(self, sigma: float = 0.05, learning_rate: float = 0.05):
+        super().__init__(sigma)
+        self.learning_rate: float = learning_rate
+
+    def _start(self, mean: np.ndarray, size: int):
+        self.mean = mean.copy()
+        self.sigma = self.sigma0
+
+    def _update(self, genomes: np.ndarray, fitnesses: np.ndarray):
+        # Centred ranks in [-0.5, 0.5], so the update doesn't depend on the scale of the fitnesses
+        ranks = np.empty(len(fitnesses))
+        ranks[np.argsort(fitnesses, kind="stable")] = np.arange(len(fitnesses))
+        shaped = ranks / max(len(fitnesses) - 1, 1) - 0.5
+
+        noise = (genomes - self.mean) / self.sigma
+        gradient = shaped @ noise / (len(genomes) * self.sigma)
+        self.mean = self.mean + self.learning_rate * gradient
+
+    def _sample(self, size: int, rng: np.random.Generator) -> np.ndarray:
+        noise = rng.standard_normal((size // 2, len(self.mean)))
+        samples = [self.mean + self.sigma * noise, self.mean - self.sigma * noise]
+        if size % 2:
+            samples.append(self.mean[None])
+        return np.concatenate(samples)
+
+
+OPTIMIZERS = {
+    "genetic": GeneticOptimizer,
+    "cmaes": CMAESOptimizer,
+    "es": EvolutionStrategy
+}
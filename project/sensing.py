@@ -0,0 +1,383 @@
+import math
+
+import numpy as np
+
+from project import enums, utils
+from project.map_gen import MapGenerator
+from project.models import Vehicle
+from project.types import *
+
+
+class SensingBackend:
+    """
+    Answers the sensor ray and collision queries of many vehicles at once against the current map's walls. prepare()
+    is called before every batch of queries, so a backend can precompute whatever it needs once per map.
+    """
+
+    def prepare(self, mapgen: MapGenerator):
+        raise NotImplementedError
+
+    def cast(self, rays: np.ndarray) -> np.ndarray:
+        """
+        Parameters
+        ----------
+        rays: np.ndarray
+            An (n, 4) array of rays as x1, y1, x2, y2.
+
+        Returns
+        -------
+        np.ndarray
+            The fraction along each ray of its first hit, or inf where it doesn't hit any wall.
+        """
+        raise NotImplementedError
+
+    def collisions(self, borders: np.ndarray) -> list[Point | None]:
+        """
+        Parameters
+        ----------
+        borders: np.ndarray
+            A (vehicles, 4, 4) array of the borders of every vehicle, as x1, y1, x2, y2.
+
+        Returns
+        -------
+        list
+            A point where each vehicle touches a wall, or None if it doesn't.
+        """
+        raise NotImplementedError
+
+
+class ExactSensing(SensingBackend):
+    """
+    Exact intersections of the rays and vehicle borders with the merged walls. Rays are tested against every wall, but
+    collisions go through a broadphase first: every grid cell knows the walls along its sides, so each vehicle's
+    borders are only tested against the walls of the cells its bounding box overlaps, which is a constant number of
+    walls per vehicle regardless of the map's size. Maps with few walls are quicker to test against every wall.
+    """
+    BROADPHASE_MIN_WALLS = 100
+
+    def __init__(self):
+        self._key: bytes | None = None
+        self._walls: np.ndarray = np.empty((0, 4))
+        self._tile_size: float = 0.0
+
+        # The walls along the sides of every cell, including a ring of cells around the map, as the wall indices
+        # cell_walls[cell_starts[cell]:cell_starts[cell + 1]] where cell is the flattened (y + 1, x + 1)
+        self._cells: int = 0  # Cells along each side, including the ring
+        self._cell_starts: np.ndarray = np.zeros(1, dtype=np.int64)
+        self._cell_walls: np.ndarray = np.empty(0, dtype=np.int64)
+
+    def prepare(self, mapgen: MapGenerator):
+        if mapgen.map_key() == self._key:
+            return
+        self._key = mapgen.map_key()
+
+        layout = mapgen.layout()
+        self._walls = mapgen.walls()
+        self._tile_size = layout.tile_size
+        self._cells = layout.map_size() + 2
+
+        # Every unit length piece of a wall is a side of the two cells on either side of it
+        cells, walls = [], []
+        for index, (x1, y1, x2, y2) in enumerate(layout.walls.tolist()):
+            if y1 == y2:
+                xs = np.arange(min(x1, x2), max(x1, x2)) + 1
+                for y in (y1 - 1, y1):
+                    cells.append((y + 1) * self._cells + xs)
+                    walls.append(np.full(len(xs), index))
+            else:
+                ys = np.arange(min(y1, y2), max(y1, y2)) + 1
+                for x in (x1 - 1, x1):
+                    cells.append(ys * self._cells + x + 1)
+                    walls.append(np.full(len(ys), index))
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int64)
+        walls = np.concatenate(walls) if walls else np.empty(0, dtype=np.int64)
+
+        order = np.lexsort((walls, cells))
+        self._cell_walls = walls[order]
+        self._cell_starts = np.concatenate(([0], np.cumsum(np.bincount(cells, minlength=self._cells ** 2))))
+
+    def cast(self, rays: np.ndarray) -> np.ndarray:
+        hits = utils.axis_aligned_intersections(rays, self._walls)
+        return np.min(np.where(np.isnan(hits), np.inf, hits), axis=1, initial=np.inf)
+
+    def collisions(self, borders: np.ndarray) -> list[Point | None]:
+        if not len(borders):
+            return []
+        if len(self._walls) < ExactSensing.BROADPHASE_MIN_WALLS:
+            return self._all_collisions(borders)
+
+        # Cells overlapped by every vehicle's bounding box, clamped to the ring around the map
+        ends = borders.reshape(len(borders), -1, 2)
+        low = np.clip(np.floor(ends.min(axis=1) / self._tile_size).astype(np.int64) + 1, 0, self._cells - 1)
+        high = np.clip(np.floor(ends.max(axis=1) / self._tile_size).astype(np.int64) + 1, 0, self._cells - 1)
+        span = int(np.max(high - low)) + 1
+        offsets = np.arange(span)
+        columns = low[:, 0, None, None] + offsets[None, None, :]
+        rows = low[:, 1, None, None] + offsets[None, :, None]
+        overlapped = (columns <= high[:, 0, None, None]) & (rows <= high[:, 1, None, None])
+        vehicles, row_offsets, column_offsets = np.nonzero(overlapped)
+        cells = (low[vehicles, 1] + row_offsets) * self._cells + low[vehicles, 0] + column_offsets
+
+        # Every vehicle with every wall of its cells, and then every border of the vehicle with that wall
+        counts = self._cell_starts[cells + 1] - self._cell_starts[cells]
+        pair_vehicles = np.repeat(vehicles, counts)
+        firsts = np.repeat(self._cell_starts[cells] - np.cumsum(counts) + counts, counts)
+        pair_walls = self._cell_walls[firsts + np.arange(len(firsts))]
+        sides = borders.shape[1]
+        lines = borders[pair_vehicles].reshape(-1, 4)
+        hits = utils.axis_aligned_intersections(lines, np.repeat(self._walls[pair_walls], sides, axis=0), pairwise=True)
+
+        # Each vehicle collides with the first wall its first intersecting border intersects, in the order of the
+        # borders and walls
+        found = np.flatnonzero(~np.isnan(hits))
+        found_vehicles = pair_vehicles[found // sides]
+        found_sides = found % sides
+        order = np.lexsort((pair_walls[found // sides], found_sides, found_vehicles))
+        firsts = order[np.unique(found_vehicles[order], return_index=True)[1]]
+
+        collisions: list[Point | None] = [None] * len(borders)
+        for vehicle, (x1, y1, x2, y2), ua in zip(found_vehicles[firsts].tolist(), lines[found[firsts]].tolist(),
+                                                 hits[found[firsts]].tolist()):
+            collisions[vehicle] = (x1 + ua * (x2 - x1), y1 + ua * (y2 - y1))
+        return collisions
+
+    def _all_collisions(self, borders: np.ndarray) -> list[Point | None]:
+        # The same as collisions(), testing every border against every wall
+        hits = utils.axis_aligned_intersections(borders.reshape(-1, 4), self._walls).reshape(len(borders), -1)
+        found = ~np.isnan(hits)
+        collisions = []
+        for vehicle_borders, vehicle_hits, vehicle_found in zip(borders, hits, found):
+            if not vehicle_found.any():
+                collisions.append(None)
+                continue
+            index = int(np.argmax(vehicle_found))
+            x1, y1, x2, y2 = vehicle_borders[index // len(self._walls)].tolist()
+            ua = float(vehicle_hits[index])
+            collisions.append((x1 + ua * (x2 - x1), y1 + ua * (y2 - y1)))
+        return collisions
+
+
+class DistanceFieldSensing(SensingBackend):
+    """
+    Rasterises the walls into a grid of the distance from every grid node to the nearest wall, once per map. Rays are
+    then sphere traced over the bilinearly interpolated grid, i.e. they repeatedly step forward by the distance to the
+    nearest wall until they are within a quarter of a cell of one, and vehicles collide when a point along their
+    borders is within a quarter of a cell of a wall. The cost of a query only depends on the resolution, not on the
+    number of walls.
+
+    The grid is only stored for the tiles of the path and the tiles around them, as a separate block of nodes per
+    tile, so its size is proportional to the path's length rather than the map's area. Every other point is at least
+    a tile away from any wall, so distances are capped at one tile size. The walls run along the tile edges, which are
+    nodes of every block, so the interpolated distances are exact along straight walls and only approximate around
+    their ends.
+
+    Parameters
+    ----------
+    resolution: float
+        The largest distance between grid nodes in pixels. Sensor distances along straight walls are within about a
+        quarter of it of the exact ones, but a ray that grazes past a wall's end within about a cell will hit it,
+        and a vehicle within a quarter of it of a wall collides.
+    max_steps: int
+        The most sphere tracing steps per ray. Rays that haven't hit anything by then are reported as not hitting.
+    """
+
+    def __init__(self, resolution: float = 2.0, max_steps: int = 256):
+        self.resolution = resolution
+        self.max_steps = max_steps
+
+        self._key: bytes | None = None
+        self._tile_size: float = 0.0
+        self._cells: int = 0  # Cells along each side of a tile
+        self._step: float = 0.0  # Distance between nodes, at most the resolution
+        self._slots: np.ndarray = np.empty((0, 0), dtype=np.int32)  # Tile (shifted by one) to its block, or -1
+        self._field: np.ndarray = np.empty((0, 0, 0), dtype=np.float32)  # Blocks of (cells + 1, cells + 1) nodes
+
+    def prepare(self, mapgen: MapGenerator):
+        if mapgen.map_key() == self._key:
+            return
+        self._key = mapgen.map_key()
+
+        layout = mapgen.layout()
+        size = layout.map_size()
+        self._tile_size = layout.tile_size
+        self._cells = math.ceil(layout.tile_size / self.resolution)
+        self._step = layout.tile_size / self._cells
+
+        # A block for every tile within one tile of the path, including those just outside the map
+        around = (layout.path[:, None, :2] + np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])) + 1
+        tiles = np.unique(around.reshape(-1, 2), axis=0)
+        self._slots = np.full((size + 2, size + 2), -1, dtype=np.int32)
+        self._slots[tiles[:, 1], tiles[:, 0]] = np.arange(len(tiles))
+        self._field = np.full((len(tiles), self._cells + 1, self._cells + 1), self._tile_size, dtype=np.float32)
+
+        nodes = np.arange(self._cells + 1) * self._step
+        for x1, y1, x2, y2 in mapgen.walls().tolist():
+            x_low, x_high = sorted((x1, x2))
+            y_low, y_high = sorted((y1, y2))
+
+            # Only the blocks of the tiles around the wall can be closer to it than the cap
+            columns = slice(max(int(x_low // self._tile_size), 0), int(x_high // self._tile_size) + 3)
+            rows = slice(max(int(y_low // self._tile_size), 0), int(y_high // self._tile_size) + 3)
+            ys, xs = np.nonzero(self._slots[rows, columns] >= 0)
+            if not len(xs):
+                continue
+            slots = self._slots[rows, columns][ys, xs]
+
+            # Distance from the blocks' nodes to the axis aligned wall
+            node_xs = (xs[:, None] + columns.start - 1) * self._tile_size + nodes
+            node_ys = (ys[:, None] + rows.start - 1) * self._tile_size + nodes
+            dx = np.maximum(np.maximum(x_low - node_xs, node_xs - x_high), 0)
+            dy = np.maximum(np.maximum(y_low - node_ys, node_ys - y_high), 0)
+            distances = np.sqrt(dx[:, None, :] ** 2 + dy[:, :, None] ** 2)
+            self._field[slots] = np.minimum(self._field[slots], distances)
+
+    def distances(self, points: np.ndarray) -> np.ndarray:
+        # Bilinear interpolation of the distances at the four nodes around each point, within the block of its tile
+        tiles = np.floor(points / self._tile_size)
+        local = points / self._step - tiles * self._cells
+        tiles = tiles.astype(np.int64) + 1
+        inside = np.all((tiles >= 0) & (tiles < len(self._slots)), axis=-1)
+        tiles = np.clip(tiles, 0, len(self._slots) - 1)
+        slots = np.where(inside, self._slots[tiles[..., 1], tiles[..., 0]], -1)
+
+        corners = np.clip(np.floor(local), 0, self._cells - 1)
+        fx, fy = np.moveaxis(np.clip(local - corners, 0, 1), -1, 0)
+        x, y = np.moveaxis(corners.astype(np.int64), -1, 0)
+
+        field = self._field
+        distances = ((field[slots, y, x] * (1 - fx) + field[slots, y, x + 1] * fx) * (1 - fy) +
+                     (field[slots, y + 1, x] * (1 - fx) + field[slots, y + 1, x + 1] * fx) * fy)
+        return np.where(slots >= 0, distances, self._tile_size)
+
+    def cast(self, rays: np.ndarray) -> np.ndarray:
+        starts = rays[:, :2]
+        lengths = np.hypot(rays[:, 2] - rays[:, 0], rays[:, 3] - rays[:, 1])
+        directions = (rays[:, 2:] - starts) / lengths[:, None]
+        hit_distance = self._step / 4
+
+        # Rays only hit walls they are getting closer to, so the distance is also sampled a cell behind their start
+        steps = np.full(len(rays), self._step)
+        previous = self.distances(starts - self._step * directions)
+        travelled = np.zeros(len(rays))
+        result = np.full(len(rays), np.inf)
+        active = np.arange(len(rays))
+        for _ in range(self.max_steps):
+            distances = self.distances(starts[active] + travelled[active, None] * directions[active])
+            approach = previous[active] - distances
+            hit = (distances <= hit_distance) & (approach > 0)
+
+            # The rest of the way to the wall, assuming it continues straight at the rate the ray is approaching it
+            hits = active[hit]
+            rate = np.clip(approach[hit] / steps[hits], 0.05, 1)
+            result[hits] = (travelled[hits] + distances[hit] / rate) / lengths[hits]
+            result[hits[result[hits] > 1]] = np.inf
+
+            # Interpolated distances can be a bit too long around the ends of walls, so step a bit less
+            previous[active] = distances
+            steps[active] = np.maximum(distances - hit_distance, hit_distance)
+            travelled[active] += steps[active]
+            active = active[~hit & (travelled[active] < lengths[active])]
+            if not len(active):
+                break
+
+        return result
+
+    def collisions(self, borders: np.ndarray) -> list[Point | None]:
+        collisions: list[Point | None] = [None] * len(borders)
+
+        # Only vehicles with a wall within their circumradius (plus a cell, for the interpolation) can touch one
+        ends = borders.reshape(len(borders), -1, 2)
+        centers = ends.mean(axis=1)
+        radii = np.max(np.hypot(*np.moveaxis(ends - centers[:, None], -1, 0)), axis=1)
+        candidates = np.flatnonzero(self.distances(centers) <= radii + self._step)
+        if not len(candidates):
+            return collisions
+
+        # Sample points along their borders at most half a cell apart, and look up how close the nearest wall is
+        borders = borders[candidates]
+        samples = math.ceil(np.max(np.hypot(borders[..., 2] - borders[..., 0],
+                                            borders[..., 3] - borders[..., 1])) / (self._step / 2)) + 1
+        fractions = np.linspace(0, 1, samples)[:, None]
+        points = borders[:, :, None, :2] + fractions * (borders[:, :, None, 2:] - borders[:, :, None, :2])
+        points = points.reshape(len(borders), -1, 2)
+        distances = self.distances(points)
+
+        # Half the spacing of the samples, so that a border crossing a wall is always caught
+        nearest = np.argmin(distances, axis=1)
+        touching = distances[np.arange(len(borders)), nearest] <= self._step / 4
+        for i in np.flatnonzero(touching):
+            collisions[candidates[i]] = tuple(points[i, nearest[i]].tolist())
+        return collisions
+
+
+def compare_backends(mapgen: MapGenerator, candidate: SensingBackend, reference: SensingBackend | None = None,
+                     samples: int = 1000, rng: np.random.Generator | None = None) -> dict:
+    """
+    Measures the error of a sensing backend against a reference backend (the exact one by default) on the given map,
+    with a vehicle placed at random positions within the map's tiles and at random angles. The sensors are only
+    compared for the poses where the vehicle doesn't collide according to the reference, as a vehicle never senses
+    from the others.
+
+    Returns
+    -------
+    dict
+        The mean, 95th and 99th percentile and maximum absolute error of the sensor distances in pixels, the fraction
+        of sensors that hit a wall with one backend but not the other, and the fraction of poses where the backends
+        disagree about whether the vehicle collides. The errors and hit mismatch rate are 0 when there are no sensors to
+        compare.
+
+    Notes
+    -----
+    These are sampled statistics, not bounds. The error along straight walls is within about a quarter of the distance
+    field's resolution, but a ray that grazes past a wall's end within about a cell hits that end with the distance
+    field and the wall behind it with the exact backend. The maximum error is then the distance between the two walls,
+    which is about 270px on the benchmark's maps whatever the resolution, while the percentiles show how rare those
+    rays are.
+    """
+    reference = reference or ExactSensing()
+    rng = rng or np.random.default_rng()
+    candidate.prepare(mapgen)
+    reference.prepare(mapgen)
+
+    # Random poses within random tiles of the path
+    layout = mapgen.layout()
+    tiles = layout.path[rng.integers(len(layout.path), size=samples), :2]
+    positions = (tiles + rng.random((samples, 2))) * layout.tile_size
+    vehicle = Vehicle(0, 0, enums.VEHICLE_SIZE, enums.VEHICLE_SIZE, 0)
+    rays, borders = [], []
+    for (x, y), theta in zip(positions.tolist(), rng.uniform(0, 2 * math.pi, samples).tolist()):
+        vehicle.set_pose(x, y, theta)
+        rays.append(vehicle.sensor_rays().copy())
+        borders.append(vehicle.border_lines().copy())
+    borders = np.stack(borders)
+    reference_collisions = reference.collisions(borders)
+    collision_mismatches = sum((a is None) != (b is None)
+                               for a, b in zip(candidate.collisions(borders), reference_collisions))
+
+    # Every pose may collide on maps whose tiles are smaller than the vehicle, leaving no sensors to compare
+    free_rays = [pose_rays for pose_rays, collision in zip(rays, reference_collisions) if collision is None]
+    rays = np.concatenate(free_rays) if free_rays else np.empty((0, 4))
+    lengths = np.hypot(rays[:, 2] - rays[:, 0], rays[:, 3] - rays[:, 1])
+    candidate_hits, reference_hits = candidate.cast(rays), reference.cast(rays)
+    both = np.isfinite(candidate_hits) & np.isfinite(reference_hits)
+    errors = np.abs(candidate_hits[both] - reference_hits[both]) * lengths[both]
+    if not len(errors):
+        errors = np.zeros(1)
+    hit_mismatches = np.isfinite(candidate_hits) != np.isfinite(reference_hits)
+
+    return {
+        "samples": samples,
+        "sensors": len(rays),
+        "mean_error": float(np.mean(errors)),
+        "p95_error": float(np.percentile(errors, 95)),
+        "p99_error": float(np.percentile(errors, 99)),
+        "max_error": float(np.max(errors)),
+        "hit_mismatch_rate": float(np.mean(hit_mismatches)) if len(hit_mismatches) else 0.0,
+        "collision_mismatch_rate": collision_mismatches / samples
+    }
+
+
+SENSING_BACKENDS = {
+    "exact": ExactSensing,
+    "distance_field": DistanceFieldSensing
+}
@@ -0,0 +1,392 @@
+"""
+A local job server for running training and experiment jobs without the interface. Jobs are queued and run on a
+bounded pool of worker processes, and clients can watch their progress as it happens. Every job gets its own directory
+under the jobs directory, where its spec, status and resulting agents or experiment reports are stored.
+
+Clients connect over localhost TCP or a Unix socket and send one JSON request per connection, terminated by a newline.
+The server answers with one or more JSON messages, one per line, and closes the connection. The requests are:
+
+- {"command": "submit", "job": {...}, "watch": false} = Queue a job, optionally watching it
+- {"command": "status", "job_id": "..."} = The current status of a job
+- {"command": "list"} = The status of all jobs
+- {"command": "watch", "job_id": "..."} = Stream a job's progress until it is finished
+
+A job spec looks like this, where everything but "type" is optional (experiment jobs need at least one agent):
+
+    {
+        "type": "training" | "experiment",
+        "environment": {"ticks_per_run": 750, "curriculum": "adaptive", ...},  # See Environment.PARAMETERS
+        "map_sizes": [3, 11],  # The map sizes to progress through, inclusive
+        "agents": ["agents/sample_best.pickle"],  # Training: initial agents. Experiment: agents to evaluate
+        "population": 20,  # Training only
+        "cycles": 1,  # Training only: how many times to progress through the map sizes
+        "max_generations": null,  # Training only: stop early after this many generations
+        "runs_per_size": 50,  # Experiment only
+        "seed": null  # Root seed of the job, generated if not given. The same spec and seed replay the same job
+    }
+
+Run `python -m project.server serve` to start the server, and `python -m project.server submit spec.json --watch` to
+submit a job from a JSON file.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from project import enums
+from project.environment import Environment
+from project.experiment import run_experiment
+
+JOBS_DIR = os.path.join(Environment.PROJECT_ROOT, "jobs")
+HOST = "127.0.0.1"
+PORT = 8765
+FINAL_EVENTS = ("finished", "failed")
+
+
+class Job:
+    def __init__(self, job_id: str, spec: dict, directory: str):
+        self.id = job_id
+        self.spec = spec
+        self.directory = directory
+        self.status: str = "queued"
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.progress: deque[dict] = deque(maxlen=100)  # Most recent progress messages, for late watchers
+        self.watchers: set[asyncio.Queue] = set()
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "type": self.spec["type"],
+            "status": self.status,
+            "directory": self.directory,
+            "progress": self.progress[-1] if self.progress else None,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobServer:
+    def __init__(self, jobs_dir: str = JOBS_DIR, workers: int | None = None):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.jobs: dict[str, Job] = {}
+
+        self._executor: ProcessPoolExecutor | None = None
+        self._runs: set[asyncio.Task] = set()  # Running jobs' tasks, so they aren't garbage collected
+        self._progress = None  # Queue shared with the worker processes
+
+    async def serve(self, host: str = HOST, port: int = PORT, path: str | None = None):
+        # Spawn rather than fork the workers, as forking a process with running threads and an event loop is unsafe
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager, ProcessPoolExecutor(self.workers, mp_context=context) as executor:
+            self._executor = executor
+            self._progress = manager.Queue()
+            pump = asyncio.create_task(self._pump_progress())
+
+            if path:
+                server = await asyncio.start_unix_server(self._handle, path)
+            else:
+                server = await asyncio.start_server(self._handle, host, port)
+
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                self._progress.put(None)
+                await pump
+                executor.shutdown(cancel_futures=True)
+
+    def submit(self, spec: dict) -> Job:
+        spec = validate_spec(spec)
+        job_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        directory = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "spec.json"), "w") as file:
+            json.dump(spec, file, indent=2)
+
+        job = Job(job_id, spec, directory)
+        self.jobs[job_id] = job
+        run = asyncio.create_task(self._run(job))
+        self._runs.add(run)
+        run.add_done_callback(self._runs.discard)
+        return job
+
+    async def _run(self, job: Job):
+        loop = asyncio.get_running_loop()
+        try:
+            job.result = await loop.run_in_executor(
+                self._executor, run_job, job.id, job.spec, job.directory, self._progress)
+            job.status = "finished"
+        except Exception as error:
+            job.status = "failed"
+            job.error = repr(error)
+
+        with open(os.path.join(job.directory, "status.json"), "w") as file:
+            json.dump(job.summary(), file, indent=2)
+        self._publish(job, {"job_id": job.id, "event": job.status, "result": job.result, "error": job.error})
+
+    async def _pump_progress(self):
+        # Forward progress messages from the worker processes to the jobs' watchers
+        loop = asyncio.get_running_loop()
+        while (item := await loop.run_in_executor(None, self._progress.get)) is not None:
+            job_id, message = item
+            if job := self.jobs.get(job_id):
+                if message["event"] == "started":
+                    job.status = "running"
+                job.progress.append(message)
+                self._publish(job, message)
+
+    def _publish(self, job: Job, message: dict):
+        for queue in job.watchers:
+            queue.put_nowait(message)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            line = await reader.readline()
+            try:
+                await self._respond(json.loads(line), writer)
+            except (ValueError, KeyError, TypeError) as error:  # Including JSON decoding errors
+                await _send(writer, {"error": str(error)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, request: dict, writer: asyncio.StreamWriter):
+        match request.get("command"):
+            case "submit":
+                job = self.submit(request["job"])
+                await _send(writer, job.summary())
+                if request.get("watch"):
+                    await self._watch(job, writer)
+            case "status":
+                await _send(writer, self._job(request).summary())
+            case "list":
+                await _send(writer, {"jobs": [job.summary() for job in self.jobs.values()]})
+            case "watch":
+                await self._watch(self._job(request), writer)
+            case command:
+                raise ValueError(f"Unknown command '{command}'")
+
+    async def _watch(self, job: Job, writer: asyncio.StreamWriter):
+        for message in tuple(job.progress):
+            await _send(writer, message)
+        if job.status in FINAL_EVENTS:
+            await _send(writer, {"job_id": job.id, "event": job.status, "result": job.result, "error": job.error})
+            return
+
+        queue = asyncio.Queue()
+        job.watchers.add(queue)
+        try:
+            while True:
+                message = await queue.get()
+                await _send(writer, message)
+                if message["event"] in FINAL_EVENTS:
+                    break
+        finally:
+            job.watchers.discard(queue)
+
+    def _job(self, request: dict) -> Job:
+        job_id = request["job_id"]
+        if job_id not in self.jobs:
+            raise KeyError(f"Unknown job '{job_id}'")
+        return self.jobs[job_id]
+
+
+def validate_spec(spec: dict) -> dict:
+    """
+    Validates the given job spec and returns a copy of it with the defaults filled in. Raises a ValueError if the spec
+    is invalid.
+    """
+    if spec.get("type") not in ("training", "experiment"):
+        raise ValueError(f"Job type must be 'training' or 'experiment', got {spec.get('type')!r}")
+
+    environment = spec.get("environment", {})
+    if not isinstance(environment, dict):
+        raise ValueError(f"Environment parameters must be an object, got {environment!r}")
+    try:
+        Environment.validate_parameters(environment)
+    except ValueError as error:
+        raise ValueError(f"Invalid environment parameters: {error}") from None
+
+    map_sizes = spec.get("map_sizes", [3, 11])
+    if not (isinstance(map_sizes, (list, tuple)) and len(map_sizes) == 2 and all(map(_is_int, map_sizes))):
+        raise ValueError(f"Map sizes must be a minimum and maximum map size, got {map_sizes!r}")
+    minimum, maximum = map_sizes
+    if not enums.MIN_MAP_SIZE <= minimum <= maximum <= enums.MAX_MAP_SIZE:
+        raise ValueError(f"Map sizes must be within {enums.MIN_MAP_SIZE} and {enums.MAX_MAP_SIZE}, "
+                         f"got {minimum} to {maximum}")
+
+    agents = [str(path) for path in spec.get("agents", [])]
+    for path in agents:
+        if not os.path.isfile(path):
+            raise ValueError(f"Agent file '{path}' does not exist")
+    if spec["type"] == "experiment" and not agents:
+        raise ValueError("Experiment jobs need at least one agent")
+
+    counts = {"population": enums.NUM_POPULATION, "cycles": 1, "runs_per_size": 50}  # Name to default
+    for name, default in counts.items():
+        value = spec.get(name, default)
+        if not _is_int(value) or value < 1:
+            raise ValueError(f"'{name}' must be a positive integer, got {value!r}")
+    population = spec.get("population", enums.NUM_POPULATION)
+    max_generations = spec.get("max_generations")
+    if max_generations is not None and (not _is_int(max_generations) or max_generations < 1):
+        raise ValueError(f"Max generations must be a positive integer or null, got {max_generations!r}")
+    if len(agents) > population:
+        raise ValueError(f"More agents than the population size. {len(agents)} > {population}")
+
+    seed = spec.get("seed")
+    if seed is not None and (not _is_int(seed) or seed < 0):
+        raise ValueError(f"Seed must be a non-negative integer or null, got {seed!r}")
+
+    return {
+        "type": spec["type"],
+        "environment": dict(environment),
+        "map_sizes": [minimum, maximum],
+        "agents": agents,
+        "population": population,
+        "cycles": spec.get("cycles", 1),
+        "max_generations": max_generations,
+        "runs_per_size": spec.get("runs_per_size", 50),
+        "seed": seed if seed is not None else np.random.SeedSequence().entropy
+    }
+
+
+def _is_int(value) -> bool:
+    # JSON booleans are ints to Python, but never a valid count
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def run_job(job_id: str, spec: dict, directory: str, progress) -> dict:
+    """
+    Worker process entry point. Runs the given (validated) job spec, writing its results into the given directory and
+    putting (job_id, message) progress messages into the given queue.
+    """
+    progress.put((job_id, {"job_id": job_id, "event": "started"}))
+    parameters = {**spec["environment"], "map_size_range": spec["map_sizes"]}
+    if spec["type"] == "training":
+        return _run_training(job_id, spec, parameters, directory, progress)
+    return _run_experiments(job_id, spec, parameters, directory, progress)
+
+
+def _run_training(job_id: str, spec: dict, parameters: dict, directory: str, progress) -> dict:
+    env = Environment(population=spec["population"], seed=spec["seed"])
+    env.set_learning_mode(True)
+    env.configure(parameters)
+    env.agents_dir = os.path.join(directory, "agents")
+    for index, path in enumerate(spec["agents"]):
+        env.load_agent(path, index)
+
+    start = time.perf_counter()
+    generation = env.generation
+    max_generations = spec["max_generations"]
+    while env.completed_cycles < spec["cycles"] and (max_generations is None or env.generation < max_generations):
+        env.tick()
+        if env.generation != generation:
+            generation = env.generation
+            progress.put((job_id, {
+                "job_id": job_id,
+                "event": "generation",
+                "generation": generation,
+                "map_size": env.get_map_size(),
+                "completed_cycles": env.completed_cycles,
+                "mutation_chance": env.mutation_chance,
+                "elapsed": time.perf_counter() - start
+            }))
+
+    # Stopped early, so save the agents here. The vehicles were just reset for a new generation, so the best agents
+    # are those of the generation before, by the fitnesses it ended with
+    if env.completed_cycles < spec["cycles"]:
+        env.save_best_agent(env.agents_dir, last_generation=True)
+
+    return {
+        "generations": env.generation,
+        "completed_cycles": env.completed_cycles,
+        "agents": sorted(os.listdir(env.agents_dir)),
+        "curriculum": env.curriculum.report(),
+        "elapsed": time.perf_counter() - start
+    }
+
+
+def _run_experiments(job_id: str, spec: dict, parameters: dict, directory: str, progress) -> dict:
+    results = {}
+    seeds = np.random.SeedSequence(spec["seed"]).spawn(len(spec["agents"]))
+    for i, (path, seed) in enumerate(zip(spec["agents"], seeds)):
+        label = f"{i:02d}_{Path(path).stem}"
+        run_reports, experiment_results = run_experiment(path, spec["runs_per_size"], parameters, seed)
+        Environment.write_experiment(os.path.join(directory, label), run_reports, experiment_results)
+        results[label] = experiment_results
+        progress.put((job_id, {"job_id": job_id, "event": "experiment", "agent": label,
+                               "total_collisions": experiment_results["total_collisions"]}))
+
+    return results
+
+
+async def request(message: dict, host: str = HOST, port: int = PORT, path: str | None = None):
+    """
+    Sends a request to a job server and yields its responses as they arrive.
+    """
+    if path:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        await _send(writer, message)
+        while line := await reader.readline():
+            yield json.loads(line)
+    finally:
+        writer.close()
+
+
+async def _send(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b"\n")
+    await writer.drain()
+
+
+async def _print_responses(message: dict, args: argparse.Namespace):
+    async for response in request(message, args.host, args.port, args.unix):
+        print(json.dumps(response))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local job server for training and experiment runs.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", default=None, help="Use a Unix socket at this path instead of TCP")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the job server")
+    serve_parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes")
+    serve_parser.add_argument("-d", "--jobs-dir", default=JOBS_DIR, help="Directory to store the jobs in")
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a job spec from a JSON file")
+    submit_parser.add_argument("spec", help="Path to the job spec")
+    submit_parser.add_argument("--watch", action="store_true", help="Watch the job's progress")
+
+    subparsers.add_parser("list", help="List all jobs")
+    for name in ("status", "watch"):
+        subparsers.add_parser(name, help=f"{name.capitalize()} a job").add_argument("job_id")
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        asyncio.run(JobServer(args.jobs_dir, args.workers).serve(args.host, args.port, args.unix))
+    elif args.command == "submit":
+        with open(args.spec, "r") as file:
+            job = json.load(file)
+        job["agents"] = [os.path.abspath(path) for path in job.get("agents", [])]  # Relative to the client
+        asyncio.run(_print_responses({"command": "submit", "job": job, "watch": args.watch}, args))
+    else:
+        asyncio.run(_print_responses({"command": args.command, "job_id": getattr(args, "job_id", None)}, args))
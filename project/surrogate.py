@@ -0,0 +1,131 @@
+import math
+from collections import deque
+
+import numpy as np
+
+
+class Surrogate:
+    """
+    Pre-screens the candidates of a generation with a cheap model of the fitness, fitted to an archive of the most
+    recent (genome, fitness) results. Of the candidates that would otherwise be simulated, only the `simulate_share`
+    with the best predicted fitness are, where `explore_share` of the candidates are picked at random instead so that
+    the archive doesn't only learn about what it already likes. Nothing is screened out until the archive holds
+    `min_archive` results. Subclasses implement _predict().
+
+    Every generation, the predictions of the simulated candidates are compared to their actual fitnesses, and the
+    rank correlation and mean absolute error are kept in `history`.
+    """
+
+    def __init__(self, simulate_share: float = 0.5, explore_share: float = 0.1, archive_size: int = 400,
+                 min_archive: int = 60):
+        self.simulate_share = simulate_share
+        self.explore_share = explore_share
+        self.min_archive = min_archive
+        self.history: list[dict] = []  # Accuracy of every generation's predictions
+        self._genomes: deque[np.ndarray] = deque(maxlen=archive_size)
+        self._fitnesses: deque[float] = deque(maxlen=archive_size)
+
+    def predict(self, genomes: np.ndarray) -> np.ndarray:
+        # Predicted fitness of every genome, or NaN while the archive is empty
+        if not self._genomes:
+            return np.full(len(genomes), np.nan)
+        return self._predict(np.array(self._genomes), np.array(self._fitnesses), np.asarray(genomes, dtype=float))
+
+    def screen(self, genomes: np.ndarray, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Decides which of the candidate genomes to simulate.
+
+        Returns
+        -------
+        tuple[np.ndarray, np.ndarray]
+            A boolean mask of the genomes to simulate, and the predicted fitness of every genome.
+        """
+        count = len(genomes)
+        predictions = self.predict(genomes)
+        if len(self._genomes) < self.min_archive:
+            return np.ones(count, dtype=bool), predictions
+
+        simulate = np.zeros(count, dtype=bool)
+        explore = round(count * self.explore_share)
+        exploit = max(math.ceil(count * self.simulate_share) - explore, 1)
+        simulate[np.argsort(-predictions, kind="stable")[:exploit]] = True
+        rest = np.flatnonzero(~simulate)
+        simulate[rng.choice(rest, min(explore, len(rest)), replace=False)] = True
+        return simulate, predictions
+
+    def observe(self, genomes: np.ndarray, fitnesses: np.ndarray, predictions: np.ndarray):
+        # Scores the predictions of simulated genomes against their fitnesses, then adds them to the archive
+        known = ~np.isnan(predictions)
+        accuracy = {"simulated": len(genomes), "rank_correlation": math.nan, "mean_absolute_error": math.nan}
+        if known.sum() > 1:
+            accuracy["rank_correlation"] = rank_correlation(predictions[known], fitnesses[known])
+            accuracy["mean_absolute_error"] = float(np.mean(np.abs(predictions[known] - fitnesses[known])))
+        self.history.append(accuracy)
+
+        self._genomes.extend(np.asarray(genomes, dtype=float))
+        self._fitnesses.extend(np.asarray(fitnesses, dtype=float).tolist())
+
+    def report(self) -> dict:
+        correlations = [entry["rank_correlation"] for entry in self.history
+                        if not math.isnan(entry["rank_correlation"])]
+        return {
+            "surrogate": type(self).__name__,
+            "generations": len(self.history),
+            "simulated": sum(entry["simulated"] for entry in self.history),
+            "mean_rank_correlation": float(np.mean(correlations)) if correlations else None
+        }
+
+    def _predict(self, archive: np.ndarray, fitnesses: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class RidgeSurrogate(Surrogate):
+    """
+    Predicts the fitness as a linear function of the genes, fitted by ridge regression.
+    """
+
+    def __init__(self, alpha: float = 1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.alpha = alpha
+
+    def _predict(self, archive: np.ndarray, fitnesses: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+        mean, target = archive.mean(axis=0), fitnesses.mean()
+        centred = archive - mean
+        coefficients = np.linalg.solve(centred.T @ centred + self.alpha * np.eye(archive.shape[1]),
+                                       centred.T @ (fitnesses - target))
+        return (genomes - mean) @ coefficients + target
+
+
+class KNNSurrogate(Surrogate):
+    """
+    Predicts the fitness as the inverse distance weighted mean of the fitnesses of the k nearest genomes in the archive.
+    """
+
+    def __init__(self, k: int = 5, **kwargs):
+        super().__init__(**kwargs)
+        self.k = k
+
+    def _predict(self, archive: np.ndarray, fitnesses: np.ndarray, genomes: np.ndarray) -> np.ndarray:
+        # Squared distances from every genome to every archived genome
+        distances = (genomes ** 2).sum(axis=1)[:, None] - 2 * genomes @ archive.T + (archive ** 2).sum(axis=1)
+        k = min(self.k, len(archive))
+        nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        weights = 1 / (np.sqrt(np.maximum(np.take_along_axis(distances, nearest, axis=1), 0)) + 1e-9)
+        return (weights * fitnesses[nearest]).sum(axis=1) / weights.sum(axis=1)
+
+
+def rank_correlation(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Calculates Spearman's rank correlation between two arrays, or NaN if either is constant.
+    """
+    ranks_a = np.argsort(np.argsort(a, kind="stable"), kind="stable")
+    ranks_b = np.argsort(np.argsort(b, kind="stable"), kind="stable")
+    if np.ptp(a) == 0 or np.ptp(b) == 0:
+        return math.nan
+    return float(np.corrcoef(ranks_a, ranks_b)[0, 1])
+
+
+SURROGATES = {
+    "ridge": RidgeSurrogate,
+    "knn": KNNSurrogate
+}
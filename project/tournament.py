@@ -0,0 +1,153 @@
+"""
+Tournament evaluation of a library of saved agents. All the agents run together in one environment on the same maps,
+and the results are written as a leaderboard:
+
+- <output>/leaderboard.json = The rank, success rate, mean ticks and collisions of each agent, overall and per map size
+- <output>/leaderboard.csv = The same leaderboard as a CSV, one row per agent and map size
+- <output>/runs.json = The result of every run of every agent
+
+Agents are given as file paths or directories of them, optionally labelled as LABEL=PATH. Unlabelled agents are
+labelled by their file name. Example: `python -m project.tournament agents/ --runs-per-size 20 --seed 1`
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from project import utils
+from project.environment import Environment
+
+
+class Tournament:
+    """
+    Evaluates many saved agents at once, by loading every agent into its own vehicle of one environment and running
+    them all on the same sequence of maps, through the same map sizes as the Experiment Mode. The vehicles don't
+    interact, so each agent's results are the same as if it was evaluated on its own on those maps.
+    """
+
+    def __init__(self, agents: dict[str, str], runs_per_size: int = 50, parameters: dict | None = None,
+                 seed: int | np.random.SeedSequence | None = None):
+        if not agents:
+            raise ValueError("A tournament needs at least one agent")
+
+        self.agents = agents  # Label to agent file path
+        self.runs_per_size = runs_per_size
+        self.parameters = parameters or {}
+        self.seed = seed
+
+        # Reports of every run of every agent, and the compiled leaderboard
+        self.run_reports: dict[str, list[dict]] = {label: [] for label in agents}
+        self.leaderboard: list[dict] = []
+
+    def run(self) -> list[dict]:
+        env = Environment(population=len(self.agents), seed=self.seed)
+        env.set_learning_mode(False)
+        env.resize_n_regens = self.runs_per_size
+        env.autosave = False
+        env.configure(self.parameters)
+        env.auto_reset = False  # Vehicles are reset here, once their results have been read
+        for index, path in enumerate(self.agents.values()):
+            env.load_agent(path, index)
+
+        while not env.completed_cycles:
+            map_size = env.get_map_size()
+            completed_runs = env.completed_runs
+            env.tick()
+            if env.completed_runs == completed_runs:
+                continue
+
+            for label, data in zip(self.agents, env.vehicle_datas()):
+                self.run_reports[label].append({
+                    "map_size": map_size,
+                    "collided": bool(data.collision),
+                    "finished": bool(data.is_finished),
+                    "ticks_taken": data.ticks_taken
+                })
+            env.reset_vehicles()
+
+        self.leaderboard = self.compile_leaderboard(self.run_reports)
+        return self.leaderboard
+
+    @staticmethod
+    def compile_leaderboard(run_reports: dict[str, list[dict]]) -> list[dict]:
+        """
+        Compiles the success rate, mean ticks of the successful runs and collisions of each agent, overall and per map
+        size. Agents are ranked by their overall success rate, then by their mean ticks.
+        """
+        leaderboard = []
+        for label, reports in run_reports.items():
+            entry = {"agent": label, **Tournament._compile_runs(reports)}
+            for size in sorted({report["map_size"] for report in reports}):
+                entry[f"map{size}"] = Tournament._compile_runs([report for report in reports
+                                                                if report["map_size"] == size])
+            leaderboard.append(entry)
+
+        leaderboard.sort(key=lambda entry: (-entry["success_rate"], entry["mean_ticks"] or float("inf")))
+        for rank, entry in enumerate(leaderboard, 1):
+            entry["rank"] = rank
+        return leaderboard
+
+    def write(self, directory: str):
+        # Writes the leaderboard to leaderboard.json and leaderboard.csv, and every agent's runs to runs.json
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "leaderboard.json"), "w") as file:
+            json.dump({"agents": self.agents, "runs_per_size": self.runs_per_size, "leaderboard": self.leaderboard},
+                      file, indent=2)
+        with open(os.path.join(directory, "runs.json"), "w") as file:
+            json.dump(self.run_reports, file, indent=2)
+
+        rows = [("Rank", "Agent", "Map Size", "Runs", "Success Rate", "Mean Ticks", "Collisions")]
+        for entry in self.leaderboard:
+            sizes = [("All", entry)] + [(key[3:], entry[key]) for key in entry if key.startswith("map")]
+            for size, stats in sizes:
+                rows.append((entry["rank"], entry["agent"], size, stats["runs"], stats["success_rate"],
+                             stats["mean_ticks"], stats["collisions"]))
+        utils.write_csv(os.path.join(directory, "leaderboard.csv"), rows)
+
+    @staticmethod
+    def _compile_runs(reports: list[dict]) -> dict:
+        ticks = [report["ticks_taken"] for report in reports if report["finished"]]
+        return {
+            "runs": len(reports),
+            "success_rate": sum(report["finished"] for report in reports) / len(reports) if reports else 0.0,
+            "mean_ticks": utils.average(ticks) if ticks else None,  # None if the agent never reached the goal
+            "collisions": sum(report["collided"] for report in reports)
+        }
+
+
+def _parse_agents(values: list[str]) -> dict[str, str]:
+    agents = {}
+    for value in values:
+        label, _, path = value.rpartition("=")
+        paths = sorted(Path(path).glob("*.pickle")) if os.path.isdir(path) else [Path(path)]
+        for path in paths:
+            name = label or path.stem
+            if name in agents:
+                raise SystemExit(f"Duplicate agent label '{name}'. Label them explicitly with LABEL=PATH.")
+            if not path.is_file():
+                raise SystemExit(f"Agent file '{path}' does not exist.")
+            agents[name] = str(path)
+    return agents
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a tournament of saved agents on the same maps.")
+    parser.add_argument("agents", nargs="+", help="Agent pickle files or directories of them, optionally as LABEL=PATH")
+    parser.add_argument("-n", "--runs-per-size", type=int, default=50, help="Number of runs per map size")
+    parser.add_argument("-m", "--map-sizes", type=int, nargs=2, default=None, metavar=("MIN", "MAX"),
+                        help="The map sizes to progress through, inclusive")
+    parser.add_argument("-s", "--seed", type=int, default=None, help="Seed of the maps, for replaying a tournament")
+    parser.add_argument("-o", "--output", default=os.path.join(Environment.EXPERIMENTS_DIR, "tournament"),
+                        help="Output directory")
+    args = parser.parse_args()
+
+    tournament = Tournament(_parse_agents(args.agents), args.runs_per_size,
+                            {"map_size_range": args.map_sizes} if args.map_sizes else None, args.seed)
+    for entry in tournament.run():
+        mean_ticks = f"{entry['mean_ticks']:.1f}" if entry["mean_ticks"] is not None else "-"
+        print(f"{entry['rank']}. {entry['agent']}: {entry['success_rate']:.0%} success, {mean_ticks} mean ticks, "
+              f"{entry['collisions']} collisions")
+    tournament.write(args.output)
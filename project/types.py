@@ -4,5 +4,6 @@ Point = Tuple[float, float]
 Line = Tuple[Point, Point]
 Genome = List[float]
 Population = List[Genome]
+Pose = Tuple[float, float, float]  # x, y and theta of a vehicle
 
-__all__ = ["Point", "Line", "Genome", "Population"]
+__all__ = ["Point", "Line", "Genome", "Population", "Pose"]
@@ -35,6 +35,7 @@ class App(QApplication):
             load_agent = True
 
         self._environment = Environment()
+        self._environment.configure({"prefetch_maps": 1})  # So that changing maps doesn't stall the interface
         self._main_window = MainWindow(self._environment)
         self._main_window.quit_shortcut.activated.connect(self._on_quit_shortcut)
         self._environment.set_learning_mode(train)
@@ -1,12 +1,14 @@
 import math
+import time
 
+import numpy as np
 from PySide6.QtCore import *
 from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 
 from project import enums
+from project.agent import GeneticAlgorithm as GA
 from project.environment import Environment
-from project.map_gen import MapTile
 from project.models import Vehicle, Wheel, Sensor, VehicleData
 from project.types import *
 
@@ -18,10 +20,34 @@ class Canvas(QWidget):
         self.setFixedSize(enums.CANVAS_SIZE, enums.CANVAS_SIZE)
         self._env: Environment = environment
         self.is_running: bool = is_running
+        self.show_metrics: bool = True
+
+        # Samples of the metrics chart, refilled in place every frame
+        self._chart_rect = QRectF(850, 50, 140, 70)
+        self._best_samples = np.empty(int(self._chart_rect.width()))
+        self._mean_samples = np.empty(int(self._chart_rect.width()))
+
+        # Level of detail. Only the best vehicle, vehicles with a loaded agent and up to `detail_count` of the fittest
+        # others are drawn in full, and the rest as dots or a density heatmap. While a frame takes longer to paint than
+        # `frame_budget` milliseconds, fewer vehicles are drawn in full, and more again once it's well under budget
+        self.detail_count: int = 20
+        self.heatmap: bool = False
+        self.frame_budget: float = 12.0
+        self.frame_ms: float = 0.0  # Moving average of the time spent painting a frame
+        self._detail_limit: int = self.detail_count
+        self._heat_pixels = np.zeros((64, 64), dtype=np.uint32)  # Kept alive for the QImage that wraps it
 
     def paintEvent(self, event):
+        start = time.perf_counter()
         p = QPainter(self)
 
+        # Zoom out to fit maps that are larger than the canvas
+        p.save()
+        layout = self._env.mapgen.layout()
+        map_width = layout.tile_size * layout.map_size()
+        if map_width > enums.CANVAS_SIZE:
+            p.scale(enums.CANVAS_SIZE / map_width, enums.CANVAS_SIZE / map_width)
+
         # Draw last tile
         p.save()
         p.setOpacity(0.4)
@@ -35,9 +61,9 @@ class Canvas(QWidget):
         )
         p.restore()
 
-        # Draw tile borders
-        for tile in self._env.mapgen.tiles():
-            self._draw_tile(tile, p)
+        # Draw walls
+        for x_start, y_start, x_end, y_end in self._env.mapgen.walls().tolist():
+            p.drawLine(QLineF(x_start, y_start, x_end, y_end))
 
         # Draw finish line for last border
         p.save()
@@ -49,10 +75,18 @@ class Canvas(QWidget):
         p.drawLine(*p1, *p2)
         p.restore()
 
-        # Draw vehicles
-        for vehicle, (_, data) in self._env.vehicles.items():
-            if vehicle is not self._env.current_best_vehicle and not data.is_custom_agent:
-                self._draw_vehicle(vehicle, data, "blue", p)
+        # Draw vehicles, the fittest in full detail and the rest cheaply underneath them
+        vehicles, datas = self._env.get_vehicles(), self._env.vehicle_datas()
+        detailed = self._detailed_vehicles(vehicles, datas)
+        others = [i for i, (vehicle, data) in enumerate(zip(vehicles, datas))
+                  if not detailed[i] and vehicle is not self._env.current_best_vehicle and not data.is_custom_agent]
+        if self.heatmap:
+            self._draw_heatmap([vehicles[i] for i in others], map_width, p)
+        else:
+            self._draw_markers([vehicles[i] for i in others], [datas[i] for i in others], p)
+        for i in np.flatnonzero(detailed).tolist():
+            if vehicles[i] is not self._env.current_best_vehicle and not datas[i].is_custom_agent:
+                self._draw_vehicle(vehicles[i], datas[i], "blue", p)
 
         # Draw the best fit vehicle above the others
         if best := self._env.current_best_vehicle:
@@ -62,6 +96,7 @@ class Canvas(QWidget):
         for vehicle in filter(lambda vehicle: self._env.vehicle_data(vehicle).is_custom_agent,
                               self._env.get_vehicles()):
             self._draw_vehicle(vehicle, self._env.vehicle_data(vehicle), "lime", p)
+        p.restore()
 
         # Draw controls info
         controls_info = [
@@ -80,37 +115,85 @@ class Canvas(QWidget):
         ]
         self._draw_text_section(850, 0, "", general_info, p)
 
-    def _draw_tile(self, tile: MapTile, painter: QPainter):
-        for border in tile.borders:
-            if border:
-                start, end = border
-                x_start, y_start = start
-                x_end, y_end = end
-                painter.drawLine(
-                    x_start,
-                    y_start,
-                    x_end,
-                    y_end
-                )
+        # Draw metrics of the recent runs
+        if self.show_metrics:
+            self._draw_metrics(p)
+        p.end()
+
+        self._adapt_detail((time.perf_counter() - start) * 1000)
+
+    def _detailed_vehicles(self, vehicles: tuple[Vehicle], datas: tuple[VehicleData]) -> np.ndarray:
+        # Mask of the fittest vehicles to draw in full, up to the current detail limit
+        detailed = np.zeros(len(vehicles), dtype=bool)
+        limit = min(self._detail_limit, len(vehicles))
+        if limit >= len(vehicles):
+            detailed[:] = True
+        elif limit:
+            fitnesses = GA.fitnesses(datas, self._env.fitness_measure)
+            detailed[np.argpartition(-fitnesses, limit - 1)[:limit]] = True
+        return detailed
+
+    def _adapt_detail(self, frame_ms: float):
+        # Halve the detail limit while over budget, and grow it back by one while well under budget
+        self.frame_ms = frame_ms if not self.frame_ms else 0.8 * self.frame_ms + 0.2 * frame_ms
+        if self.frame_ms > self.frame_budget:
+            self._detail_limit //= 2
+        elif self.frame_ms < self.frame_budget / 2:
+            self._detail_limit += 1
+        self._detail_limit = min(self._detail_limit, self.detail_count)
+
+    def _draw_markers(self, vehicles: list[Vehicle], datas: list[VehicleData], painter: QPainter):
+        # One dot per vehicle, drawn in one call per colour
+        groups = {"blue": [], "red": [], "lime": []}
+        for vehicle, data in zip(vehicles, datas):
+            colour = "red" if data.collision else "lime" if data.is_finished else "blue"
+            groups[colour].append(QPointF(vehicle.x, vehicle.y))
+
+        painter.save()
+        painter.setOpacity(0.6)
+        for colour, points in groups.items():
+            if points:
+                pen = QPen(QColor(colour), enums.VEHICLE_SIZE / 2, Qt.PenStyle.SolidLine, Qt.PenCapStyle.RoundCap)
+                painter.setPen(pen)
+                painter.drawPoints(QPolygonF(points))
+        painter.restore()
+
+    def _draw_heatmap(self, vehicles: list[Vehicle], map_width: float, painter: QPainter):
+        # The number of vehicles in each cell of a coarse grid over the map, as the opacity of one stretched image
+        if not vehicles:
+            return
+        cells = len(self._heat_pixels)
+        positions = np.array([vehicle.pos() for vehicle in vehicles]) * (cells / map_width)
+        columns, rows = np.clip(positions.astype(int), 0, cells - 1).T
+        counts = np.bincount(rows * cells + columns, minlength=cells * cells).reshape(cells, cells)
+        alphas = (counts * (255 / counts.max())).astype(np.uint32)
+        np.bitwise_or(alphas << 24, 0x0000FF, out=self._heat_pixels)  # Blue, as ARGB
+
+        image = QImage(self._heat_pixels.data, cells, cells, cells * 4, QImage.Format.Format_ARGB32)
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        painter.drawImage(QRectF(0, 0, map_width, map_width), image)
+        painter.restore()
 
     def _draw_vehicle(self, vehicle: Vehicle, data: VehicleData, body_colour: str, painter: QPainter):
         # Draw vehicle's main body
         painter.save()
         self._draw_vehicle_body(vehicle, data, body_colour, painter)
-        painter.resetTransform()
         painter.restore()
 
         # Draw wheels
         for wheel in vehicle.wheels:
+            painter.save()
             self._draw_wheel(vehicle, wheel, painter)
-            painter.resetTransform()
+            painter.restore()
 
         # Draw sensor lines
         painter.save()
         for i in range(len(vehicle.sensors)):
             # TODO (low): Find out how to update sensor length in real time, instead of on ticks
             point, _ = data.intersections[i]
-            if not (data.collision or data.is_finished):  # Only draw sensors of moving vehicles, to reduce visual mess
+            # Only draw sensors of moving vehicles, to reduce visual mess
+            if not (data.collision or data.is_finished or data.screened):
                 self._draw_sensor_line(vehicle, vehicle.sensors[i], point, painter)
         painter.restore()
 
@@ -118,7 +201,6 @@ class Canvas(QWidget):
         painter.save()
         for sensor in vehicle.sensors:
             self._draw_sensor(sensor, painter)
-            painter.resetTransform()
         painter.restore()
 
     def _draw_vehicle_body(self, vehicle: Vehicle, data: VehicleData, color: str, painter: QPainter):
@@ -185,6 +267,44 @@ class Canvas(QWidget):
             sensor.size
         )
 
+    def _draw_metrics(self, painter: QPainter):
+        metrics = self._env.metrics
+        if (latest := metrics.latest()) is None:
+            return
+
+        # Chart of the best and mean fitness of the recent runs, both scaled to the highest best fitness
+        rect = self._chart_rect
+        count = metrics.downsample("best_fitness", self._best_samples)
+        metrics.downsample("mean_fitness", self._mean_samples)
+        top = max(float(self._best_samples[:count].max()), 1e-9)
+
+        painter.save()
+        painter.setOpacity(0.8)
+        painter.fillRect(rect, "white")
+        painter.drawRect(rect)
+        for samples, colour in ((self._best_samples[:count], "green"), (self._mean_samples[:count], "blue")):
+            painter.setPen(colour)
+            self._draw_series(samples, top, painter)
+        painter.restore()
+
+        metrics_info = [
+            f"Fitness: {latest['best_fitness']:.2f} | {latest['mean_fitness']:.2f} | {latest['median_fitness']:.2f}",
+            f"Finished: {latest['finished']} | Collided: {latest['collided']}",
+            f"Mutation Chance: {latest['mutation_chance']:.3f}",
+            f"Ticks/s: {latest['ticks_per_second']:.0f} | ms/tick: {latest['ms_per_tick']:.2f}",
+            f"Detailed: {min(self._detail_limit, len(self._env.vehicles))} | ms/frame: {self.frame_ms:.1f}"
+        ]
+        self._draw_text_section(rect.left(), rect.bottom(), "", metrics_info, painter)
+
+    def _draw_series(self, samples: np.ndarray, top: float, painter: QPainter):
+        # Converts the samples to y coordinates in place, and joins them up from left to right
+        rect = self._chart_rect
+        np.multiply(samples, -rect.height() / top, out=samples)
+        np.add(samples, rect.bottom(), out=samples)
+        step = rect.width() / max(len(samples) - 1, 1)
+        for i in range(1, len(samples)):
+            painter.drawLine(QLineF(rect.left() + (i - 1) * step, samples[i - 1], rect.left() + i * step, samples[i]))
+
     def _draw_text_section(self, x: float, y: float, title: str, text_rows: list[str], painter: QPainter):
         font_height = QFontMetrics(painter.font()).height()
 
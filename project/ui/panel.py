@@ -18,6 +18,7 @@ class Panel(QScrollArea):
         self.ticks_per_gen_spinbox = QSpinBox()
         self.learning_mode_checkbox = QCheckBox()
         self.auto_reset_checkbox = QCheckBox()
+        self.show_metrics_checkbox = QCheckBox()
 
         self._general_section.add_row("Run Simulation", self.run_simulation_checkbox)
         self._general_section.add_row("Tick Interval (ms)", self.tick_interval_spinbox)
@@ -31,6 +32,25 @@ class Panel(QScrollArea):
                                       "current generation of agents tackle the environments.")
         self._general_section.add_row("Auto Reset", self.auto_reset_checkbox,
                                       "Automatically reset the environment or proceed to the next generation.")
+        self._general_section.add_row("Show Metrics", self.show_metrics_checkbox,
+                                      "Show a chart of the best (green) and mean (blue) fitness of the recent runs, "
+                                      "along with the statistics and speed of the last run.")
+
+        # Rendering Settings
+        self._rendering_section = _Section("Rendering")
+        self.detail_count_spinbox = QSpinBox()
+        self.heatmap_checkbox = QCheckBox()
+        self.frame_budget_spinbox = QSpinBox()
+
+        self._rendering_section.add_row("Detailed Vehicles", self.detail_count_spinbox,
+                                        "The most vehicles, besides the best one and any with a loaded agent, to draw "
+                                        "with their wheels and sensors. The fittest are chosen, and the others are "
+                                        "drawn as dots.")
+        self._rendering_section.add_row("Density Heatmap", self.heatmap_checkbox,
+                                        "Draw the vehicles that aren't detailed as a heatmap of where they are, "
+                                        "instead of as dots.")
+        self._rendering_section.add_row("Frame Budget (ms)", self.frame_budget_spinbox,
+                                        "Fewer vehicles are detailed while drawing a frame takes longer than this.")
 
         # Map Generation Settings
         self._map_section = _Section("Map Generation")
@@ -39,6 +59,7 @@ class Panel(QScrollArea):
         self.regen_n_runs_spinbox = QSpinBox()
         self.resize_n_regens_checkbox = QCheckBox()
         self.resize_n_regens_spinbox = QSpinBox()
+        self.adaptive_curriculum_checkbox = QCheckBox()
         self.regenerate_btn = QPushButton("Regenerate Map")
 
         self.regen_n_runs_box = QWidget(layout=QHBoxLayout())
@@ -54,6 +75,10 @@ class Panel(QScrollArea):
                                   "Automatically regenerate the map after N runs of the current map.")
         self._map_section.add_row("Resize on N Regenerations", self.resize_n_regens_box,
                                   "Automatically increment map size after N regenerations of the current map size.")
+        self._map_section.add_row("Adaptive Curriculum", self.adaptive_curriculum_checkbox,
+                                  "Instead of resizing the map after a fixed number of regenerations, move on to the "
+                                  "next map size once the agents reliably reach the goal on the current one, and "
+                                  "occasionally revisit the smaller sizes.")
         self._map_section.add_row("", self.regenerate_btn,
                                   "Regenerate the map based on the current map size.")
 
@@ -96,6 +121,7 @@ class Panel(QScrollArea):
         self._agent_section.add_row("", self.load_agent_btn)
 
         self.addWidget(self._general_section)
+        self.addWidget(self._rendering_section)
         self.addWidget(self._map_section)
         self.addWidget(self._vehicle_section)
         self.addWidget(self._agent_section)
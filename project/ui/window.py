@@ -3,6 +3,7 @@ from PySide6.QtGui import *
 from PySide6.QtWidgets import *
 
 from project import enums
+from project.curriculum import AdaptiveCurriculum, FixedCurriculum
 from project.environment import Environment
 from project.ui.canvas import Canvas
 from project.ui.panel import Panel
@@ -19,6 +20,7 @@ class MainWindow(QMainWindow):
 
         self._env: Environment = environment
         self._is_running: bool = False
+        self._seen_version: int = -1  # The environment's state version the interface last showed
 
         self.panel: Panel = Panel()
         self.canvas: Canvas = Canvas(self._env, self._is_running)
@@ -27,6 +29,7 @@ class MainWindow(QMainWindow):
 
         self._setup_panel_values()
         self._connect_panel_widgets()
+        self._panel_updaters = self._create_panel_updaters()
         self._env_runner.timeout.connect(self._tick)
         self._ui_updater.timeout.connect(self._update_ui)
         self._ui_updater.start(1000 / 60)  # Canvas updates per second, adjust the denominator to the desired FPS.
@@ -43,31 +46,54 @@ class MainWindow(QMainWindow):
         self._env_runner.start(self._env.tick_interval)
 
     def _update_ui(self):
-        self._block_panel_signals(QCheckBox, True)
-        self._block_panel_signals(QSpinBox, True)
-
-        self.panel.run_simulation_checkbox.setChecked(self._is_running)
-        self.panel.auto_reset_checkbox.setChecked(self._env.auto_reset)
-        self.panel.map_size_spinbox.setValue(self._env.get_map_size())
-        self.panel.regen_n_runs_checkbox.setChecked(self._env.regen_n_runs_enabled)
-        self.panel.regen_n_runs_spinbox.setEnabled(self._env.regen_n_runs_enabled)
-        self.panel.regen_n_runs_spinbox.setValue(self._env.regen_n_runs)
-        self.panel.resize_n_regens_checkbox.setChecked(self._env.resize_n_regens_enabled)
-        self.panel.resize_n_regens_spinbox.setEnabled(self._env.resize_n_regens_enabled)
-        self.panel.resize_n_regens_spinbox.setValue(self._env.resize_n_regens)
-        self.panel.dynamic_mutation_checkbox.setChecked(self._env.dynamic_mutation)
-        self.panel.mutation_chance_spinbox.setDisabled(self._env.dynamic_mutation)
-        self.panel.mutation_chance_spinbox.setValue(self._env.mutation_chance)
-        self.panel.mutation_rate_spinbox.setValue(self._env.mutation_rate)
-        self.canvas.is_running = self._is_running
-
-        self._block_panel_signals(QCheckBox, False)
-        self._block_panel_signals(QSpinBox, False)
-
-        self.panel.learning_mode_checkbox.setChecked(self._env.learning_mode)
-
+        # Only refresh the widgets whose values changed, and only repaint when the environment changed
+        changed = self._env.changed_since(self._seen_version)
+        if not changed:
+            return
+        self._seen_version = self._env.state_version
+
+        for name in changed:
+            if updater := self._panel_updaters.get(name):
+                updater()
         self.canvas.update()
 
+    def _create_panel_updaters(self) -> dict:
+        # Functions that show the environment's value of an observed name in the panel, without emitting signals
+        env, panel = self._env, self.panel
+
+        def quietly(setter, value):
+            with QSignalBlocker(setter.__self__):
+                setter(value)
+
+        def regen_n_runs_enabled():
+            quietly(panel.regen_n_runs_checkbox.setChecked, env.regen_n_runs_enabled)
+            panel.regen_n_runs_spinbox.setEnabled(env.regen_n_runs_enabled)
+
+        def resize_n_regens_enabled():
+            quietly(panel.resize_n_regens_checkbox.setChecked, env.resize_n_regens_enabled)
+            panel.resize_n_regens_spinbox.setEnabled(env.resize_n_regens_enabled)
+
+        def dynamic_mutation():
+            quietly(panel.dynamic_mutation_checkbox.setChecked, env.dynamic_mutation)
+            panel.mutation_chance_spinbox.setDisabled(env.dynamic_mutation)
+
+        return {
+            "tick_interval": lambda: quietly(panel.tick_interval_spinbox.setValue, env.tick_interval),
+            "ticks_per_run": lambda: quietly(panel.ticks_per_gen_spinbox.setValue, env.ticks_per_run),
+            "learning_mode": lambda: panel.learning_mode_checkbox.setChecked(env.learning_mode),  # Locks widgets
+            "auto_reset": lambda: quietly(panel.auto_reset_checkbox.setChecked, env.auto_reset),
+            "map_size": lambda: quietly(panel.map_size_spinbox.setValue, env.get_map_size()),
+            "regen_n_runs_enabled": regen_n_runs_enabled,
+            "regen_n_runs": lambda: quietly(panel.regen_n_runs_spinbox.setValue, env.regen_n_runs),
+            "resize_n_regens_enabled": resize_n_regens_enabled,
+            "resize_n_regens": lambda: quietly(panel.resize_n_regens_spinbox.setValue, env.resize_n_regens),
+            "dynamic_mutation": dynamic_mutation,
+            "mutation_chance": lambda: quietly(panel.mutation_chance_spinbox.setValue, env.mutation_chance),
+            "mutation_rate": lambda: quietly(panel.mutation_rate_spinbox.setValue, env.mutation_rate),
+            "curriculum": lambda: quietly(panel.adaptive_curriculum_checkbox.setChecked,
+                                          isinstance(env.curriculum, AdaptiveCurriculum))
+        }
+
     def _update_runner(self, condition: bool):
         if condition:
             self._env_runner.stop()
@@ -76,6 +102,12 @@ class MainWindow(QMainWindow):
             self._env_runner.start(self._env.tick_interval)
             self._is_running = True
 
+        # The running state belongs to the interface, so it isn't versioned by the environment
+        with QSignalBlocker(self.panel.run_simulation_checkbox):
+            self.panel.run_simulation_checkbox.setChecked(self._is_running)
+        self.canvas.is_running = self._is_running
+        self.canvas.update()
+
     def eventFilter(self, watched: QObject, event: QKeyEvent) -> bool:
         if event.type() in [QEvent.KeyPress, QEvent.KeyRelease]:
             event_type = event.type()
@@ -114,6 +146,21 @@ class MainWindow(QMainWindow):
     def _on_auto_reset_changed(self, check: int):
         self._env.auto_reset = bool(check)
 
+    def _on_show_metrics_changed(self, check: int):
+        self.canvas.show_metrics = bool(check)
+        self.canvas.update()
+
+    def _on_detail_count_changed(self, value: int):
+        self.canvas.detail_count = value
+        self.canvas.update()
+
+    def _on_heatmap_changed(self, check: int):
+        self.canvas.heatmap = bool(check)
+        self.canvas.update()
+
+    def _on_frame_budget_changed(self, value: int):
+        self.canvas.frame_budget = value
+
     def _on_map_size_changed(self, value: int):
         self._env.change_map_size(value)
 
@@ -131,20 +178,23 @@ class MainWindow(QMainWindow):
     def _on_resize_n_regens_changed(self, value: int):
         self._env.resize_n_regens = value
 
+    def _on_adaptive_curriculum_changed(self, check: int):
+        self._env.curriculum = AdaptiveCurriculum() if check else FixedCurriculum()
+
     def _on_regenerate(self):
         self._env.regenerate_map()
 
     def _on_sensor_length_changed(self, value: int):
-        enums.SENSOR_LENGTH = value
+        self._env.set_physics("SENSOR_LENGTH", value)
 
     def _on_max_speed_changed(self, value: int):
-        enums.VEHICLE_MAXSPEED = value
+        self._env.set_physics("VEHICLE_MAXSPEED", value)
 
     def _on_dspeed_changed(self, value: float):
-        enums.VEHICLE_DSPEED = value
+        self._env.set_physics("VEHICLE_DSPEED", value)
 
     def _on_dangle_changed(self, value: int):
-        enums.VEHICLE_DANGLE = value
+        self._env.set_physics("VEHICLE_DANGLE", value)
 
     def _on_reset_vehicle(self):
         self._env.reset_vehicles()
@@ -164,10 +214,10 @@ class MainWindow(QMainWindow):
         self._env.end_current_run(True, True)
 
     def _on_save_best_model(self):
-        self._env.save_best_agent(self._env.AGENTS_DIR)
+        self._env.save_best_agent(self._env.agents_dir)
 
     def _on_load_model(self):
-        dialog = QFileDialog(self, "Select Python pickle file", self._env.AGENTS_DIR, "Python Pickles (*.pickle)")
+        dialog = QFileDialog(self, "Select Python pickle file", self._env.agents_dir, "Python Pickles (*.pickle)")
         dialog.setAcceptMode(QFileDialog.AcceptMode.AcceptOpen)
 
         if dialog.exec():
@@ -182,9 +232,17 @@ class MainWindow(QMainWindow):
         self.panel.ticks_per_gen_spinbox.setSingleStep(50)
         self.panel.ticks_per_gen_spinbox.setValue(self._env.ticks_per_run)
         self.panel.auto_reset_checkbox.setChecked(self._env.auto_reset)
+        self.panel.show_metrics_checkbox.setChecked(self.canvas.show_metrics)
+
+        # Rendering
+        self.panel.detail_count_spinbox.setRange(0, 1000)
+        self.panel.detail_count_spinbox.setValue(self.canvas.detail_count)
+        self.panel.heatmap_checkbox.setChecked(self.canvas.heatmap)
+        self.panel.frame_budget_spinbox.setRange(1, 100)
+        self.panel.frame_budget_spinbox.setValue(int(self.canvas.frame_budget))
 
         # Map
-        self.panel.map_size_spinbox.setRange(3, 11)
+        self.panel.map_size_spinbox.setRange(enums.MIN_MAP_SIZE, enums.MAX_MAP_SIZE)
         self.panel.regen_n_runs_checkbox.setChecked(self._env.regen_n_runs_enabled)
         self.panel.regen_n_runs_spinbox.setRange(1, 50)
         self.panel.regen_n_runs_spinbox.setSingleStep(1)
@@ -196,6 +254,7 @@ class MainWindow(QMainWindow):
         self.panel.resize_n_regens_spinbox.setValue(self._env.resize_n_regens)
         self.panel.resize_n_regens_spinbox.setEnabled(self.panel.resize_n_regens_checkbox.isChecked())
         self.panel.map_size_spinbox.setValue(self._env.get_map_size())
+        self.panel.adaptive_curriculum_checkbox.setChecked(isinstance(self._env.curriculum, AdaptiveCurriculum))
 
         # Vehicle
         self.panel.sensor_length_spinbox.setRange(10, enums.CANVAS_SIZE)
@@ -225,6 +284,12 @@ class MainWindow(QMainWindow):
         self.panel.ticks_per_gen_spinbox.valueChanged.connect(self._on_ticks_until_nextgen_changed)
         self.panel.learning_mode_checkbox.stateChanged.connect(self._on_learning_mode_changed)
         self.panel.auto_reset_checkbox.stateChanged.connect(self._on_auto_reset_changed)
+        self.panel.show_metrics_checkbox.stateChanged.connect(self._on_show_metrics_changed)
+
+        # Rendering
+        self.panel.detail_count_spinbox.valueChanged.connect(self._on_detail_count_changed)
+        self.panel.heatmap_checkbox.stateChanged.connect(self._on_heatmap_changed)
+        self.panel.frame_budget_spinbox.valueChanged.connect(self._on_frame_budget_changed)
 
         # Map
         self.panel.map_size_spinbox.valueChanged.connect(self._on_map_size_changed)
@@ -232,6 +297,7 @@ class MainWindow(QMainWindow):
         self.panel.regen_n_runs_spinbox.valueChanged.connect(self._on_regen_n_runs_changed)
         self.panel.resize_n_regens_checkbox.stateChanged.connect(self._on_resize_n_regens_checked)
         self.panel.resize_n_regens_spinbox.valueChanged.connect(self._on_resize_n_regens_changed)
+        self.panel.adaptive_curriculum_checkbox.stateChanged.connect(self._on_adaptive_curriculum_changed)
         self.panel.regenerate_btn.clicked.connect(self._on_regenerate)
 
         # Vehicle
@@ -260,7 +326,3 @@ class MainWindow(QMainWindow):
         self.quit_shortcut = QShortcut(QKeySequence("Ctrl+Q"), self)
         self.close_shortcut = QShortcut(QKeySequence("Ctrl+W"), self)
         self.close_shortcut.activated.connect(self.close)
-
-    def _block_panel_signals(self, widget_type: type, block: bool):
-        for widget in self.panel.findChildren(widget_type):
-            widget.blockSignals(block)
@@ -1,5 +1,8 @@
+import csv
 import math
 
+import numpy as np
+
 from project.types import *
 
 
@@ -48,6 +51,41 @@ def intersects(line1: Line, line2: Line) -> Point | None:
     return x, y
 
 
+def axis_aligned_intersections(lines: np.ndarray, walls: np.ndarray, pairwise: bool = False) -> np.ndarray:
+    """
+    Calculates where each of the lines intersects each of the walls, like intersects() but for many lines and walls at
+    once. The walls must all be horizontal or vertical. The result only depends on the line at which a wall lies, not
+    on its length, so collinear walls give exactly the same intersections whether they are merged or not.
+
+    Parameters
+    ----------
+    lines: np.ndarray
+        An (n, 4) array of lines as x1, y1, x2, y2.
+    walls: np.ndarray
+        An (m, 4) array of horizontal or vertical walls as x1, y1, x2, y2.
+    pairwise: bool
+        Only intersect each line with the wall in the same row, in which case m must equal n.
+
+    Returns
+    -------
+    np.ndarray
+        An (n, m) array of the fraction along each line at which it intersects each wall, or NaN where it doesn't.
+        The intersection point is (x1 + ua * (x2 - x1), y1 + ua * (y2 - y1)). An (n,) array if pairwise.
+    """
+    x1, y1, x2, y2 = lines.T if pairwise else (lines[:, i, None] for i in range(4))
+    wall_x1, wall_y1, wall_x2, wall_y2 = walls.T
+    horizontal = wall_y1 == wall_y2
+
+    with np.errstate(divide="ignore", invalid="ignore"):  # Lines parallel to a wall give inf or NaN, i.e. no hit
+        ua = np.where(horizontal, (wall_y1 - y1) / (y2 - y1), (wall_x1 - x1) / (x2 - x1))
+        along = np.where(horizontal, x1 + ua * (x2 - x1), y1 + ua * (y2 - y1))  # Position along the wall
+        low = np.where(horizontal, np.minimum(wall_x1, wall_x2), np.minimum(wall_y1, wall_y2))
+        high = np.where(horizontal, np.maximum(wall_x1, wall_x2), np.maximum(wall_y1, wall_y2))
+        hits = (0 < ua) & (ua < 1) & (low < along) & (along < high)
+
+    return np.where(hits, ua, np.nan)
+
+
 def calculate_borders(top_left: Point, width: float, height: float) -> list[Line]:
     """
     Calculates the borders lines of a square/rectangle with the given top left point. The returned list of lines
@@ -106,3 +144,12 @@ def normalise_arr(arr: list[float]):
     is the largest.
     """
     return [normalise(value, arr) for value in arr]
+
+
+def write_csv(path: str, rows: list):
+    """
+    Writes the given rows into a space delimited CSV file.
+    """
+    with open(path, "w") as file:
+        writer = csv.writer(file, delimiter=" ")
+        writer.writerows(rows)